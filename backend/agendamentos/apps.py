@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AgendamentosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'agendamentos'
+
+    def ready(self):
+        # Conecta os sinais que invalidam os mapas de ocupação em cache
+        from . import signals  # noqa: F401
@@ -0,0 +1,162 @@
+# backend/agendamentos/calendario.py
+"""
+Feed do calendário (FullCalendar) por janela de datas.
+
+Em vez de serializar todo o histórico da clínica, devolvemos apenas os
+eventos que tocam a janela [start, end), paginados por cursor (keyset) em
+(data_hora_inicio, id) e montados com .values() — sem instanciar models nem
+passar pelo AgendamentoSerializer. O ETag é derivado da última alteração
+da janela, para que o navegador receba 304 quando nada mudou.
+
+Os eventos também trazem nomes de tabelas relacionadas. Pacientes têm
+data_atualizacao, que entra no ETag. Salas, médicos, especialidades e
+procedimentos não têm; por isso, os sinais em agendamentos/signals.py
+incrementam uma versão no cache quando eles mudam, e ela também entra no ETag.
+"""
+
+import base64
+import hashlib
+from datetime import datetime, time
+from time import time_ns
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Agendamento
+
+LIMITE_PADRAO = 500
+LIMITE_MAXIMO = 2000
+
+CHAVE_VERSAO_NOMES = 'agendamentos:calendario:versao_nomes'
+
+CAMPOS_EVENTO = (
+    'id', 'data_hora_inicio', 'data_hora_fim', 'status', 'tipo_agendamento', 'modalidade',
+    'paciente_id', 'paciente__nome_completo',
+    'medico_id', 'medico__first_name', 'medico__last_name',
+    'especialidade__nome', 'procedimento__descricao',
+    'sala_id', 'sala__nome',
+)
+
+
+class ParametroInvalido(ValueError):
+    pass
+
+
+def interpretar_limite_da_janela(valor):
+    """Aceita datetime ISO (com ou sem fuso) ou apenas a data (meia-noite local)."""
+    momento = parse_datetime(valor.replace(' ', '+')) if valor else None
+    if momento is None and valor:
+        data = parse_date(valor[:10])
+        if data:
+            momento = datetime.combine(data, time.min)
+    if momento is None:
+        raise ParametroInvalido(f"Data inválida: {valor!r}. Use o formato ISO 8601.")
+    if timezone.is_naive(momento):
+        momento = timezone.make_aware(momento)
+    return momento
+
+
+def codificar_cursor(data_hora_inicio, agendamento_id):
+    bruto = f"{data_hora_inicio.isoformat()}|{agendamento_id}".encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        inicio_str, id_str = bruto.rsplit('|', 1)
+        inicio = parse_datetime(inicio_str)
+        if inicio is None:
+            raise ValueError
+        return inicio, int(id_str)
+    except (ValueError, UnicodeDecodeError):
+        raise ParametroInvalido("Cursor inválido.")
+
+
+def queryset_da_janela(inicio, fim, sala_id=None, medico_id=None):
+    queryset = Agendamento.objects.filter(data_hora_inicio__lt=fim, data_hora_fim__gt=inicio)
+    if sala_id:
+        queryset = queryset.filter(sala_id=sala_id)
+    if medico_id:
+        queryset = queryset.filter(medico_id=medico_id)
+    return queryset
+
+
+def versao_nomes():
+    """Versão dos nomes de salas, médicos, especialidades e procedimentos."""
+    atual = cache.get(CHAVE_VERSAO_NOMES)
+    if atual is None:
+        # Cache vazio: começa de um valor que nenhum ETag já emitido usou
+        cache.add(CHAVE_VERSAO_NOMES, time_ns(), None)
+        atual = cache.get(CHAVE_VERSAO_NOMES)
+    return atual
+
+
+def _incrementar_versao_nomes():
+    try:
+        cache.incr(CHAVE_VERSAO_NOMES)
+    except ValueError:
+        cache.add(CHAVE_VERSAO_NOMES, time_ns(), None)
+
+
+def invalidar_nomes():
+    """Muda os ETags de todas as janelas (depois do commit, se houver transação)."""
+    transaction.on_commit(_incrementar_versao_nomes)
+
+
+def calcular_etag(queryset, *partes):
+    """
+    ETag fraco a partir da última data_atualizacao dos agendamentos e dos
+    pacientes da janela, da quantidade de agendamentos (a contagem pega
+    remoções, que não mexem no máximo) e da versão dos nomes.
+    """
+    resumo = queryset.aggregate(
+        ultima=Max('data_atualizacao'), paciente=Max('paciente__data_atualizacao'), total=Count('id')
+    )
+    datas = [resumo[campo].isoformat() if resumo[campo] else '-' for campo in ('ultima', 'paciente')]
+    chave = '|'.join(datas + [str(resumo['total']), str(versao_nomes())] + [str(parte) for parte in partes])
+    return 'W/"%s"' % hashlib.md5(chave.encode()).hexdigest()
+
+
+def _evento(linha):
+    medico_nome = ' '.join(filter(None, [linha['medico__first_name'], linha['medico__last_name']])) or None
+    return {
+        'id': linha['id'],
+        'data_hora_inicio': timezone.localtime(linha['data_hora_inicio']).isoformat(),
+        'data_hora_fim': timezone.localtime(linha['data_hora_fim']).isoformat(),
+        'status': linha['status'],
+        'tipo_agendamento': linha['tipo_agendamento'],
+        'modalidade': linha['modalidade'],
+        'paciente': linha['paciente_id'],
+        'paciente_nome': linha['paciente__nome_completo'],
+        'medico': linha['medico_id'],
+        'medico_nome': medico_nome,
+        'especialidade_nome': linha['especialidade__nome'],
+        'procedimento_descricao': linha['procedimento__descricao'],
+        'sala': linha['sala_id'],
+        'sala_nome': linha['sala__nome'],
+    }
+
+
+def montar_pagina(queryset, cursor=None, limite=LIMITE_PADRAO):
+    """
+    Uma página de eventos ordenada por (data_hora_inicio, id). Busca
+    `limite + 1` linhas só para saber se existe próxima página.
+    """
+    if cursor:
+        cursor_inicio, cursor_id = decodificar_cursor(cursor)
+        queryset = queryset.filter(
+            Q(data_hora_inicio__gt=cursor_inicio) | Q(data_hora_inicio=cursor_inicio, id__gt=cursor_id)
+        )
+
+    linhas = list(queryset.order_by('data_hora_inicio', 'id').values(*CAMPOS_EVENTO)[:limite + 1])
+    proximo_cursor = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        ultima = linhas[-1]
+        proximo_cursor = codificar_cursor(ultima['data_hora_inicio'], ultima['id'])
+
+    return {'results': [_evento(linha) for linha in linhas], 'next_cursor': proximo_cursor}
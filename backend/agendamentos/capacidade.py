@@ -0,0 +1,113 @@
+# backend/agendamentos/capacidade.py
+"""
+Verificação de capacidade das salas à prova de concorrência.
+
+A validação do serializer (mapas de ocupação em cache) é só uma checagem
+rápida: duas reservas simultâneas podem passar por ela. A checagem que vale
+é feita aqui, dentro da transação que grava o agendamento, depois de travar
+a sala naquele(s) dia(s):
+
+- Postgres: pg_advisory_xact_lock(sala_id, dia) — só reservas da MESMA sala
+  no MESMO dia esperam umas pelas outras; as demais seguem em paralelo.
+- Outros bancos: select_for_update na linha da Sala.
+
+Com a trava, uma única query com agregação condicional conta as consultas e
+procedimentos que se sobrepõem ao intervalo.
+"""
+
+from django.db import connection
+from django.db.models import Count, Q
+
+from .models import Agendamento, Sala
+from . import ocupacao
+
+CAPACIDADE_POR_TIPO = {
+    'Consulta': 3,
+    'Procedimento': 1,
+}
+
+
+class CapacidadeExcedida(Exception):
+    pass
+
+
+def mensagem_capacidade_excedida(tipo_agendamento):
+    capacidade = CAPACIDADE_POR_TIPO[tipo_agendamento]
+    if tipo_agendamento == 'Consulta':
+        return f"A capacidade máxima de {capacidade} consultas para esta sala e horário já foi atingida."
+    return f"A capacidade máxima de {capacidade} procedimento(s) para esta sala e horário já foi atingida."
+
+
+def contar_sobreposicoes(inicio, fim, sala_id=None, excluir_pk=None):
+    """
+    Agendamentos não cancelados que se sobrepõem a [inicio, fim), por tipo,
+    em uma única query (agregação condicional).
+    """
+    conflitos = Agendamento.objects.filter(
+        data_hora_inicio__lt=fim,
+        data_hora_fim__gt=inicio,
+    ).exclude(status='Cancelado')
+    if sala_id:
+        conflitos = conflitos.filter(sala_id=sala_id)
+    if excluir_pk:
+        conflitos = conflitos.exclude(pk=excluir_pk)
+
+    return conflitos.aggregate(
+        Consulta=Count('id', filter=Q(tipo_agendamento='Consulta')),
+        Procedimento=Count('id', filter=Q(tipo_agendamento='Procedimento')),
+    )
+
+
+def _pico_simultaneo(sala_id, inicio, fim, tipo_agendamento, excluir_pk=None):
+    """
+    Maior número de agendamentos do tipo ocorrendo ao mesmo tempo dentro de
+    [inicio, fim) — mesma regra dos mapas de ocupação usados na validação.
+    """
+    linhas = Agendamento.objects.filter(
+        sala_id=sala_id,
+        tipo_agendamento=tipo_agendamento,
+        data_hora_inicio__lt=fim,
+        data_hora_fim__gt=inicio,
+    ).exclude(status='Cancelado').exclude(pk=excluir_pk).values_list('data_hora_inicio', 'data_hora_fim')
+
+    eventos = []
+    for ag_inicio, ag_fim in linhas:
+        eventos.append((max(ag_inicio, inicio), 1))
+        eventos.append((min(ag_fim, fim), -1))
+    # Término antes de início no mesmo instante: agendamentos encostados não se sobrepõem
+    eventos.sort(key=lambda evento: (evento[0], evento[1]))
+
+    atual = pico = 0
+    for _, delta in eventos:
+        atual += delta
+        pico = max(pico, atual)
+    return pico
+
+
+def travar_sala(sala_id, inicio, fim):
+    """Trava a sala nos dias tocados pelo intervalo até o fim da transação atual."""
+    if connection.vendor == 'postgresql':
+        dias = sorted({data.toordinal() for data in ocupacao.datas_do_intervalo(inicio, fim)})
+        with connection.cursor() as cursor:
+            for dia in dias:  # sempre na mesma ordem, para não haver deadlock
+                cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [sala_id, dia])
+    else:
+        list(Sala.objects.select_for_update().filter(pk=sala_id).values_list('pk', flat=True))
+
+
+def garantir_capacidade(sala_id, inicio, fim, tipo_agendamento, excluir_pk=None):
+    """
+    Deve ser chamada dentro de transaction.atomic(), imediatamente antes de
+    gravar o agendamento. Levanta CapacidadeExcedida se a sala estiver cheia.
+    """
+    if not sala_id or tipo_agendamento not in CAPACIDADE_POR_TIPO or not inicio or not fim:
+        return
+
+    travar_sala(sala_id, inicio, fim)
+
+    capacidade = CAPACIDADE_POR_TIPO[tipo_agendamento]
+    sobrepostos = contar_sobreposicoes(inicio, fim, sala_id, excluir_pk)[tipo_agendamento]
+    # Se nem somando todas as sobreposições a capacidade é atingida, não há
+    # por que calcular o pico; só no caso limite buscamos os horários exatos.
+    if sobrepostos >= capacidade and _pico_simultaneo(sala_id, inicio, fim, tipo_agendamento, excluir_pk) >= capacidade:
+        raise CapacidadeExcedida(mensagem_capacidade_excedida(tipo_agendamento))
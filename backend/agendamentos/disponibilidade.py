@@ -0,0 +1,195 @@
+# backend/agendamentos/disponibilidade.py
+"""
+Motor de disponibilidade.
+
+Em vez de consultar o banco uma vez por slot, carregamos as jornadas e os
+mapas de ocupação (agendamentos.ocupacao) dos dias da janela de busca e
+calculamos os horários livres em memória com operações de bits.
+"""
+
+import heapq
+from datetime import datetime, timedelta, time
+
+from django.utils import timezone
+
+from . import ocupacao
+
+INTERVALO_SLOT_MINUTOS = 30   # Um slot a cada 30 minutos
+DURACAO_SLOT_MINUTOS = 50     # Duração considerada para detectar conflitos
+DIAS_BUSCA = 90               # Horizonte padrão de busca
+
+# Jornada fixa da sala de procedimentos: Segunda a Sábado, 8h às 18h
+GRADE_SALA_PROCEDIMENTOS = {dia: [(time(8, 0), time(18, 0))] for dia in range(6)}
+
+
+def carregar_grades_medicos(medico_ids):
+    """
+    Retorna {medico_id: grade} com as jornadas ativas de cada médico agrupadas
+    por dia da semana (Segunda=0 ... Domingo=6, mesmo padrão de
+    JornadaDeTrabalho.DiaSemana). Uma única query para todos os médicos;
+    médicos sem jornada ativa ficam de fora.
+    """
+    from usuarios.models import JornadaDeTrabalho
+
+    grades = {}
+    jornadas = JornadaDeTrabalho.objects.filter(
+        medico_id__in=list(medico_ids),
+        medico__cargo='medico',
+        ativo=True
+    ).values_list('medico_id', 'dia_da_semana', 'hora_inicio', 'hora_fim').order_by('dia_da_semana', 'hora_inicio')
+
+    for medico_id, dia, hora_inicio, hora_fim in jornadas:
+        grades.setdefault(medico_id, {}).setdefault(dia, []).append((hora_inicio, hora_fim))
+    return grades
+
+
+def carregar_grade_medico(medico_id):
+    """Grade de um único médico. Retorna um dicionário vazio se o médico não existir."""
+    return carregar_grades_medicos([medico_id]).get(medico_id, {})
+
+
+def janela_de_busca(data_inicial=None):
+    """Retorna (agora, primeira_data) em horário local."""
+    agora = timezone.localtime(timezone.now())
+    primeira_data = max(data_inicial, agora.date()) if data_inicial else agora.date()
+    return agora, primeira_data
+
+
+def datas_da_grade(grade, primeira_data, dias=DIAS_BUSCA):
+    """Dias da janela em que existe jornada."""
+    datas = (primeira_data + timedelta(days=i) for i in range(dias))
+    return [data for data in datas if grade.get(data.weekday())]
+
+
+def iterar_slots_livres(grade, livre, primeira_data, agora, dias=DIAS_BUSCA,
+                        intervalo_minutos=INTERVALO_SLOT_MINUTOS, duracao_minutos=DURACAO_SLOT_MINUTOS):
+    """
+    Gera, em ordem crescente, os inícios (datetime aware) dos slots livres.
+    `grade` mapeia dia da semana -> lista de (hora_inicio, hora_fim) e
+    `livre(inicio, fim)` diz se o intervalo está desocupado.
+    """
+    passo = timedelta(minutes=intervalo_minutos)
+    duracao = timedelta(minutes=duracao_minutos)
+    fuso = timezone.get_default_timezone()
+
+    for i in range(dias):
+        data_atual = primeira_data + timedelta(days=i)
+        turnos = grade.get(data_atual.weekday())
+        if not turnos:
+            continue
+
+        inicios_do_dia = set()
+        for hora_inicio, hora_fim in turnos:
+            slot = datetime.combine(data_atual, hora_inicio)
+            while slot.date() == data_atual and slot.time() < hora_fim:
+                inicios_do_dia.add(slot)
+                slot += passo
+
+        for slot in sorted(inicios_do_dia):
+            slot_aware = timezone.make_aware(slot, fuso)
+            if slot_aware <= agora:
+                continue
+            if livre(slot_aware, slot_aware + duracao):
+                yield slot_aware
+
+
+def slots_livres_medico(medico_id, data_inicial=None, dias=DIAS_BUSCA):
+    """Gerador de slots livres do médico usando os mapas de ocupação em cache."""
+    grade = carregar_grade_medico(medico_id)
+    if not grade:
+        return None
+    agora, primeira_data = janela_de_busca(data_inicial)
+    mapas = ocupacao.carregar_mapas('medico', [medico_id], datas_da_grade(grade, primeira_data, dias))
+    return iterar_slots_livres(
+        grade,
+        lambda inicio, fim: ocupacao.medico_livre(mapas, medico_id, inicio, fim),
+        primeira_data, agora, dias
+    )
+
+
+def _slots_do_medico(medico_id, grade, mapas, primeira_data, agora, dias):
+    livres = iterar_slots_livres(
+        grade,
+        lambda inicio, fim: ocupacao.medico_livre(mapas, medico_id, inicio, fim),
+        primeira_data, agora, dias
+    )
+    return ((slot, medico_id) for slot in livres)
+
+
+def slots_livres_medicos(medico_ids, data_inicial=None, dias=DIAS_BUSCA):
+    """
+    Gerador de (slot, medico_id) em ordem cronológica para vários médicos.
+    Carrega as grades e os mapas de todos de uma vez (duas queries no máximo)
+    e faz um merge k-way (heapq.merge) dos geradores de cada médico, então
+    só é calculado o necessário para produzir os primeiros slots pedidos.
+    """
+    grades = carregar_grades_medicos(medico_ids)
+    agora, primeira_data = janela_de_busca(data_inicial)
+    datas = set()
+    for grade in grades.values():
+        datas.update(datas_da_grade(grade, primeira_data, dias))
+    mapas = ocupacao.carregar_mapas('medico', list(grades), datas)
+    return heapq.merge(*(
+        _slots_do_medico(medico_id, grade, mapas, primeira_data, agora, dias)
+        for medico_id, grade in grades.items()
+    ))
+
+
+def slots_livres_sala_procedimentos(sala_id, data_inicial=None, dias=DIAS_BUSCA):
+    """Gerador de slots livres da sala de procedimentos (1 procedimento por vez)."""
+    agora, primeira_data = janela_de_busca(data_inicial)
+    mapas = ocupacao.carregar_mapas('sala', [sala_id], datas_da_grade(GRADE_SALA_PROCEDIMENTOS, primeira_data, dias))
+    return iterar_slots_livres(
+        GRADE_SALA_PROCEDIMENTOS,
+        lambda inicio, fim: ocupacao.ocupacao_maxima_sala(mapas, sala_id, inicio, fim, 'Procedimento') == 0,
+        primeira_data, agora, dias
+    )
+
+
+def primeiro_dia_com_horarios(slots):
+    """
+    Consome o gerador de slots livres até o fim do primeiro dia que tiver
+    horários e devolve no formato esperado pelo chatbot.
+    """
+    data_encontrada = None
+    horarios = []
+    for slot in slots:
+        slot_local = timezone.localtime(slot)
+        if data_encontrada is None:
+            data_encontrada = slot_local.date()
+        elif slot_local.date() != data_encontrada:
+            break
+        horarios.append(slot_local.strftime('%H:%M'))
+
+    if data_encontrada is None:
+        return None
+    return {
+        "data": data_encontrada.strftime('%Y-%m-%d'),
+        "horarios_disponiveis": horarios
+    }
+
+
+def primeiro_medico_com_horarios(slots_medicos):
+    """
+    Recebe o gerador de slots_livres_medicos e devolve (medico_id, horarios)
+    do médico com o horário mais cedo, com todos os horários dele naquele dia
+    (no mesmo formato de primeiro_dia_com_horarios), ou (None, None).
+    """
+    medico_encontrado = None
+    data_encontrada = None
+    horarios = []
+    for slot, medico_id in slots_medicos:
+        slot_local = timezone.localtime(slot)
+        if medico_encontrado is None:
+            medico_encontrado, data_encontrada = medico_id, slot_local.date()
+        elif slot_local.date() != data_encontrada:
+            break
+        if medico_id == medico_encontrado:
+            horarios.append(slot_local.strftime('%H:%M'))
+
+    if medico_encontrado is None:
+        return None, None
+    return medico_encontrado, {
+        "data": data_encontrada.strftime('%Y-%m-%d'),
+        "horarios_disponiveis": horarios
+    }
@@ -0,0 +1,168 @@
+# backend/agendamentos/expiracao.py
+"""
+Expiração de agendamentos não pagos (status 'Agendado' com expira_em).
+
+- cancelar_expirados(): um único UPDATE ... RETURNING cancela, pelo índice
+  parcial agendamento_expiracao_idx, só o que já venceu (custo proporcional
+  aos expirados, não a todos os pendentes) e, na mesma transação, passa os
+  Pagamentos pendentes desses agendamentos para 'Expirado'.
+- RodaDeTempo + executar_continuamente(): modo opcional, em processo, que
+  dispara a expiração no segundo do prazo em vez de esperar o próximo cron.
+"""
+
+import logging
+import sqlite3
+import time as relogio
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Agendamento
+from . import ocupacao
+
+logger = logging.getLogger(__name__)
+
+
+def _suporta_returning():
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 35)
+
+
+def _cancelar_com_returning(agora):
+    tabela = connection.ops.quote_name(Agendamento._meta.db_table)
+    sql = f"""
+        UPDATE {tabela}
+           SET status = %s, data_atualizacao = %s
+         WHERE status = %s AND expira_em IS NOT NULL AND expira_em <= %s
+     RETURNING id, medico_id, sala_id, data_hora_inicio, data_hora_fim
+    """
+    # Como o ORM faz com DateTimeField: no sqlite a data é gravada e comparada
+    # como texto em UTC, sem fuso; o datetime cru não casaria com esse formato
+    agora = connection.ops.adapt_datetimefield_value(agora)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, ['Cancelado', agora, 'Agendado', agora])
+        linhas = cursor.fetchall()
+
+    if connection.vendor == 'sqlite':
+        # No sqlite o RETURNING devolve as datas como texto em UTC, sem fuso
+        def converter(valor):
+            if isinstance(valor, str):
+                valor = parse_datetime(valor)
+            return timezone.make_aware(valor, dt_timezone.utc) if timezone.is_naive(valor) else valor
+        linhas = [(ag_id, medico_id, sala_id, converter(inicio), converter(fim)) for ag_id, medico_id, sala_id, inicio, fim in linhas]
+    return linhas
+
+
+def _cancelar_sem_returning(agora):
+    vencidos = Agendamento.objects.select_for_update().filter(
+        status='Agendado', expira_em__isnull=False, expira_em__lte=agora
+    )
+    linhas = list(vencidos.values_list('id', 'medico_id', 'sala_id', 'data_hora_inicio', 'data_hora_fim'))
+    Agendamento.objects.filter(id__in=[linha[0] for linha in linhas]).update(status='Cancelado', data_atualizacao=agora)
+    return linhas
+
+
+def cancelar_expirados(agora=None):
+    """
+    Cancela os agendamentos vencidos e expira os pagamentos pendentes deles.
+    Retorna a lista de ids cancelados.
+    """
+    from faturamento.models import Pagamento
+
+    agora = agora or timezone.now()
+    with transaction.atomic():
+        linhas = _cancelar_com_returning(agora) if _suporta_returning() else _cancelar_sem_returning(agora)
+        ids = [linha[0] for linha in linhas]
+        if ids:
+            Pagamento.objects.filter(agendamento_id__in=ids, status='Pendente').update(status='Expirado')
+            # update() não dispara sinais: invalidamos os mapas de ocupação aqui
+            for _, medico_id, sala_id, inicio, fim in linhas:
+                ocupacao.invalidar(medico_id, sala_id, inicio, fim)
+    return ids
+
+
+def proximos_prazos(ate):
+    """(id, expira_em) dos pendentes que vencem até `ate`, pelo índice parcial."""
+    return Agendamento.objects.filter(
+        status='Agendado', expira_em__isnull=False, expira_em__lte=ate
+    ).values_list('id', 'expira_em')
+
+
+class RodaDeTempo:
+    """
+    Timing wheel simples: `tamanho` casas de `tick` segundos. Cada prazo cai
+    na casa (tick do prazo % tamanho) com o número de voltas que faltam;
+    avançar a roda custa O(casas percorridas + itens vencidos).
+    """
+
+    def __init__(self, tick=1, tamanho=512, inicio=None):
+        self.tick = tick
+        self.tamanho = tamanho
+        self.casas = [dict() for _ in range(tamanho)]
+        self.onde = {}  # chave -> índice da casa
+        self.tick_atual = self._tick_de(inicio if inicio is not None else relogio.time())
+
+    def _tick_de(self, instante):
+        return int(instante // self.tick)
+
+    def __len__(self):
+        return len(self.onde)
+
+    def agendar(self, chave, instante):
+        """(Re)agenda `chave` para o instante (timestamp). Prazos já vencidos saem no próximo avanço."""
+        self.cancelar(chave)
+        tick_prazo = max(self._tick_de(instante), self.tick_atual + 1)
+        indice = tick_prazo % self.tamanho
+        voltas = (tick_prazo - self.tick_atual - 1) // self.tamanho
+        self.casas[indice][chave] = voltas
+        self.onde[chave] = indice
+
+    def cancelar(self, chave):
+        indice = self.onde.pop(chave, None)
+        if indice is not None:
+            self.casas[indice].pop(chave, None)
+
+    def avancar(self, agora=None):
+        """Avança a roda até `agora` e devolve as chaves vencidas."""
+        destino = self._tick_de(agora if agora is not None else relogio.time())
+        vencidas = []
+        while self.tick_atual < destino:
+            self.tick_atual += 1
+            casa = self.casas[self.tick_atual % self.tamanho]
+            for chave, voltas in list(casa.items()):
+                if voltas == 0:
+                    del casa[chave]
+                    del self.onde[chave]
+                    vencidas.append(chave)
+                else:
+                    casa[chave] = voltas - 1
+        return vencidas
+
+
+def executar_continuamente(recarregar_a_cada=30, horizonte_minutos=60, parar=None):
+    """
+    Modo contínuo: a cada `recarregar_a_cada` segundos carrega na roda os prazos
+    do próximo `horizonte_minutos` (consulta barata no índice parcial) e, a cada
+    tick, cancela assim que algum prazo vence. `parar` é uma função opcional que
+    encerra o laço quando retorna True.
+    """
+    roda = RodaDeTempo()
+    ultima_carga = None
+    while not (parar and parar()):
+        agora = relogio.time()
+        close_old_connections()  # processo longo: descarta conexões vencidas/quebradas
+        if ultima_carga is None or agora - ultima_carga >= recarregar_a_cada:
+            ate = timezone.now() + timedelta(minutes=horizonte_minutos)
+            for agendamento_id, expira_em in proximos_prazos(ate):
+                roda.agendar(agendamento_id, expira_em.timestamp())
+            ultima_carga = agora
+
+        if roda.avancar(agora):
+            ids = cancelar_expirados()
+            if ids:
+                logger.info(f"[ROBO FAXINEIRO] {len(ids)} agendamento(s) cancelado(s) no prazo: {ids}")
+
+        relogio.sleep(max(0.0, roda.tick - (relogio.time() % roda.tick)))
@@ -0,0 +1,205 @@
+# backend/agendamentos/lembretes.py
+"""
+Pipeline de lembretes do dia seguinte (e-mail e WhatsApp).
+
+- Os agendamentos são buscados em uma única query, já anotados com os
+  canais para os quais o lembrete foi enviado (LembreteEnviado).
+- E-mails saem por UMA conexão SMTP reaproveitada (get_connection), em vez
+  de uma sessão nova por paciente.
+- WhatsApp sai pelo gateway de saída (chatbot.envio_mensagens): conexões
+  reaproveitadas, limite de taxa do provedor, concorrência limitada e
+  reenvio das falhas temporárias.
+- O LembreteEnviado é gravado ANTES do envio, como reserva: cada execução
+  envia só os lembretes que ela mesma conseguiu reservar, então duas
+  execuções sobrepostas do cron, ou uma que caiu depois de enviar, não
+  repetem mensagens. Se o envio falhar de vez, a reserva é apagada e a
+  próxima execução tenta de novo.
+"""
+
+import logging
+from datetime import datetime, timedelta, time
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from chatbot import envio_mensagens
+
+from .models import Agendamento, LembreteEnviado
+
+logger = logging.getLogger(__name__)
+
+CONCORRENCIA_WHATSAPP = 10
+TAMANHO_LOTE_RESERVA = 500
+
+
+def _resumo():
+    return {'enviados': 0, 'falhas': 0, 'ignorados': 0}
+
+
+def buscar_agendamentos_de_amanha(status):
+    """Agendamentos de amanhã com o paciente e os canais já enviados, em uma query."""
+    amanha = timezone.localtime(timezone.now()).date() + timedelta(days=1)
+    inicio_de_amanha = timezone.make_aware(datetime.combine(amanha, time.min))
+    fim_de_amanha = timezone.make_aware(datetime.combine(amanha, time.max))
+
+    def ja_enviado(canal):
+        return Exists(LembreteEnviado.objects.filter(agendamento=OuterRef('pk'), canal=canal))
+
+    return list(
+        Agendamento.objects.filter(
+            data_hora_inicio__gte=inicio_de_amanha,
+            data_hora_inicio__lte=fim_de_amanha,
+            status__in=status
+        ).select_related('paciente').annotate(
+            email_enviado=ja_enviado('email'),
+            whatsapp_enviado=ja_enviado('whatsapp'),
+        ).order_by('data_hora_inicio')
+    )
+
+
+def _reservar(agendamentos, canal):
+    """
+    Grava o LembreteEnviado de cada agendamento e devolve só aqueles cuja
+    linha foi inserida por esta chamada. O bulk_create(ignore_conflicts=True)
+    não diz quais linhas entraram, por isso o INSERT ... ON CONFLICT DO
+    NOTHING RETURNING (Postgres e sqlite).
+    """
+    tabela = connection.ops.quote_name(LembreteEnviado._meta.db_table)
+    agora = connection.ops.adapt_datetimefield_value(timezone.now())
+    reservados = set()
+    with connection.cursor() as cursor:
+        for inicio in range(0, len(agendamentos), TAMANHO_LOTE_RESERVA):
+            lote = agendamentos[inicio:inicio + TAMANHO_LOTE_RESERVA]
+            cursor.execute(
+                f"""
+                INSERT INTO {tabela} (agendamento_id, canal, enviado_em)
+                VALUES {', '.join(['(%s, %s, %s)'] * len(lote))}
+                ON CONFLICT (agendamento_id, canal) DO NOTHING
+                RETURNING agendamento_id
+                """,
+                [valor for agendamento in lote for valor in (agendamento.id, canal, agora)],
+            )
+            reservados.update(agendamento_id for agendamento_id, in cursor.fetchall())
+    return [agendamento for agendamento in agendamentos if agendamento.id in reservados]
+
+
+def _liberar(agendamento_ids, canal):
+    """Apaga as reservas dos envios que falharam, para a próxima execução tentar de novo."""
+    if agendamento_ids:
+        LembreteEnviado.objects.filter(agendamento_id__in=agendamento_ids, canal=canal).delete()
+
+
+def _mensagem_email(agendamento):
+    paciente = agendamento.paciente
+    hora_local = timezone.localtime(agendamento.data_hora_inicio)
+    data_formatada = hora_local.strftime('%d/%m/%Y')
+    hora_formatada = hora_local.strftime('%H:%M')
+
+    assunto = "Lembrete de Consulta - Clínica Limalé"
+    mensagem = f"""
+                Olá, {paciente.nome_completo}!
+
+                Este é um lembrete da sua consulta amanhã, dia {data_formatada} às {hora_formatada}.
+
+                Se precisar reagendar, por favor, entre em contato.
+
+                Atenciosamente,
+                Clínica Limalé
+                """
+    return EmailMessage(subject=assunto, body=mensagem, to=[paciente.email])
+
+
+def enviar_emails(agendamentos):
+    """Envia os e-mails pendentes reaproveitando uma única conexão SMTP."""
+    resumo = _resumo()
+    pendentes = []
+    for agendamento in agendamentos:
+        if agendamento.email_enviado or not agendamento.paciente.email:
+            resumo['ignorados'] += 1
+        else:
+            pendentes.append(agendamento)
+    reservados = _reservar(pendentes, 'email')
+    # Os demais já foram reservados por outra execução
+    resumo['ignorados'] += len(pendentes) - len(reservados)
+    pendentes = reservados
+    if not pendentes:
+        return resumo
+
+    enviados_ids = []
+    conexao = get_connection(fail_silently=False)
+    try:
+        conexao.open()
+        for agendamento in pendentes:
+            try:
+                conexao.send_messages([_mensagem_email(agendamento)])
+                enviados_ids.append(agendamento.id)
+            except Exception as e:
+                logger.error(f"Falha ao enviar email para {agendamento.paciente.email}: {e}")
+                resumo['falhas'] += 1
+    except Exception as e:
+        # Não foi possível nem abrir a conexão: todos os pendentes falharam
+        logger.error(f"Falha ao abrir a conexão SMTP: {e}")
+        resumo['falhas'] = len(pendentes) - len(enviados_ids)
+    finally:
+        conexao.close()
+
+    enviados = set(enviados_ids)
+    _liberar([agendamento.id for agendamento in pendentes if agendamento.id not in enviados], 'email')
+    resumo['enviados'] = len(enviados_ids)
+    return resumo
+
+
+def _payload_whatsapp(agendamento):
+    paciente = agendamento.paciente
+    hora_formatada = timezone.localtime(agendamento.data_hora_inicio).strftime('%H:%M')
+    mensagem = (
+        f"Olá, {paciente.nome_completo.split(' ')[0]}! Tudo bem?\n\n"
+        f"Passando para lembrar do seu agendamento na Clínica Limalé amanhã, às *{hora_formatada}*.\n\n"
+        "Caso precise reagendar ou cancelar, basta responder a esta mensagem.\n\n"
+        "Atenciosamente,\nEquipe Limalé"
+    )
+    # O payload pode variar dependendo da API (WAHA, Meta, etc.)
+    return {
+        "chatId": f"{paciente.telefone_celular}@c.us",  # O sufixo pode variar
+        "message": mensagem
+    }
+
+
+def enviar_whatsapp(agendamentos, webhook_url, concorrencia=CONCORRENCIA_WHATSAPP):
+    """Dispara os lembretes de WhatsApp pendentes com concorrência limitada."""
+    resumo = _resumo()
+    pendentes = []
+    for agendamento in agendamentos:
+        if agendamento.whatsapp_enviado or not agendamento.paciente.telefone_celular:
+            resumo['ignorados'] += 1
+        else:
+            pendentes.append(agendamento)
+    reservados = _reservar(pendentes, 'whatsapp')
+    resumo['ignorados'] += len(pendentes) - len(reservados)
+    pendentes = reservados
+    if not pendentes:
+        return resumo
+
+    status = envio_mensagens.enviar_lote(
+        [(webhook_url, _payload_whatsapp(agendamento)) for agendamento in pendentes], concorrencia=concorrencia
+    )
+
+    # NA_FILA conta como enviado: o gateway reenvia, e o cron não deve repetir a
+    # mensagem. INCERTO também (pode ter chegado): a reserva fica.
+    falhas_ids = []
+    resumo['na_fila'] = resumo['incertos'] = 0
+    for agendamento, status_envio in zip(pendentes, status):
+        if status_envio == envio_mensagens.FALHOU:
+            logger.error(f"Falha ao enviar WhatsApp para {agendamento.paciente.nome_completo} (Ag. ID {agendamento.id})")
+            falhas_ids.append(agendamento.id)
+        elif status_envio == envio_mensagens.NA_FILA:
+            resumo['na_fila'] += 1
+        elif status_envio == envio_mensagens.INCERTO:
+            resumo['incertos'] += 1
+
+    _liberar(falhas_ids, 'whatsapp')
+    resumo['falhas'] = len(falhas_ids)
+    resumo['enviados'] = len(pendentes) - len(falhas_ids)
+    return resumo
@@ -2,7 +2,7 @@
 
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from agendamentos.models import Agendamento
+from agendamentos import expiracao
 import logging
 
 # Configura um logger para podermos ver a execução nos logs do Render
@@ -11,34 +11,35 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     help = 'Cancela agendamentos com status "Agendado" cujo prazo de pagamento expirou.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--continuo', action='store_true',
+            help='Fica em execução e cancela cada agendamento no segundo em que o prazo vence (timing wheel), em vez de depender do cron.'
+        )
+        parser.add_argument(
+            '--recarregar-a-cada', type=int, default=30,
+            help='No modo contínuo, intervalo (segundos) para buscar novos prazos no banco.'
+        )
+
     def handle(self, *args, **options):
+        if options['continuo']:
+            logger.info("[ROBO FAXINEIRO] Iniciando em modo contínuo.")
+            expiracao.executar_continuamente(recarregar_a_cada=options['recarregar_a_cada'])
+            return
+
         agora_utc = timezone.now()
         
         # Usamos logger.info para que apareça nos logs do Render
         logger.info(f"[ROBO FAXINEIRO] Executando verificação de agendamentos expirados.")
         logger.info(f"[ROBO FAXINEIRO] Horário atual do servidor (UTC): {agora_utc}")
 
-        # Busca por agendamentos que estão pendentes E cujo prazo já passou
-        agendamentos_expirados = Agendamento.objects.filter(
-            status='Agendado',
-            expira_em__isnull=False, # Garante que só pegamos agendamentos que têm um prazo
-            expira_em__lte=agora_utc
-        )
-        
-        total_cancelados = agendamentos_expirados.update(status='Cancelado')
+        # Um único UPDATE ... RETURNING cancela os vencidos e, na mesma transação,
+        # os pagamentos pendentes deles passam para 'Expirado'
+        cancelados = expiracao.cancelar_expirados(agora_utc)
 
-        if total_cancelados > 0:
-            msg = f"SUCESSO: {total_cancelados} agendamento(s) foram cancelados."
-            logger.info(f"[ROBO FAXINEIRO] {msg}")
-            return msg # Retorna a mensagem para o N8N
+        if cancelados:
+            msg = f"SUCESSO: {len(cancelados)} agendamento(s) foram cancelados."
         else:
-            # Se nada foi cancelado, vamos investigar o porquê
-            agendamentos_pendentes = Agendamento.objects.filter(status='Agendado', expira_em__isnull=False)
-            msg = f"Nenhum agendamento expirado encontrado. {agendamentos_pendentes.count()} agendamento(s) pendente(s) aguardando expiração."
-            logger.info(f"[ROBO FAXINEIRO] {msg}")
-            
-            # Log de depuração para cada agendamento pendente
-            for ag in agendamentos_pendentes:
-                logger.info(f"[ROBO FAXINEIRO] DEBUG: Agendamento ID {ag.id} tem prazo em (UTC): {ag.expira_em}")
-            
-            return msg # Retorna a mensagem para o N8N
\ No newline at end of file
+            msg = "Nenhum agendamento expirado encontrado."
+        logger.info(f"[ROBO FAXINEIRO] {msg}")
+        return msg # Retorna a mensagem para o N8N
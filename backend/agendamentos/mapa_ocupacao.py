@@ -0,0 +1,101 @@
+# backend/agendamentos/mapa_ocupacao.py
+"""
+Mapa de calor da ocupação das salas: (sala x slot x tipo_agendamento).
+
+Em vez de uma requisição ao verificar-capacidade por horário, a recepção
+pede a janela inteira (um dia, uma semana) de uma vez. Os agendamentos que
+tocam a janela são buscados em UMA query e somados com um array de
+diferenças: cada agendamento marca +1 no slot em que começa e -1 no slot
+seguinte ao último que ocupa; uma soma acumulada por linha dá a contagem
+de cada slot. Custo O(agendamentos + salas * slots), sem laço por horário.
+"""
+
+from datetime import timedelta
+from itertools import accumulate
+
+from .capacidade import CAPACIDADE_POR_TIPO
+from .calendario import ParametroInvalido
+from .models import Agendamento, Sala
+from .ocupacao import TIPOS_SALA
+
+SLOT_PADRAO_MINUTOS = 30
+SLOT_MINIMO_MINUTOS = 5
+JANELA_MAXIMA_DIAS = 31
+MAXIMO_DE_SLOTS = 31 * 24 * 2  # um mês em slots de 30 minutos
+
+
+def validar_janela(inicio, fim, slot_minutos):
+    if fim <= inicio:
+        raise ParametroInvalido('"fim" deve ser posterior a "inicio".')
+    if fim - inicio > timedelta(days=JANELA_MAXIMA_DIAS):
+        raise ParametroInvalido(f"A janela não pode passar de {JANELA_MAXIMA_DIAS} dias.")
+    if slot_minutos < SLOT_MINIMO_MINUTOS or (24 * 60) % slot_minutos:
+        raise ParametroInvalido(f'"slot" deve dividir o dia e ter pelo menos {SLOT_MINIMO_MINUTOS} minutos (ex: 15, 30, 60).')
+    if quantidade_de_slots(inicio, fim, slot_minutos) > MAXIMO_DE_SLOTS:
+        raise ParametroInvalido(f"A janela tem slots demais para este tamanho (máx. {MAXIMO_DE_SLOTS}); aumente o slot.")
+
+
+def quantidade_de_slots(inicio, fim, slot_minutos):
+    slot_segundos = slot_minutos * 60
+    return -int(-(fim - inicio).total_seconds() // slot_segundos)
+
+
+def queryset_da_janela(inicio, fim):
+    return Agendamento.objects.filter(
+        data_hora_inicio__lt=fim,
+        data_hora_fim__gt=inicio,
+        sala__isnull=False,
+    ).exclude(status='Cancelado')
+
+
+def montar_mapa(inicio, fim, slot_minutos=SLOT_PADRAO_MINUTOS):
+    """
+    Devolve o payload do mapa: `salas` e, alinhado a elas, `ocupacao`, onde
+    ocupacao[i][t][s] é quantos agendamentos do tipo TIPOS_SALA[t] ocupam a
+    sala i no slot s (qualquer sobreposição com o slot conta). Duas queries.
+    """
+    validar_janela(inicio, fim, slot_minutos)
+    total_slots = quantidade_de_slots(inicio, fim, slot_minutos)
+    slot_segundos = slot_minutos * 60
+    origem = inicio.timestamp()
+
+    salas = list(Sala.objects.order_by('nome').values('id', 'nome'))
+    linha_da_sala = {sala['id']: indice for indice, sala in enumerate(salas)}
+    indice_do_tipo = {tipo: indice for indice, tipo in enumerate(TIPOS_SALA)}
+    largura = len(TIPOS_SALA)
+
+    # Um array de diferenças por (sala, tipo), com uma casa extra no fim
+    diferencas = [[0] * (total_slots + 1) for _ in range(len(salas) * largura)]
+
+    linhas = queryset_da_janela(inicio, fim).values_list(
+        'sala_id', 'tipo_agendamento', 'data_hora_inicio', 'data_hora_fim'
+    )
+    for sala_id, tipo, ag_inicio, ag_fim in linhas:
+        indice_tipo = indice_do_tipo.get(tipo)
+        indice_sala = linha_da_sala.get(sala_id)
+        if indice_tipo is None or indice_sala is None:
+            continue
+        primeiro = max(int((ag_inicio.timestamp() - origem) // slot_segundos), 0)
+        ultimo = min(-int(-(ag_fim.timestamp() - origem) // slot_segundos), total_slots)
+        if primeiro < ultimo:
+            linha = diferencas[indice_sala * largura + indice_tipo]
+            linha[primeiro] += 1
+            linha[ultimo] -= 1
+
+    ocupacao = []
+    for indice_sala in range(len(salas)):
+        ocupacao.append([
+            list(accumulate(diferencas[indice_sala * largura + indice_tipo][:total_slots]))
+            for indice_tipo in range(largura)
+        ])
+
+    return {
+        'inicio': inicio.isoformat(),
+        'fim': fim.isoformat(),
+        'slot_minutos': slot_minutos,
+        'total_slots': total_slots,
+        'tipos': TIPOS_SALA,
+        'capacidade': {tipo: CAPACIDADE_POR_TIPO[tipo] for tipo in TIPOS_SALA},
+        'salas': salas,
+        'ocupacao': ocupacao,
+    }
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-18 11:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamentos', '0011_alter_agendamento_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(fields=['data_hora_inicio', 'id'], name='agendamento_inicio_id_idx'),
+        ),
+    ]
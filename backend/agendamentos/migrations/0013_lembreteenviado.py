@@ -0,0 +1,27 @@
+# Generated by Django 5.0.7 on 2026-10-18 11:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamentos', '0012_agendamento_inicio_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LembreteEnviado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('canal', models.CharField(choices=[('email', 'E-mail'), ('whatsapp', 'WhatsApp')], max_length=10)),
+                ('enviado_em', models.DateTimeField(auto_now_add=True)),
+                ('agendamento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lembretes_enviados', to='agendamentos.agendamento')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='lembreteenviado',
+            constraint=models.UniqueConstraint(fields=('agendamento', 'canal'), name='lembrete_unico_por_canal'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-18 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamentos', '0013_lembreteenviado'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(condition=models.Q(('expira_em__isnull', False), ('status', 'Agendado')), fields=['expira_em'], name='agendamento_expiracao_idx'),
+        ),
+    ]
@@ -76,8 +76,39 @@ class Agendamento(models.Model):
     data_criacao = models.DateTimeField(auto_now_add=True)
     data_atualizacao = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Janela + paginação por cursor do feed do calendário (agendamentos.calendario)
+            models.Index(fields=['data_hora_inicio', 'id'], name='agendamento_inicio_id_idx'),
+            # Índice parcial: só os pendentes com prazo de pagamento (agendamentos.expiracao)
+            models.Index(
+                fields=['expira_em'],
+                condition=models.Q(status='Agendado', expira_em__isnull=False),
+                name='agendamento_expiracao_idx'
+            ),
+        ]
+
     def __str__(self):
         hora_local = timezone.localtime(self.data_hora_inicio)
         data_formatada = hora_local.strftime('%d/%m/%Y às %H:%M')
         # Adiciona o nome da sala na representação do objeto
-        return f"{self.paciente.nome_completo} em {self.sala.nome if self.sala else 'Sala não definida'} - {data_formatada}"
\ No newline at end of file
+        return f"{self.paciente.nome_completo} em {self.sala.nome if self.sala else 'Sala não definida'} - {data_formatada}"
+
+class LembreteEnviado(models.Model):
+    """
+    Registro dos lembretes já enviados (um por agendamento e canal).
+    Torna o envio idempotente: rodar o cron de novo não repete mensagens.
+    """
+    CANAL_CHOICES = [('email', 'E-mail'), ('whatsapp', 'WhatsApp')]
+
+    agendamento = models.ForeignKey(Agendamento, on_delete=models.CASCADE, related_name='lembretes_enviados')
+    canal = models.CharField(max_length=10, choices=CANAL_CHOICES)
+    enviado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['agendamento', 'canal'], name='lembrete_unico_por_canal'),
+        ]
+
+    def __str__(self):
+        return f"Lembrete {self.canal} - Agendamento {self.agendamento_id}"
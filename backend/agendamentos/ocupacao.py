@@ -0,0 +1,230 @@
+# backend/agendamentos/ocupacao.py
+"""
+Mapas de ocupação em cache por (médico, dia) e por (sala, dia).
+
+Cada dia é dividido em blocos fixos de RESOLUCAO_MINUTOS:
+- Médico: um bitmap (int) onde o bit N indica que o bloco N está ocupado.
+- Sala: um bytearray com a quantidade de agendamentos por bloco, separado
+  por tipo (Consulta / Procedimento), para validar a capacidade da sala.
+
+Os mapas são reconstruídos sob demanda (uma única query para todos os dias
+que faltam no cache) e invalidados pelos sinais em agendamentos/signals.py.
+Com o cache quente, perguntar "este horário está livre?" vira operação de bits.
+
+Cada (entidade, dia) tem também uma geração no cache, trocada a cada
+invalidação. O mapa é guardado junto com a geração lida antes de montá-lo;
+se uma invalidação acontecer durante a montagem, o mapa gravado fica com a
+geração antiga e é descartado na próxima leitura.
+"""
+
+import uuid
+from datetime import datetime, timedelta, time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Agendamento
+
+RESOLUCAO_MINUTOS = 5
+BLOCOS_POR_DIA = (24 * 60) // RESOLUCAO_MINUTOS
+TIMEOUT_CACHE_SEGUNDOS = 15 * 60  # Rede de segurança caso alguma alteração escape dos sinais
+TIMEOUT_GERACAO_SEGUNDOS = 2 * TIMEOUT_CACHE_SEGUNDOS  # A geração precisa durar mais que os mapas gravados com ela
+
+# Ordem dos tipos dentro do bytearray da sala
+TIPOS_SALA = ['Consulta', 'Procedimento']
+
+_CAMPOS = {'medico': 'medico_id', 'sala': 'sala_id'}
+
+
+def _chave(tipo_entidade, entidade_id, data):
+    return f"ocupacao:{tipo_entidade}:{entidade_id}:{data.isoformat()}"
+
+
+def _chave_geracao(tipo_entidade, entidade_id, data):
+    return f"ocupacao:geracao:{tipo_entidade}:{entidade_id}:{data.isoformat()}"
+
+
+def _minutos_do_dia(momento):
+    return momento.hour * 60 + momento.minute + momento.second / 60
+
+
+def _blocos_por_dia(inicio, fim):
+    """
+    Quebra o intervalo [inicio, fim) em pedaços por dia local e devolve
+    (data, bloco_inicial, bloco_final). Os blocos são arredondados para fora,
+    então um agendamento nunca ocupa "menos" do que realmente ocupa.
+    """
+    # Fuso padrão (TIME_ZONE) em vez de localtime(): o projeto não ativa fusos
+    # por requisição e get_default_timezone() é memorizado, o que evita o custo
+    # do thread-local a cada slot verificado.
+    fuso = timezone.get_default_timezone()
+    inicio = inicio.astimezone(fuso)
+    fim = fim.astimezone(fuso)
+    data, data_fim = inicio.date(), fim.date()
+    while data <= data_fim:
+        minutos_inicio = _minutos_do_dia(inicio) if data == inicio.date() else 0
+        minutos_fim = _minutos_do_dia(fim) if data == data_fim else 24 * 60
+        if minutos_inicio < minutos_fim:
+            bloco_inicial = int(minutos_inicio // RESOLUCAO_MINUTOS)
+            bloco_final = min(-int(-minutos_fim // RESOLUCAO_MINUTOS), BLOCOS_POR_DIA)
+            yield data, bloco_inicial, bloco_final
+        data += timedelta(days=1)
+
+
+def _mascara(bloco_inicial, bloco_final):
+    return ((1 << (bloco_final - bloco_inicial)) - 1) << bloco_inicial
+
+
+def _mapa_vazio(tipo_entidade):
+    return 0 if tipo_entidade == 'medico' else bytearray(BLOCOS_POR_DIA * len(TIPOS_SALA))
+
+
+def _construir_mapas(tipo_entidade, ids, datas):
+    """Uma query para todos os (entidade, dia) pedidos."""
+    campo = _CAMPOS[tipo_entidade]
+    mapas = {(entidade_id, data): _mapa_vazio(tipo_entidade) for entidade_id in ids for data in datas}
+    inicio = timezone.make_aware(datetime.combine(min(datas), time.min))
+    fim = timezone.make_aware(datetime.combine(max(datas) + timedelta(days=1), time.min))
+
+    linhas = Agendamento.objects.filter(
+        **{f'{campo}__in': ids},
+        data_hora_inicio__lt=fim,
+        data_hora_fim__gt=inicio,
+    ).exclude(status='Cancelado').values_list(campo, 'tipo_agendamento', 'data_hora_inicio', 'data_hora_fim')
+
+    for entidade_id, tipo_agendamento, ag_inicio, ag_fim in linhas:
+        if not ag_inicio or not ag_fim or ag_fim <= ag_inicio:
+            continue
+        for data, bloco_inicial, bloco_final in _blocos_por_dia(ag_inicio, ag_fim):
+            chave = (entidade_id, data)
+            if chave not in mapas:
+                continue
+            if tipo_entidade == 'medico':
+                mapas[chave] |= _mascara(bloco_inicial, bloco_final)
+            else:
+                deslocamento = TIPOS_SALA.index(tipo_agendamento) * BLOCOS_POR_DIA if tipo_agendamento in TIPOS_SALA else 0
+                contagens = mapas[chave]
+                for bloco in range(deslocamento + bloco_inicial, deslocamento + bloco_final):
+                    contagens[bloco] = min(contagens[bloco] + 1, 255)
+    return mapas
+
+
+def _serializar(tipo_entidade, mapa):
+    if tipo_entidade == 'medico':
+        return mapa.to_bytes(BLOCOS_POR_DIA // 8, 'little')
+    return bytes(mapa)
+
+
+def _deserializar(tipo_entidade, valor):
+    if tipo_entidade == 'medico':
+        return int.from_bytes(valor, 'little')
+    return bytearray(valor)
+
+
+def carregar_mapas(tipo_entidade, ids, datas):
+    """
+    Retorna {(entidade_id, data): mapa} lendo do cache e reconstruindo,
+    em uma única query, apenas o que estiver faltando.
+    """
+    ids = list(ids)
+    datas = sorted(set(datas))
+    if not ids or not datas:
+        return {}
+
+    pares = [(entidade_id, data) for entidade_id in ids for data in datas]
+    # Mapas e gerações na mesma ida ao cache
+    em_cache = cache.get_many(
+        [_chave(tipo_entidade, *par) for par in pares] + [_chave_geracao(tipo_entidade, *par) for par in pares]
+    )
+
+    mapas, faltando = {}, {}
+    for par in pares:
+        geracao = em_cache.get(_chave_geracao(tipo_entidade, *par))
+        guardado = em_cache.get(_chave(tipo_entidade, *par))
+        if guardado is not None and guardado[0] == geracao:
+            mapas[par] = _deserializar(tipo_entidade, guardado[1])
+        else:
+            faltando[par] = geracao
+
+    if faltando:
+        ids_faltando = sorted({entidade_id for entidade_id, _ in faltando})
+        datas_faltando = sorted({data for _, data in faltando})
+        construidos = _construir_mapas(tipo_entidade, ids_faltando, datas_faltando)
+        novos = {par: construidos[par] for par in faltando}
+        cache.set_many(
+            {_chave(tipo_entidade, *par): (faltando[par], _serializar(tipo_entidade, mapa)) for par, mapa in novos.items()},
+            timeout=TIMEOUT_CACHE_SEGUNDOS
+        )
+        mapas.update(novos)
+    return mapas
+
+
+def datas_do_intervalo(inicio, fim):
+    return [data for data, _, _ in _blocos_por_dia(inicio, fim)]
+
+
+def medico_livre(mapas, medico_id, inicio, fim):
+    """True se nenhum bloco de [inicio, fim) estiver ocupado na agenda do médico."""
+    for data, bloco_inicial, bloco_final in _blocos_por_dia(inicio, fim):
+        if mapas.get((medico_id, data), 0) & _mascara(bloco_inicial, bloco_final):
+            return False
+    return True
+
+
+def ocupacao_maxima_sala(mapas, sala_id, inicio, fim, tipo_agendamento, excluir=None):
+    """
+    Maior número de agendamentos simultâneos do tipo informado na sala
+    durante [inicio, fim). `excluir` é um agendamento já salvo cuja própria
+    ocupação não deve contar (edição de um agendamento existente).
+    """
+    deslocamento = TIPOS_SALA.index(tipo_agendamento) * BLOCOS_POR_DIA
+    blocos_excluidos = {}
+    if (excluir is not None and excluir.pk and excluir.sala_id == sala_id
+            and excluir.status != 'Cancelado' and excluir.tipo_agendamento == tipo_agendamento
+            and excluir.data_hora_inicio and excluir.data_hora_fim):
+        for data, bloco_inicial, bloco_final in _blocos_por_dia(excluir.data_hora_inicio, excluir.data_hora_fim):
+            blocos_excluidos[data] = range(bloco_inicial, bloco_final)
+
+    maximo = 0
+    for data, bloco_inicial, bloco_final in _blocos_por_dia(inicio, fim):
+        contagens = mapas.get((sala_id, data))
+        if not contagens:
+            continue
+        excluidos = blocos_excluidos.get(data, range(0))
+        for bloco in range(bloco_inicial, bloco_final):
+            quantidade = contagens[deslocamento + bloco] - (1 if bloco in excluidos else 0)
+            maximo = max(maximo, quantidade)
+    return maximo
+
+
+def invalidar(medico_id, sala_id, inicio, fim):
+    """
+    Troca a geração (e apaga os mapas) dos dias tocados pelo intervalo. Faz
+    isso na hora e de novo após o commit: um mapa montado antes da transação
+    terminar, ou durante a própria invalidação, fica com a geração antiga e
+    não é mais usado.
+    """
+    if not inicio or not fim:
+        return
+    pares = []
+    for data in datas_do_intervalo(inicio, max(fim, inicio)) or [timezone.localtime(inicio).date()]:
+        if medico_id:
+            pares.append(('medico', medico_id, data))
+        if sala_id:
+            pares.append(('sala', sala_id, data))
+    if pares:
+        _nova_geracao(pares)
+        transaction.on_commit(lambda: _nova_geracao(pares))
+
+
+def _nova_geracao(pares):
+    geracao = uuid.uuid4().hex
+    cache.set_many({_chave_geracao(*par): geracao for par in pares}, timeout=TIMEOUT_GERACAO_SEGUNDOS)
+    cache.delete_many([_chave(*par) for par in pares])
+
+
+def invalidar_queryset(queryset):
+    """Invalida os mapas de um queryset antes de um update() em massa (que não dispara sinais)."""
+    for medico_id, sala_id, inicio, fim in queryset.values_list('medico_id', 'sala_id', 'data_hora_inicio', 'data_hora_fim'):
+        invalidar(medico_id, sala_id, inicio, fim)
@@ -5,7 +5,13 @@ from .models import Agendamento, Sala
 from pacientes.models import Paciente
 from usuarios.models import CustomUser, Especialidade
 from faturamento.models import Procedimento
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from django.utils import timezone
+from . import ocupacao, capacidade
+
+# Status que contam como "já consultou" para o cálculo de primeira_consulta
+STATUS_CONSULTA_ANTERIOR = ['Realizado', 'Confirmado']
 
 
 # --- Serializer para LEITURA (GET) ---
@@ -58,12 +64,106 @@ class AgendamentoSerializer(serializers.ModelSerializer):
         ]
 
     def get_primeira_consulta(self, obj):
+        # Listagens passam por preparar_listagem(), que já calcula o valor para
+        # todas as linhas em uma única query; a consulta individual fica só
+        # como fallback (ex: detalhe de um agendamento).
+        anotado = getattr(obj, 'primeira_consulta_anotada', None)
+        if anotado is not None:
+            return anotado
         return not Agendamento.objects.filter(
-            paciente=obj.paciente,
-            status__in=['Realizado', 'Confirmado'],
+            paciente_id=obj.paciente_id,
+            status__in=STATUS_CONSULTA_ANTERIOR,
             data_hora_inicio__lt=obj.data_hora_inicio
         ).exists()
 
+
+def preparar_listagem(queryset):
+    """
+    Prepara um queryset de Agendamento para o AgendamentoSerializer: traz as
+    relações exibidas via select_related e anota `primeira_consulta` com um
+    Exists, evitando uma query por linha.
+    """
+    consultas_anteriores = Agendamento.objects.filter(
+        paciente=OuterRef('paciente'),
+        status__in=STATUS_CONSULTA_ANTERIOR,
+        data_hora_inicio__lt=OuterRef('data_hora_inicio')
+    )
+    return queryset.select_related(
+        'paciente', 'medico', 'especialidade', 'procedimento', 'plano_utilizado', 'sala', 'pagamento'
+    ).annotate(primeira_consulta_anotada=~Exists(consultas_anteriores))
+
+# --- Modelo de leitura da agenda (MinhaAgenda, Hoje, Lista de Espera) ---
+# Mesmo formato de saída do AgendamentoSerializer, mas a partir de .values():
+# sem instanciar models nem resolver relações campo a campo.
+CAMPOS_AGENDA = (
+    'id', 'paciente_id', 'paciente__nome_completo', 'data_hora_inicio', 'data_hora_fim',
+    'status', 'plano_utilizado__nome', 'tipo_atendimento', 'observacoes', 'pagamento__status',
+    'link_telemedicina', 'modalidade', 'tipo_visita', 'tipo_agendamento',
+    'medico_id', 'medico__first_name', 'medico__last_name',
+    'especialidade_id', 'especialidade__nome', 'procedimento_id', 'procedimento__descricao',
+    'data_criacao', 'data_atualizacao', 'expira_em', 'id_sala_telemedicina',
+    'sala_id', 'sala__nome', 'primeira_consulta_anotada',
+)
+
+
+def projetar_agenda(queryset):
+    """
+    Projeção enxuta para o AgendaLeituraSerializer: uma única query com os
+    JOINs explícitos e `primeira_consulta` anotada via Exists.
+    """
+    consultas_anteriores = Agendamento.objects.filter(
+        paciente=OuterRef('paciente'),
+        status__in=STATUS_CONSULTA_ANTERIOR,
+        data_hora_inicio__lt=OuterRef('data_hora_inicio')
+    )
+    return queryset.annotate(primeira_consulta_anotada=~Exists(consultas_anteriores)).values(*CAMPOS_AGENDA)
+
+
+class AgendaLeituraSerializer(serializers.BaseSerializer):
+    """Serializa as linhas de projetar_agenda() no formato do AgendamentoSerializer."""
+    _data_hora = serializers.DateTimeField()
+
+    def _formatar_data_hora(self, valor):
+        return self._data_hora.to_representation(valor) if valor else None
+
+    def to_representation(self, linha):
+        if linha['medico_id']:
+            medico_nome = f"{linha['medico__first_name']} {linha['medico__last_name']}".strip()
+        else:
+            medico_nome = None
+        dados = {
+            'id': linha['id'],
+            'paciente': linha['paciente_id'],
+            'paciente_nome': linha['paciente__nome_completo'],
+            'data_hora_inicio': self._formatar_data_hora(linha['data_hora_inicio']),
+            'data_hora_fim': self._formatar_data_hora(linha['data_hora_fim']),
+            'status': linha['status'],
+            'plano_utilizado': linha['plano_utilizado__nome'],
+            'tipo_atendimento': linha['tipo_atendimento'],
+            'observacoes': linha['observacoes'],
+            'status_pagamento': linha['pagamento__status'],
+            'primeira_consulta': linha['primeira_consulta_anotada'],
+            'link_telemedicina': linha['link_telemedicina'],
+            'modalidade': linha['modalidade'],
+            'tipo_visita': linha['tipo_visita'],
+            'tipo_agendamento': linha['tipo_agendamento'],
+            'medico': linha['medico_id'],
+            'medico_nome': medico_nome,
+            'especialidade': linha['especialidade_id'],
+            'especialidade_nome': linha['especialidade__nome'],
+            'procedimento': linha['procedimento_id'],
+            'procedimento_descricao': linha['procedimento__descricao'],
+            'data_criacao': self._formatar_data_hora(linha['data_criacao']),
+            'data_atualizacao': self._formatar_data_hora(linha['data_atualizacao']),
+            'expira_em': self._formatar_data_hora(linha['expira_em']),
+            'id_sala_telemedicina': linha['id_sala_telemedicina'],
+            'sala': linha['sala_id'],
+        }
+        # Como no AgendamentoSerializer, sala_nome só aparece quando há sala
+        if linha['sala_id']:
+            dados['sala_nome'] = linha['sala__nome']
+        return dados
+
 # --- Serializer para ESCRITA (POST, PUT) ---
 # A MUDANÇA PRINCIPAL OCORRE AQUI
 class AgendamentoWriteSerializer(serializers.ModelSerializer):
@@ -93,9 +193,6 @@ class AgendamentoWriteSerializer(serializers.ModelSerializer):
         2. A sala é OBRIGATÓRIA para usuários do sistema (recepção/admin).
         3. A capacidade (3 consultas/1 proc) é verificada APENAS se uma sala for definida.
         """
-        CAPACIDADE_CONSULTAS = 3
-        CAPACIDADE_PROCEDIMENTOS = 1
-
         tipo_agendamento_atual = data.get('tipo_agendamento')
         inicio = data.get('data_hora_inicio')
         fim = data.get('data_hora_fim')
@@ -148,25 +245,56 @@ class AgendamentoWriteSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError({"sala": "A seleção da sala é obrigatória para agendamentos feitos pelo painel."})
 
         # Passo 2: Se uma sala foi informada, validar a capacidade.
-        if sala_atual:
-            conflitos = Agendamento.objects.filter(
-                data_hora_inicio__lt=fim, 
-                data_hora_fim__gt=inicio,
-                sala=sala_atual
-            ).exclude(status='Cancelado')
-
-            if self.instance:
-                conflitos = conflitos.exclude(pk=self.instance.pk)
-
-            consultas_na_sala = conflitos.filter(tipo_agendamento='Consulta').count()
-            procedimentos_na_sala = conflitos.filter(tipo_agendamento='Procedimento').count()
-
-            if tipo_agendamento_atual == 'Consulta' and consultas_na_sala >= CAPACIDADE_CONSULTAS:
-                raise serializers.ValidationError(f"A capacidade máxima de {CAPACIDADE_CONSULTAS} consultas para esta sala e horário já foi atingida.")
-            elif tipo_agendamento_atual == 'Procedimento' and procedimentos_na_sala >= CAPACIDADE_PROCEDIMENTOS:
-                raise serializers.ValidationError(f"A capacidade máxima de {CAPACIDADE_PROCEDIMENTOS} procedimento(s) para esta sala e horário já foi atingida.")
+        # Usa os mapas de ocupação da sala em cache (agendamentos.ocupacao): conta o
+        # pico de agendamentos simultâneos de cada tipo no intervalo pedido.
+        if self.instance:
+            inicio = inicio or self.instance.data_hora_inicio
+            fim = fim or self.instance.data_hora_fim
+        if sala_atual and inicio and fim and tipo_agendamento_atual in ocupacao.TIPOS_SALA:
+            mapas = ocupacao.carregar_mapas('sala', [sala_atual.id], ocupacao.datas_do_intervalo(inicio, fim))
+            ocupacao_na_sala = ocupacao.ocupacao_maxima_sala(
+                mapas, sala_atual.id, inicio, fim, tipo_agendamento_atual, excluir=self.instance
+            )
+
+            if ocupacao_na_sala >= capacidade.CAPACIDADE_POR_TIPO[tipo_agendamento_atual]:
+                raise serializers.ValidationError(capacidade.mensagem_capacidade_excedida(tipo_agendamento_atual))
         
         return data
+
+    # A validação acima usa o cache e não impede que duas reservas simultâneas
+    # passem juntas. A checagem definitiva acontece aqui, com a sala travada,
+    # na mesma transação que grava o agendamento (ver agendamentos.capacidade).
+    def create(self, validated_data):
+        with transaction.atomic():
+            self._garantir_capacidade(validated_data)
+            return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        with transaction.atomic():
+            self._garantir_capacidade(validated_data, instance)
+            return super().update(instance, validated_data)
+
+    def _garantir_capacidade(self, validated_data, instance=None):
+        def valor(campo):
+            if campo in validated_data:
+                return validated_data[campo]
+            if instance is not None:
+                return getattr(instance, campo)
+            return Agendamento._meta.get_field(campo).get_default()
+
+        if valor('status') == 'Cancelado':
+            return
+        sala = valor('sala')
+        try:
+            capacidade.garantir_capacidade(
+                sala.id if sala else None,
+                valor('data_hora_inicio'),
+                valor('data_hora_fim'),
+                valor('tipo_agendamento'),
+                excluir_pk=instance.pk if instance else None
+            )
+        except capacidade.CapacidadeExcedida as e:
+            raise serializers.ValidationError(str(e))
     
 # --- Serializer simples para listar as salas ---
 class SalaSerializer(serializers.ModelSerializer):
@@ -1,6 +1,7 @@
 # backend/agendamentos/services.py - VERSÃO FINAL E CORRETA
 
 import logging 
+from itertools import islice
 from django.utils import timezone
 from datetime import datetime,timedelta, time
 from .models import Agendamento, Sala
@@ -10,6 +11,8 @@ from faturamento.models import Pagamento
 from django.contrib.auth import get_user_model
 from faturamento.services.inter_service import gerar_cobranca_pix, gerar_link_pagamento_cartao
 from pacientes.models import Paciente
+from chatbot import catalogo
+from . import disponibilidade, ocupacao
 
 logger = logging.getLogger(__name__)
 
@@ -39,25 +42,22 @@ def buscar_horarios_para_data(data_selecionada, medico_id, especialidade_id):
             "motivo": "O profissional selecionado não atende neste dia da semana."
         }
 
-    agendamentos_existentes = Agendamento.objects.filter(
-        medico=medico,
-        data_hora_inicio__date=data_selecionada,
-        status__in=['Agendado', 'Confirmado']
-    )
-    
-    horarios_ocupados = {ag.data_hora_inicio.astimezone(timezone.get_current_timezone()) for ag in agendamentos_existentes}
-    
+    # Mapa de ocupação do médico neste dia (cache; reconstruído em 1 query se faltar)
+    mapas = ocupacao.carregar_mapas('medico', [medico.id], [data_selecionada])
+    duracao = timedelta(minutes=DURACAO_CONSULTA_MINUTOS)
+    agora = timezone.now()
+
     horarios_disponiveis = []
-    
+
     for jornada in jornadas_do_dia:
-        horario_slot = timezone.make_aware(datetime.datetime.combine(data_selecionada, jornada.hora_inicio))
+        horario_slot = timezone.make_aware(datetime.combine(data_selecionada, jornada.hora_inicio))
         hora_fim_turno = jornada.hora_fim
 
-        while horario_slot.time() < hora_fim_turno:
-            if horario_slot > timezone.now() and horario_slot not in horarios_ocupados:
+        while horario_slot.date() == data_selecionada and horario_slot.time() < hora_fim_turno:
+            if horario_slot > agora and ocupacao.medico_livre(mapas, medico.id, horario_slot, horario_slot + duracao):
                 horarios_disponiveis.append(horario_slot.strftime('%H:%M'))
-            
-            horario_slot += timedelta(minutes=DURACAO_CONSULTA_MINUTOS)
+
+            horario_slot += duracao
 
     if not horarios_disponiveis:
         return {
@@ -72,11 +72,12 @@ def buscar_horarios_para_data(data_selecionada, medico_id, especialidade_id):
         "motivo": None
     }
 
-def buscar_proximo_horario_procedimento(procedimento_id: int):
+def buscar_proximo_horario_procedimento(procedimento_id: int, data_inicial=None):
     """
-    <<-- NOVA LÓGICA -->>
     Busca os próximos horários livres especificamente na SALA DE PROCEDIMENTOS.
     Esta função é usada para EXAMES/PROCEDIMENTOS.
+    Usa os mapas de ocupação da sala em cache (ver agendamentos.ocupacao);
+    com o cache frio, reconstrói os 90 dias em uma única query.
     """
     try:
         # Tenta encontrar a sala por um dos nomes comuns.
@@ -86,42 +87,8 @@ def buscar_proximo_horario_procedimento(procedimento_id: int):
         except Sala.DoesNotExist:
             sala_procedimentos = Sala.objects.get(nome__iexact="Consultório 1")
 
-        # Define uma jornada de trabalho padrão para a sala de procedimentos
-        # (Ex: Segunda a Sábado). Ajuste conforme necessário.
-        jornada_sala = {'hora_inicio': time(8, 0), 'hora_fim': time(18, 0)}
-        agora = timezone.localtime(timezone.now())
-
-        for i in range(90): # Busca nos próximos 90 dias
-            data_atual = agora.date() + timedelta(days=i)
-            # Ignora Domingos
-            if data_atual.weekday() == 6:
-                continue
-            
-            horarios_disponiveis = []
-            slot_atual = datetime.combine(data_atual, jornada_sala['hora_inicio'])
-
-            while slot_atual.time() < jornada_sala['hora_fim']:
-                if timezone.make_aware(slot_atual) > agora:
-                    # Verifica se a SALA tem conflito de agendamento
-                    conflito_sala = Agendamento.objects.filter(
-                        sala=sala_procedimentos,
-                        status__in=['Agendado', 'Confirmado', 'Realizado'],
-                        tipo_agendamento='Procedimento',
-                        data_hora_inicio__lt=timezone.make_aware(slot_atual + timedelta(minutes=50)),
-                        data_hora_fim__gt=timezone.make_aware(slot_atual)
-                    ).exists()
-                    
-                    if not conflito_sala:
-                        horarios_disponiveis.append(slot_atual.strftime('%H:%M'))
-
-                slot_atual += timedelta(minutes=30)
-
-            if horarios_disponiveis:
-                return {
-                    "data": data_atual.strftime('%Y-%m-%d'),
-                    "horarios_disponiveis": horarios_disponiveis
-                }
-        return None
+        slots = disponibilidade.slots_livres_sala_procedimentos(sala_procedimentos.id, data_inicial)
+        return disponibilidade.primeiro_dia_com_horarios(slots)
 
     except Sala.DoesNotExist:
         logger.error("A 'Sala 1' ou 'Consultório 1' não foi encontrada no banco de dados. Não é possível agendar procedimentos.")
@@ -177,69 +144,84 @@ def criar_agendamento_e_pagamento_pendente(agendamento_instance, usuario_logado,
 
     return agendamento
 
-def buscar_proximo_horario_disponivel(medico_id: int):
+def buscar_proximo_horario_disponivel(medico_id: int, data_inicial=None):
     """
     Busca os próximos horários livres para um MÉDICO específico.
     Esta função é usada para CONSULTAS (Presenciais e Telemedicina).
     A lógica verifica apenas a agenda do médico, pois:
     - Para Telemedicina, a sala não importa.
     - Para Presencial, a recepcionista alocará a sala posteriormente.
+    Custa no máximo duas queries (jornadas + reconstrução dos mapas de
+    ocupação que não estiverem em cache), independente de quantos dias/slots
+    forem percorridos. `data_inicial` permite começar a busca a partir de uma
+    data futura (ex: quando o paciente pede "outra data").
     """
     try:
-        medico = CustomUser.objects.get(id=medico_id, cargo='medico')
-        jornadas = JornadaDeTrabalho.objects.filter(medico=medico).order_by('dia_da_semana')
-        if not jornadas.exists():
+        slots = disponibilidade.slots_livres_medico(medico_id, data_inicial)
+        if slots is None:
+            logger.warning(f"Médico com id={medico_id} não encontrado ou sem jornada de trabalho ativa.")
             return None
+        return disponibilidade.primeiro_dia_com_horarios(slots)
 
-        agora = timezone.localtime(timezone.now())
-        
-        for i in range(90): # Busca nos próximos 90 dias
-            data_atual = agora.date() + timedelta(days=i)
-            dia_semana_py = data_atual.weekday() # Segunda=0, Domingo=6
-            
-            # Converte para o padrão do Django (Domingo=1, Sábado=7)
-            dia_semana_django = (dia_semana_py + 2) % 7
-            if dia_semana_django == 0: dia_semana_django = 7
+    except Exception as e:
+        logger.error(f"Erro ao buscar horários para médico {medico_id}: {e}", exc_info=True)
+        return None
 
-            jornada_do_dia = jornadas.filter(dia_da_semana=dia_semana_django).first()
-            if not jornada_do_dia:
-                continue
 
-            horarios_disponiveis = []
-            hora_inicio = jornada_do_dia.hora_inicio
-            hora_fim = jornada_do_dia.hora_fim
-            
-            slot_atual = datetime.combine(data_atual, hora_inicio)
-            
-            while slot_atual.time() < hora_fim:
-                # O slot só é válido se for no futuro
-                if timezone.make_aware(slot_atual) > agora:
-                    # Verifica se o MÉDICO tem conflito de agendamento
-                    conflito_medico = Agendamento.objects.filter(
-                        medico=medico,
-                        status__in=['Agendado', 'Confirmado', 'Realizado'],
-                        data_hora_inicio__lt=timezone.make_aware(slot_atual + timedelta(minutes=50)),
-                        data_hora_fim__gt=timezone.make_aware(slot_atual)
-                    ).exists()
-
-                    if not conflito_medico:
-                        horarios_disponiveis.append(slot_atual.strftime('%H:%M'))
-                
-                slot_atual += timedelta(minutes=30) # Próximo slot a cada 30 min
-
-            if horarios_disponiveis:
-                return {
-                    "data": data_atual.strftime('%Y-%m-%d'),
-                    "horarios_disponiveis": horarios_disponiveis
-                }
-        return None
+def _medicos_da_especialidade(especialidade_id, medicos=None):
+    """{id: médico} dos médicos ativos da especialidade, pelo catálogo em memória (sem query)."""
+    if medicos is None:
+        medicos = catalogo.medicos(especialidade_id)
+    return {medico['id']: medico for medico in medicos}
+
+
+def buscar_primeiros_horarios_especialidade(especialidade_id, quantidade=5, data_inicial=None):
+    """
+    Retorna os `quantidade` horários livres mais cedo entre TODOS os médicos
+    da especialidade, em ordem cronológica. Custa no máximo duas queries
+    (jornadas e mapas de ocupação fora do cache), qualquer que seja o número
+    de médicos.
+    """
+    medicos = _medicos_da_especialidade(especialidade_id)
+    if not medicos:
+        return []
+
+    slots = disponibilidade.slots_livres_medicos(list(medicos), data_inicial)
+    resultado = []
+    for slot, medico_id in islice(slots, quantidade):
+        slot_local = timezone.localtime(slot)
+        medico = medicos[medico_id]
+        resultado.append({
+            "medico_id": medico_id,
+            "medico_nome": f"{medico['first_name']} {medico['last_name']}",
+            "data": slot_local.strftime('%Y-%m-%d'),
+            "horario": slot_local.strftime('%H:%M'),
+            "data_hora_inicio": slot_local.isoformat(),
+        })
+    return resultado
+
+
+def buscar_primeiro_medico_disponivel(especialidade_id, data_inicial=None, medicos=None):
+    """
+    Usado pelo chatbot: encontra o médico da especialidade com o horário
+    livre mais cedo e devolve (medico, horarios), onde `horarios` tem o
+    formato de buscar_proximo_horario_disponivel. Retorna (None, None) se
+    ninguém tiver agenda nos próximos dias. `medicos` é a lista do catálogo,
+    se quem chama já a tiver.
+    """
+    try:
+        medicos = _medicos_da_especialidade(especialidade_id, medicos)
+        if not medicos:
+            return None, None
+        slots = disponibilidade.slots_livres_medicos(list(medicos), data_inicial)
+        medico_id, horarios = disponibilidade.primeiro_medico_com_horarios(slots)
+        if medico_id is None:
+            return None, None
+        return medicos[medico_id], horarios
 
-    except CustomUser.DoesNotExist:
-        logger.error(f"Médico com id={medico_id} não encontrado.")
-        return None
     except Exception as e:
-        logger.error(f"Erro ao buscar horários para médico {medico_id}: {e}", exc_info=True)
-        return None
+        logger.error(f"Erro ao buscar horários para a especialidade {especialidade_id}: {e}", exc_info=True)
+        return None, None
 
 
 def listar_agendamentos_futuros(cpf):
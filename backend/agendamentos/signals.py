@@ -0,0 +1,72 @@
+# backend/agendamentos/signals.py
+"""
+Mantém os mapas de ocupação (agendamentos.ocupacao) coerentes com o banco:
+toda gravação/remoção de Agendamento invalida os dias afetados, tanto do
+horário antigo quanto do novo (remarcação, troca de médico ou de sala).
+
+Também muda os ETags do calendário (agendamentos.calendario) quando salas,
+médicos, especialidades ou procedimentos, cujos nomes aparecem nos eventos,
+são alterados.
+"""
+
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from faturamento.models import Procedimento
+from usuarios.models import CustomUser, Especialidade
+from .models import Agendamento, Sala
+from . import calendario, ocupacao
+
+CAMPOS_OCUPACAO = ('medico_id', 'sala_id', 'data_hora_inicio', 'data_hora_fim')
+_CAMPOS_GRAVADOS = {'medico', 'sala', *CAMPOS_OCUPACAO}
+
+
+def _retrato(agendamento):
+    return (agendamento.medico_id, agendamento.sala_id, agendamento.data_hora_inicio, agendamento.data_hora_fim)
+
+
+@receiver(pre_save, sender=Agendamento)
+def guardar_estado_original(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Lido do banco só na gravação (e não em todo objeto instanciado): é o
+    # horário que estava valendo, mesmo que a instância tenha sido carregada
+    # com .only() ou esteja desatualizada.
+    instance._ocupacao_original = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not _CAMPOS_GRAVADOS & set(update_fields):
+        return
+    instance._ocupacao_original = Agendamento.objects.filter(pk=instance.pk).values_list(*CAMPOS_OCUPACAO).first()
+
+
+@receiver(post_save, sender=Agendamento)
+def invalidar_ocupacao_ao_salvar(sender, instance, **kwargs):
+    original = getattr(instance, '_ocupacao_original', None)
+    atual = _retrato(instance)
+    if original and original != atual:
+        ocupacao.invalidar(*original)
+    ocupacao.invalidar(*atual)
+    instance._ocupacao_original = None
+
+
+@receiver(post_delete, sender=Agendamento)
+def invalidar_ocupacao_ao_remover(sender, instance, **kwargs):
+    ocupacao.invalidar(*_retrato(instance))
+
+
+@receiver(post_save, sender=Sala)
+@receiver(post_delete, sender=Sala)
+@receiver(post_save, sender=Especialidade)
+@receiver(post_delete, sender=Especialidade)
+@receiver(post_save, sender=Procedimento)
+@receiver(post_delete, sender=Procedimento)
+def invalidar_nomes_do_calendario(sender, **kwargs):
+    calendario.invalidar_nomes()
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidar_nomes_do_calendario_medico(sender, instance, update_fields=None, **kwargs):
+    # O login grava last_login a cada acesso: não muda nome nenhum
+    if instance.cargo != 'medico' or update_fields == frozenset({'last_login'}):
+        return
+    calendario.invalidar_nomes()
@@ -1,3 +1,339 @@
-from django.test import TestCase
+import threading
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from faturamento.models import Pagamento
+from pacientes.models import Paciente
+from usuarios.models import CustomUser, Especialidade, JornadaDeTrabalho
+from . import expiracao, ocupacao, services
+from .capacidade import CAPACIDADE_POR_TIPO, CapacidadeExcedida, garantir_capacidade
+from .models import Agendamento, Sala
+
+
+def criar_paciente(indice):
+    return Paciente.objects.create(
+        nome_completo=f'Paciente {indice}', data_nascimento=date(1990, 1, 1),
+        cpf=f'{indice:011d}', telefone_celular='11999999999',
+    )
+
+
+@skipUnless(connection.vendor == 'postgresql', 'a trava por sala/dia só é exercida de verdade no Postgres')
+class CapacidadeConcorrenteTests(TransactionTestCase):
+    """Reservas simultâneas no mesmo horário não passam da capacidade da sala."""
+
+    RESERVAS = 12
+
+    def setUp(self):
+        self.sala = Sala.objects.create(nome='Consultório 1')
+        self.pacientes = [criar_paciente(i) for i in range(self.RESERVAS)]
+        self.inicio = timezone.make_aware(datetime.combine(date.today() + timedelta(days=7), time(10)))
+        self.fim = self.inicio + timedelta(minutes=30)
+
+    def _reservar_em_paralelo(self, tipo_agendamento, sala_de):
+        barreira = threading.Barrier(self.RESERVAS)
+        resultados = []
+
+        def reservar(paciente):
+            sala = sala_de(paciente)
+            try:
+                barreira.wait()
+                with transaction.atomic():
+                    garantir_capacidade(sala.id, self.inicio, self.fim, tipo_agendamento)
+                    Agendamento.objects.create(
+                        paciente=paciente, sala=sala, tipo_agendamento=tipo_agendamento,
+                        data_hora_inicio=self.inicio, data_hora_fim=self.fim,
+                    )
+                resultados.append('ok')
+            except CapacidadeExcedida:
+                resultados.append('cheia')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=reservar, args=(paciente,)) for paciente in self.pacientes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return resultados
+
+    def test_consultas_simultaneas_respeitam_capacidade(self):
+        resultados = self._reservar_em_paralelo('Consulta', lambda paciente: self.sala)
+
+        capacidade = CAPACIDADE_POR_TIPO['Consulta']
+        self.assertEqual(resultados.count('ok'), capacidade)
+        self.assertEqual(resultados.count('cheia'), self.RESERVAS - capacidade)
+        self.assertEqual(Agendamento.objects.filter(sala=self.sala).count(), capacidade)
+
+    def test_procedimentos_simultaneos_respeitam_capacidade(self):
+        resultados = self._reservar_em_paralelo('Procedimento', lambda paciente: self.sala)
+
+        self.assertEqual(resultados.count('ok'), CAPACIDADE_POR_TIPO['Procedimento'])
+        self.assertEqual(Agendamento.objects.filter(sala=self.sala).count(), CAPACIDADE_POR_TIPO['Procedimento'])
+
+    def test_salas_diferentes_nao_se_bloqueiam(self):
+        salas = {paciente.id: Sala.objects.create(nome=f'Sala {paciente.id}') for paciente in self.pacientes}
+
+        resultados = self._reservar_em_paralelo('Procedimento', lambda paciente: salas[paciente.id])
+
+        self.assertEqual(resultados, ['ok'] * self.RESERVAS)
+
+
+class CapacidadeNaGravacaoTests(TestCase):
+    """
+    A API recusa agendamentos acima da capacidade da sala, inclusive quando a
+    checagem rápida da validação (mapas em cache) não vê a reserva concorrente:
+    o create/update do serializer confere de novo com a sala travada
+    (select_for_update fora do Postgres).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.especialidade = Especialidade.objects.create(nome='Cardiologia', valor_consulta=Decimal('250.00'))
+        cls.medico = CustomUser.objects.create_user(username='medico', password='x', cargo='medico')
+        cls.recepcao = CustomUser.objects.create_user(username='recepcao', password='x', cargo='recepcao')
+        cls.sala = Sala.objects.create(nome='Consultório 2')
+        cls.inicio = timezone.make_aware(datetime.combine(date.today() + timedelta(days=7), time(10)))
+        cls.fim = cls.inicio + timedelta(minutes=30)
+        for indice in range(CAPACIDADE_POR_TIPO['Consulta']):
+            cls._consulta(criar_paciente(indice), cls.inicio)
+
+    @classmethod
+    def _consulta(cls, paciente, inicio):
+        return Agendamento.objects.create(
+            paciente=paciente, medico=cls.medico, especialidade=cls.especialidade, sala=cls.sala,
+            tipo_agendamento='Consulta', data_hora_inicio=inicio, data_hora_fim=inicio + timedelta(minutes=30),
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.recepcao)
+
+    def sem_checagem_do_cache(self):
+        # Simula a reserva concorrente que ainda não estava nos mapas quando a validação rodou
+        return mock.patch.object(ocupacao, 'ocupacao_maxima_sala', return_value=0)
+
+    def _payload(self, paciente):
+        return {
+            'paciente': paciente.id, 'medico': self.medico.id, 'especialidade': self.especialidade.id,
+            'sala': self.sala.id, 'tipo_agendamento': 'Consulta', 'modalidade': 'Presencial',
+            'data_hora_inicio': self.inicio.isoformat(), 'data_hora_fim': self.fim.isoformat(),
+        }
+
+    def test_criacao_acima_da_capacidade(self):
+        payload = self._payload(criar_paciente(50))
+
+        for checagem_do_cache in (True, False):
+            with self.subTest(checagem_do_cache=checagem_do_cache):
+                if checagem_do_cache:
+                    resposta = self.client.post(reverse('lista-agendamentos'), payload, format='json')
+                else:
+                    with self.sem_checagem_do_cache():
+                        resposta = self.client.post(reverse('lista-agendamentos'), payload, format='json')
+
+                self.assertEqual(resposta.status_code, 400, resposta.data)
+                self.assertIn('capacidade máxima', str(resposta.data))
+                self.assertEqual(Agendamento.objects.filter(sala=self.sala).count(), CAPACIDADE_POR_TIPO['Consulta'])
+
+    def test_criacao_com_vaga(self):
+        Agendamento.objects.filter(sala=self.sala).first().delete()
+
+        with self.sem_checagem_do_cache():
+            resposta = self.client.post(reverse('lista-agendamentos'), self._payload(criar_paciente(50)), format='json')
+
+        self.assertEqual(resposta.status_code, 201, resposta.data)
+
+    def test_edicao_para_horario_cheio(self):
+        outro_horario = self._consulta(criar_paciente(50), self.inicio + timedelta(hours=2))
+
+        with self.sem_checagem_do_cache():
+            resposta = self.client.patch(
+                reverse('detalhe-agendamento', args=[outro_horario.id]),
+                {'sala': self.sala.id, 'data_hora_inicio': self.inicio.isoformat(), 'data_hora_fim': self.fim.isoformat()},
+                format='json',
+            )
+
+        self.assertEqual(resposta.status_code, 400, resposta.data)
+        self.assertIn('capacidade máxima', str(resposta.data))
+        outro_horario.refresh_from_db()
+        self.assertEqual(outro_horario.data_hora_inicio, self.inicio + timedelta(hours=2))
+
+    def test_cancelado_nao_ocupa_vaga(self):
+        Agendamento.objects.filter(sala=self.sala).update(status='Cancelado')
+        outro_horario = self._consulta(criar_paciente(50), self.inicio + timedelta(hours=2))
+
+        resposta = self.client.patch(
+            reverse('detalhe-agendamento', args=[outro_horario.id]),
+            {'sala': self.sala.id, 'data_hora_inicio': self.inicio.isoformat(), 'data_hora_fim': self.fim.isoformat()},
+            format='json',
+        )
+
+        self.assertEqual(resposta.status_code, 200, resposta.data)
+
+
+class OrcamentoDeQueriesDaAgendaTests(TestCase):
+    """As listagens da agenda custam o mesmo número de queries com 3 ou 30 agendamentos."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.especialidade = Especialidade.objects.create(nome='Cardiologia', valor_consulta=Decimal('250.00'))
+        cls.medico = CustomUser.objects.create_user(username='medico', password='x', cargo='medico', first_name='Ana')
+        cls.recepcao = CustomUser.objects.create_user(username='recepcao', password='x', cargo='recepcao')
+        cls.sala = Sala.objects.create(nome='Consultório 1')
+        cls.hoje = timezone.make_aware(datetime.combine(timezone.localdate(), time(23)))
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def _criar_agendamentos(self, quantidade, inicio_indice=0):
+        for indice in range(inicio_indice, inicio_indice + quantidade):
+            paciente = criar_paciente(indice)
+            inicio = self.hoje + timedelta(minutes=indice)
+            agendamento = Agendamento.objects.create(
+                paciente=paciente, medico=self.medico, especialidade=self.especialidade,
+                sala=self.sala if indice % 2 else None, modalidade='Presencial',
+                data_hora_inicio=inicio, data_hora_fim=inicio + timedelta(minutes=20),
+            )
+            if indice % 3 == 0:
+                Pagamento.objects.create(
+                    agendamento=agendamento, paciente=paciente, valor=Decimal('250.00'), registrado_por=self.recepcao
+                )
+
+    def _queries_por_endpoint(self):
+        endpoints = [
+            ('minha-agenda', self.medico, {}),
+            ('lista-agendamentos-hoje', self.recepcao, {}),
+            ('lista-agendamentos-hoje', self.recepcao, {'medico_id': self.medico.id}),
+            ('lista-espera', self.recepcao, {}),
+            ('lista-agendamentos', self.recepcao, {}),
+            ('lista-agendamentos-nao-pagos', self.recepcao, {}),
+        ]
+        queries = []
+        for nome, usuario, parametros in endpoints:
+            self.client.force_authenticate(usuario)
+            with CaptureQueriesContext(connection) as capturadas:
+                resposta = self.client.get(reverse(nome), parametros)
+            self.assertEqual(resposta.status_code, 200, nome)
+            queries.append((nome, parametros, len(capturadas), len(resposta.data)))
+        return queries
+
+    def test_listagens_em_uma_query(self):
+        self._criar_agendamentos(3)
+        poucos = self._queries_por_endpoint()
+        self._criar_agendamentos(27, inicio_indice=3)
+        muitos = self._queries_por_endpoint()
+
+        for (nome, parametros, quantidade, linhas), (_, _, quantidade_antes, linhas_antes) in zip(muitos, poucos):
+            with self.subTest(endpoint=nome, parametros=parametros):
+                self.assertGreater(linhas, linhas_antes)
+                self.assertEqual(quantidade, quantidade_antes)
+                self.assertLessEqual(quantidade, 2)
+
+    def test_agenda_do_dia(self):
+        self._criar_agendamentos(10)
+        self.client.force_authenticate(self.recepcao)
+
+        with self.assertNumQueries(1):
+            resposta = self.client.get(reverse('lista-agendamentos-hoje'))
+
+        self.assertEqual(len(resposta.data), 10)
+        primeiro = resposta.data[0]
+        self.assertEqual(primeiro['paciente_nome'], 'Paciente 0')
+        self.assertEqual(primeiro['status_pagamento'], 'Pendente')
+        self.assertEqual(resposta.data[1]['status_pagamento'], None)
+
+
+class ProximoHorarioLivreTests(TestCase):
+    """Próximo dia com horários livres de um médico, a partir das jornadas e dos mapas de ocupação."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.medico = CustomUser.objects.create_user(username='medico', password='x', cargo='medico')
+        cls.especialidade = Especialidade.objects.create(nome='Cardiologia', valor_consulta=Decimal('250.00'))
+        JornadaDeTrabalho.objects.create(
+            medico=cls.medico, dia_da_semana=JornadaDeTrabalho.DiaSemana.SEGUNDA, hora_inicio=time(8), hora_fim=time(9, 30),
+        )
+        # Jornada desativada no domingo: não pode oferecer horário
+        JornadaDeTrabalho.objects.create(
+            medico=cls.medico, dia_da_semana=JornadaDeTrabalho.DiaSemana.DOMINGO, hora_inicio=time(8), hora_fim=time(12),
+            ativo=False,
+        )
+        hoje = date.today()
+        cls.domingo = hoje + timedelta(days=14 + (6 - hoje.weekday()))
+        cls.segunda = cls.domingo + timedelta(days=1)
+
+    def setUp(self):
+        cache.clear()
+
+    def _agendar(self, hora, status='Agendado'):
+        inicio = timezone.make_aware(datetime.combine(self.segunda, hora))
+        return Agendamento.objects.create(
+            paciente=criar_paciente(Agendamento.objects.count()), medico=self.medico, especialidade=self.especialidade,
+            tipo_agendamento='Consulta', data_hora_inicio=inicio, data_hora_fim=inicio + timedelta(minutes=30),
+            status=status,
+        )
+
+    def test_segunda_da_jornada_e_a_segunda_do_calendario(self):
+        horarios = services.buscar_proximo_horario_disponivel(self.medico.id, data_inicial=self.domingo)
+
+        self.assertEqual(self.segunda.weekday(), 0)
+        self.assertEqual(horarios, {
+            'data': self.segunda.strftime('%Y-%m-%d'),
+            'horarios_disponiveis': ['08:00', '08:30', '09:00'],
+        })
+
+    def test_cancelado_nao_bloqueia_o_horario(self):
+        self._agendar(time(8), status='Cancelado')
+        self._agendar(time(9))
+
+        horarios = services.buscar_proximo_horario_disponivel(self.medico.id, data_inicial=self.domingo)
+
+        # 08:30 + 50 minutos de consulta esbarra no agendamento das 09:00
+        self.assertEqual(horarios['horarios_disponiveis'], ['08:00'])
+
+    def test_sem_jornada_ativa(self):
+        JornadaDeTrabalho.objects.filter(medico=self.medico).update(ativo=False)
+
+        self.assertIsNone(services.buscar_proximo_horario_disponivel(self.medico.id, data_inicial=self.domingo))
+
+
+class ExpiracaoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.inicio = timezone.now() + timedelta(days=3)
+        cls.recepcao = CustomUser.objects.create_user(username='recepcao', password='x', cargo='recepcao')
+
+    def _agendamento(self, indice, expira_em):
+        return Agendamento.objects.create(
+            paciente=criar_paciente(indice), tipo_agendamento='Consulta', data_hora_inicio=self.inicio,
+            data_hora_fim=self.inicio + timedelta(minutes=30), expira_em=expira_em,
+        )
+
+    def test_cancela_so_os_vencidos(self):
+        # "agora" no fuso local: o banco compara instantes, não o texto da data
+        agora = timezone.localtime(timezone.now())
+        vencido = self._agendamento(1, agora - timedelta(minutes=1))
+        no_limite = self._agendamento(2, agora)
+        no_prazo = self._agendamento(3, agora + timedelta(minutes=1))
+        Pagamento.objects.create(
+            agendamento=vencido, paciente=vencido.paciente, valor=Decimal('100.00'), registrado_por=self.recepcao
+        )
+
+        ids = expiracao.cancelar_expirados(agora)
+
+        self.assertCountEqual(ids, [vencido.id, no_limite.id])
+        self.assertEqual(
+            dict(Agendamento.objects.values_list('id', 'status')),
+            {vencido.id: 'Cancelado', no_limite.id: 'Cancelado', no_prazo.id: 'Agendado'},
+        )
+        self.assertEqual(Pagamento.objects.get(agendamento=vencido).status, 'Expirado')
+        self.assertEqual(expiracao.cancelar_expirados(agora), [])
@@ -14,7 +14,9 @@ from .views import (
     TelemedicinaListView,
     ExecutarCancelamentosExpiradosView,
     VerificarCapacidadeHorarioAPIView,
-    HorariosDisponiveisAPIView
+    MapaOcupacaoSalasAPIView,
+    HorariosDisponiveisAPIView,
+    PrimeirosHorariosEspecialidadeAPIView
 )
 
 urlpatterns = [
@@ -22,6 +24,7 @@ urlpatterns = [
     path('<int:pk>/', AgendamentoDetailAPIView.as_view(), name='detalhe-agendamento'),
     path('nao-pagos/', AgendamentosNaoPagosListAPIView.as_view(), name='lista-agendamentos-nao-pagos'),
     path('horarios-disponiveis/', HorariosDisponiveisAPIView.as_view(), name='horarios-disponiveis'),
+    path('horarios-especialidade/', PrimeirosHorariosEspecialidadeAPIView.as_view(), name='horarios-especialidade'),
     path('salas/', SalaListView.as_view(), name='lista-salas'),
     path('espera/', ListaEsperaListView.as_view(), name='lista-espera'),
     path('hoje/', AgendamentosHojeListView.as_view(), name='lista-agendamentos-hoje'),
@@ -30,5 +33,6 @@ urlpatterns = [
     path('telemedicina/', TelemedicinaListView.as_view(), name='lista-telemedicina'),
     path('executar-cancelamentos/', ExecutarCancelamentosExpiradosView.as_view(), name='executar-cancelamentos'),
     path('verificar-capacidade/', VerificarCapacidadeHorarioAPIView.as_view(), name='verificar-capacidade'),
+    path('mapa-ocupacao/', MapaOcupacaoSalasAPIView.as_view(), name='mapa-ocupacao'),
     path('minha-agenda/', MinhaAgendaView.as_view(), name='minha-agenda'),
 ]
\ No newline at end of file
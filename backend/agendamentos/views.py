@@ -7,15 +7,16 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from usuarios.permissions import IsRecepcaoOrAdmin, IsAdminUser
 from django.utils.dateparse import parse_datetime, parse_date
 from .models import Agendamento, Sala
-from .serializers import AgendamentoSerializer, AgendamentoWriteSerializer, SalaSerializer
+from .serializers import AgendamentoSerializer, AgendamentoWriteSerializer, SalaSerializer, AgendaLeituraSerializer, preparar_listagem, projetar_agenda
 from django.utils import timezone
-from django.core.mail import send_mail
 from faturamento.models import Pagamento, Procedimento
 import datetime # ALTERADO: Importe o módulo datetime inteiro
 import requests
 import os
 from usuarios.permissions import IsRecepcaoOrAdmin, IsAdminUser, AllowRead_WriteRecepcaoAdmin
 from . import services # <-- 1. IMPORTE O NOVO MÓDULO DE SERVIÇOS
+from . import calendario, capacidade, lembretes, expiracao, mapa_ocupacao
+from django.utils.cache import get_conditional_response
 from rest_framework_api_key.permissions import HasAPIKey
 # Importa a classe do nosso comando de cancelamento
 from .management.commands.cancelar_agendamentos_expirados import Command as CancelarAgendamentosCommand
@@ -38,9 +39,8 @@ class AgendamentoListCreateAPIView(generics.ListCreateAPIView):
         """
         Adiciona a capacidade de filtrar agendamentos por sala.
         """
-        queryset = Agendamento.objects.all().select_related(
-            'paciente', 'medico', 'especialidade', 'sala' # Adiciona 'sala' para otimizar a query
-        ).order_by('data_hora_inicio')
+        # select_related + primeira_consulta anotada (ver serializers.preparar_listagem)
+        queryset = preparar_listagem(Agendamento.objects.all()).order_by('data_hora_inicio')
         
         # Filtro por sala (usado pelo FullCalendar para a visão de recursos)
         sala_id = self.request.query_params.get('sala_id')
@@ -54,6 +54,44 @@ class AgendamentoListCreateAPIView(generics.ListCreateAPIView):
             
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        """
+        Com `start` e `end` (enviados pelo FullCalendar) responde no modo feed:
+        só a janela pedida, paginada por cursor, projeção enxuta e ETag/304.
+        Sem esses parâmetros mantém a listagem completa de antes.
+        """
+        start = request.query_params.get('start')
+        end = request.query_params.get('end')
+        if not (start and end):
+            return super().list(request, *args, **kwargs)
+
+        try:
+            inicio = calendario.interpretar_limite_da_janela(start)
+            fim = calendario.interpretar_limite_da_janela(end)
+            limite = min(max(int(request.query_params.get('limite', calendario.LIMITE_PADRAO)), 1), calendario.LIMITE_MAXIMO)
+        except (calendario.ParametroInvalido, ValueError) as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        sala_id = request.query_params.get('sala_id')
+        medico_id = request.query_params.get('medico_id')
+        cursor = request.query_params.get('cursor')
+        queryset = calendario.queryset_da_janela(inicio, fim, sala_id, medico_id)
+
+        etag = calendario.calcular_etag(queryset, inicio.isoformat(), fim.isoformat(), sala_id, medico_id, cursor, limite)
+        nao_modificado = get_conditional_response(request, etag=etag)
+        if nao_modificado is not None:
+            return nao_modificado
+
+        try:
+            pagina = calendario.montar_pagina(queryset, cursor, limite)
+        except calendario.ParametroInvalido as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = Response(pagina, status=status.HTTP_200_OK)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
     def get_serializer_class(self):
         if self.request.method == 'POST':
             return AgendamentoWriteSerializer
@@ -77,22 +115,22 @@ class AgendamentosNaoPagosListAPIView(generics.ListAPIView):
     serializer_class = AgendamentoSerializer
     permission_classes = [IsAuthenticated, IsRecepcaoOrAdmin]
     def get_queryset(self):
-        return Agendamento.objects.filter(pagamento__isnull=True).order_by('data_hora_inicio')
+        return preparar_listagem(Agendamento.objects.filter(pagamento__isnull=True)).order_by('data_hora_inicio')
 
 # ALTERADA: Agora aceita o filtro por médico
 class AgendamentosHojeListView(generics.ListAPIView):
-    serializer_class = AgendamentoSerializer
+    serializer_class = AgendaLeituraSerializer
     permission_classes = [IsAuthenticated]
     def get_queryset(self):
         hoje = timezone.localtime(timezone.now()).date()
-        queryset = Agendamento.objects.filter(data_hora_inicio__date=hoje).order_by('data_hora_inicio')
+        queryset = Agendamento.objects.filter(data_hora_inicio__date=hoje)
         
         # Lógica de filtro adicionada
         medico_id = self.request.query_params.get('medico_id')
         if medico_id:
             queryset = queryset.filter(medico_id=medico_id)
             
-        return queryset
+        return projetar_agenda(queryset).order_by('data_hora_inicio')
 
 # --- NOVA VIEW PARA O VERIFICADOR DE DISPONIBILIDADE ---
 class HorariosDisponiveisAPIView(APIView):
@@ -121,6 +159,45 @@ class HorariosDisponiveisAPIView(APIView):
 
         horarios = services.buscar_horarios_para_data(data_selecionada, medico_id, especialidade_id)
         return Response(horarios, status=status.HTTP_200_OK)
+
+
+class PrimeirosHorariosEspecialidadeAPIView(APIView):
+    """
+    Primeiros horários livres entre todos os médicos de uma especialidade.
+    Parâmetros: especialidade_id (obrigatório), quantidade (padrão 5, máx. 50)
+    e data_inicial (AAAA-MM-DD, opcional).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        especialidade_id = request.query_params.get('especialidade_id')
+        if not especialidade_id:
+            return Response(
+                {'detail': 'O parâmetro "especialidade_id" é obrigatório.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            especialidade_id = int(especialidade_id)
+            quantidade = min(max(int(request.query_params.get('quantidade', 5)), 1), 50)
+        except ValueError:
+            return Response(
+                {'detail': '"especialidade_id" e "quantidade" devem ser números inteiros.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        data_inicial = None
+        data_str = request.query_params.get('data_inicial')
+        if data_str:
+            data_inicial = parse_date(data_str)
+            if not data_inicial:
+                return Response(
+                    {'detail': 'Formato de data inválido. Use AAAA-MM-DD.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        horarios = services.buscar_primeiros_horarios_especialidade(especialidade_id, quantidade, data_inicial)
+        return Response({'especialidade_id': especialidade_id, 'horarios': horarios}, status=status.HTTP_200_OK)
     
 # <<-- CLASSE CORRIGIDA -->>
 class ListaEsperaListView(generics.ListAPIView):
@@ -130,7 +207,7 @@ class ListaEsperaListView(generics.ListAPIView):
     início do dia de hoje.
     """
     permission_classes = [IsAuthenticated]
-    serializer_class = AgendamentoSerializer
+    serializer_class = AgendaLeituraSerializer
 
     def get_queryset(self):
         # Pega a data de hoje no fuso horário local do servidor
@@ -139,11 +216,11 @@ class ListaEsperaListView(generics.ListAPIView):
         inicio_do_dia_de_hoje = timezone.make_aware(datetime.datetime.combine(hoje, datetime.time.min))
 
         # Filtra por agendamentos sem sala que são do dia de hoje em diante.
-        return Agendamento.objects.filter(
+        return projetar_agenda(Agendamento.objects.filter(
             sala__isnull=True,
             modalidade='Presencial',  # <-- ESSA É A NOVA CONDIÇÃO
             data_hora_inicio__gte=inicio_do_dia_de_hoje
-        ).order_by('data_hora_inicio')
+        )).order_by('data_hora_inicio')
     
 # --- VIEW DE ENVIO DE LEMBRETES COM A CORREÇÃO DE FUSO HORÁRIO ---
 class EnviarLembretesCronView(APIView):
@@ -156,59 +233,19 @@ class EnviarLembretesCronView(APIView):
         if not SECRET_KEY_CRON or provided_key != SECRET_KEY_CRON:
             return Response({'detail': 'Acesso não autorizado.'}, status=status.HTTP_401_UNAUTHORIZED)
 
-        # A lógica para encontrar os agendamentos está correta
-        agora = timezone.localtime(timezone.now())
-        amanha = agora.date() + datetime.timedelta(days=1)
-        inicio_de_amanha = timezone.make_aware(datetime.datetime.combine(amanha, datetime.time.min))
-        fim_de_amanha = timezone.make_aware(datetime.datetime.combine(amanha, datetime.time.max))
-
-        agendamentos_de_amanha = Agendamento.objects.filter(
-            data_hora_inicio__gte=inicio_de_amanha,
-            data_hora_inicio__lte=fim_de_amanha,
-            status='Confirmado'
-        ).select_related('paciente')
+        # Uma query para os agendamentos; e-mails por uma única conexão SMTP e
+        # registro dos já enviados (rodar de novo não repete lembretes).
+        agendamentos_de_amanha = lembretes.buscar_agendamentos_de_amanha(status=['Confirmado'])
 
-        if not agendamentos_de_amanha.exists():
+        if not agendamentos_de_amanha:
             return Response({'status': 'Nenhum agendamento para amanhã.'})
 
-        # --- BLOCO DE CÓDIGO RESTAURADO ---
-        total_enviado = 0
-        falhas = 0
-        for agendamento in agendamentos_de_amanha:
-            paciente = agendamento.paciente
-            if paciente.email:
-                hora_local = timezone.localtime(agendamento.data_hora_inicio)
-                data_formatada = hora_local.strftime('%d/%m/%Y')
-                hora_formatada = hora_local.strftime('%H:%M')
-
-                assunto = f"Lembrete de Consulta - Clínica Limalé"
-                mensagem = f"""
-                Olá, {paciente.nome_completo}!
-
-                Este é um lembrete da sua consulta amanhã, dia {data_formatada} às {hora_formatada}.
-
-                Se precisar reagendar, por favor, entre em contato.
-
-                Atenciosamente,
-                Clínica Limalé
-                """
-                
-                try:
-                    # Esta é a função que realmente envia o email
-                    send_mail(
-                        subject=assunto,
-                        message=mensagem,
-                        from_email=None,  # Usa o DEFAULT_FROM_EMAIL do settings.py
-                        recipient_list=[paciente.email],
-                        fail_silently=False,
-                    )
-                    total_enviado += 1
-                except Exception as e:
-                    # Se houver uma falha, registamos o erro
-                    print(f"Falha ao enviar email para {paciente.email}: {e}")
-                    falhas += 1
-        
-        return Response({'status': f'Processo concluído. {total_enviado} emails enviados, {falhas} falhas.'})
+        resumo = lembretes.enviar_emails(agendamentos_de_amanha)
+
+        return Response({
+            'status': f"Processo concluído. {resumo['enviados']} emails enviados, {resumo['falhas']} falhas, {resumo['ignorados']} ignorados.",
+            'resumo': resumo
+        })
 
 # --- VIEW DE TELEMEDICINA COM A CORREÇÃO DE FUSO HORÁRIO ---
 class CriarSalaTelemedicinaView(APIView):
@@ -278,46 +315,28 @@ class TelemedicinaListView(generics.ListAPIView):
         # return Agendamento.objects.filter(procedimento__descricao__icontains='Telemedicina', ...)
         
         # ...filtramos diretamente pela nova flag de modalidade. É mais limpo e seguro.
-        return Agendamento.objects.filter(
+        return preparar_listagem(Agendamento.objects.filter(
             data_hora_inicio__gte=hoje,
             modalidade='Telemedicina'
-        ).order_by('data_hora_inicio').select_related('paciente', 'procedimento')
+        )).order_by('data_hora_inicio')
 
 class ExecutarCancelamentosExpiradosView(APIView):
     permission_classes = [HasAPIKey]
 
     def post(self, request, *args, **kwargs):
         agora_utc = timezone.now()
-        
-        debug_info = {
-            "horario_atual_utc": agora_utc.isoformat(),
-            "agendamentos_pendentes_count": 0,
-            "detalhes_pendentes": []
-        }
 
-        # Primeiro, buscamos todos os agendamentos pendentes para inspecionar
-        agendamentos_pendentes = Agendamento.objects.filter(
-            status='Agendado', 
-            expira_em__isnull=False
-        )
-        debug_info["agendamentos_pendentes_count"] = agendamentos_pendentes.count()
-        
-        for ag in agendamentos_pendentes:
-            debug_info["detalhes_pendentes"].append({
-                "id": ag.id,
-                "expira_em_utc": ag.expira_em.isoformat() if ag.expira_em else None,
-                "expirado": ag.expira_em < agora_utc if ag.expira_em else False
-            })
-
-        # Agora, filtramos de verdade para ver quais realmente expiraram
-        agendamentos_para_cancelar = agendamentos_pendentes.filter(expira_em__lte=agora_utc)
-        
-        total_cancelados = agendamentos_para_cancelar.update(status='Cancelado')
-        
+        # Cancela só o que venceu (UPDATE ... RETURNING pelo índice parcial) e
+        # expira os pagamentos pendentes na mesma transação
+        cancelados = expiracao.cancelar_expirados(agora_utc)
+
         return Response({
             "status": "sucesso", 
-            "cancelados": total_cancelados,
-            "debug_info": debug_info
+            "cancelados": len(cancelados),
+            "debug_info": {
+                "horario_atual_utc": agora_utc.isoformat(),
+                "ids_cancelados": cancelados
+            }
         }, status=status.HTTP_200_OK)
 
 # --- NOVA VIEW PARA VERIFICAR CAPACIDADE ---
@@ -343,27 +362,59 @@ class VerificarCapacidadeHorarioAPIView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        conflitos = Agendamento.objects.filter(
-            data_hora_inicio__lt=fim, 
-            data_hora_fim__gt=inicio,
-        ).exclude(status='Cancelado')
-
-        consultas_agendadas = conflitos.filter(tipo_agendamento='Consulta').count()
-        procedimentos_agendados = conflitos.filter(tipo_agendamento='Procedimento').count()
+        # Uma única query com agregação condicional para os dois tipos
+        conflitos = capacidade.contar_sobreposicoes(inicio, fim)
 
         return Response({
-            'consultas_agendadas': consultas_agendadas,
-            'procedimentos_agendados': procedimentos_agendados
+            'consultas_agendadas': conflitos['Consulta'],
+            'procedimentos_agendados': conflitos['Procedimento']
         }, status=status.HTTP_200_OK)
 
+class MapaOcupacaoSalasAPIView(APIView):
+    """
+    Ocupação de todas as salas em uma janela (dia/semana), por slot e tipo,
+    para a recepção montar o mapa de calor com uma única requisição.
+    Parâmetros: inicio e fim (ISO 8601 ou AAAA-MM-DD) e slot (minutos, padrão 30).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        inicio_str = request.query_params.get('inicio')
+        fim_str = request.query_params.get('fim')
+        if not inicio_str or not fim_str:
+            return Response(
+                {'detail': 'Parâmetros "inicio" e "fim" são obrigatórios.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            inicio = calendario.interpretar_limite_da_janela(inicio_str)
+            fim = calendario.interpretar_limite_da_janela(fim_str)
+            slot_minutos = int(request.query_params.get('slot', mapa_ocupacao.SLOT_PADRAO_MINUTOS))
+            mapa_ocupacao.validar_janela(inicio, fim, slot_minutos)
+        except (calendario.ParametroInvalido, ValueError) as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        etag = calendario.calcular_etag(
+            mapa_ocupacao.queryset_da_janela(inicio, fim), inicio.isoformat(), fim.isoformat(), slot_minutos
+        )
+        nao_modificado = get_conditional_response(request, etag=etag)
+        if nao_modificado is not None:
+            return nao_modificado
+
+        response = Response(mapa_ocupacao.montar_mapa(inicio, fim, slot_minutos), status=status.HTTP_200_OK)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
 class MinhaAgendaView(generics.ListAPIView):
-    serializer_class = AgendamentoSerializer # Ou um serializer específico
+    serializer_class = AgendaLeituraSerializer
     permission_classes = [IsAuthenticated] # Adicionar permissão IsMedico
     def get_queryset(self):
         # Retorna agendamentos do dia em diante para o médico logado
         hoje = timezone.now().date()
-        return Agendamento.objects.filter(
+        return projetar_agenda(Agendamento.objects.filter(
             medico=self.request.user, 
             data_hora_inicio__date__gte=hoje,
             status__in=['Agendado', 'Confirmado']
-        ).order_by('data_hora_inicio')
\ No newline at end of file
+        )).order_by('data_hora_inicio')
\ No newline at end of file
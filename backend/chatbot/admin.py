@@ -1,8 +1,14 @@
 # chatbot/admin.py
 from django.contrib import admin
-from .models import ChatMemory
+from .models import ChatMemory, EnvioPendente
 
 @admin.register(ChatMemory)
 class ChatMemoryAdmin(admin.ModelAdmin):
     list_display = ('session_id', 'updated_at')
     search_fields = ('session_id',)
+
+
+@admin.register(EnvioPendente)
+class EnvioPendenteAdmin(admin.ModelAdmin):
+    list_display = ('url', 'tentativas', 'proxima_tentativa', 'criado_em')
+    readonly_fields = ('criado_em',)
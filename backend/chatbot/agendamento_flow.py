@@ -8,12 +8,14 @@ from decimal import Decimal
 from django.utils import timezone
 from dateutil.parser import parse
 
+from . import catalogo
 from .validators import ChatbotValidators
 from usuarios.models import Especialidade, CustomUser
 from pacientes.models import Paciente
 from agendamentos.serializers import AgendamentoWriteSerializer
 from agendamentos.services import (
     buscar_proximo_horario_disponivel,
+    buscar_primeiro_medico_disponivel,
     criar_agendamento_e_pagamento_pendente,
     listar_agendamentos_futuros,
     cancelar_agendamento_service
@@ -30,10 +32,10 @@ class AgendamentoManager:
         self.validators = ChatbotValidators()
 
     def _get_especialidades_from_db(self):
-        return list(Especialidade.objects.all().order_by('nome').values('id', 'nome'))
+        return list(catalogo.especialidades().values())
 
     def _get_medicos_from_db(self, especialidade_id):
-        return list(CustomUser.objects.filter(cargo='medico', especialidades__id=especialidade_id).values('id', 'first_name', 'last_name'))
+        return catalogo.medicos(especialidade_id)
 
     def processar(self, resposta_usuario, estado_atual):
      # ==================================================================
@@ -120,14 +122,13 @@ class AgendamentoManager:
         elif 'procedimento' in resposta_lower:
             self.memoria['tipo_agendamento'] = 'Procedimento'
             
-            # Importa o modelo necessário para buscar os procedimentos
-            from faturamento.models import Procedimento
-            procedimentos = list(Procedimento.objects.filter(ativo=True, valor_particular__gt=0).exclude(descricao__iexact='consulta').values('id', 'descricao'))
+            procedimentos = [proc for proc in catalogo.procedimentos().values() if proc['descricao'].lower() != 'consulta']
             
             if not procedimentos:
                 return {"response_message": "Desculpe, não encontrei procedimentos disponíveis para agendamento online no momento. Gostaria de agendar uma consulta?", "new_state": "agendamento_awaiting_type", "memory_data": self.memoria}
 
-            self.memoria['lista_procedimentos'] = procedimentos
+            # Só os IDs: a descrição volta do catálogo na próxima mensagem
+            self.memoria['lista_procedimentos'] = [proc['id'] for proc in procedimentos]
             nomes_procedimentos = '\n'.join([f"• {proc['descricao']}" for proc in procedimentos])
             
             return {
@@ -140,7 +141,8 @@ class AgendamentoManager:
         return {"response_message": f"Não entendi, {nome_usuario}. É 'Consulta' ou 'Procedimento'?", "new_state": "agendamento_awaiting_type", "memory_data": self.memoria}
 
     def handle_awaiting_procedure(self, resposta_usuario):
-        procedimento_escolhido = next((proc for proc in self.memoria.get('lista_procedimentos', []) if resposta_usuario.lower() in proc['descricao'].lower()), None)
+        procedimentos = catalogo.resolver(self.memoria.get('lista_procedimentos', []), catalogo.procedimentos())
+        procedimento_escolhido = next((proc for proc in procedimentos if resposta_usuario.lower() in proc['descricao'].lower()), None)
         
         if not procedimento_escolhido:
             return {"response_message": "Não encontrei esse procedimento na lista. Pode tentar de novo?", "new_state": "agendamento_awaiting_procedure", "memory_data": self.memoria}
@@ -195,7 +197,7 @@ class AgendamentoManager:
 
         # O próximo passo é sempre pedir a especialidade (para ambos os fluxos)
         especialidades = self._get_especialidades_from_db()
-        self.memoria['lista_especialidades'] = especialidades
+        self.memoria['lista_especialidades'] = [esp['id'] for esp in especialidades]
         nomes_especialidades = '\n'.join([f"• {esp['nome']}" for esp in especialidades])
         
         mensagem_pergunta = "Perfeito. Para qual das nossas especialidades você deseja o agendamento?"
@@ -204,7 +206,8 @@ class AgendamentoManager:
 
 
     def handle_awaiting_specialty(self, resposta_usuario):
-        especialidade_escolhida = next((esp for esp in self.memoria.get('lista_especialidades', []) if resposta_usuario.lower() in esp['nome'].lower()), None)
+        especialidades = catalogo.resolver(self.memoria.get('lista_especialidades', []), catalogo.especialidades())
+        especialidade_escolhida = next((esp for esp in especialidades if resposta_usuario.lower() in esp['nome'].lower()), None)
         if not especialidade_escolhida:
             return {"response_message": "Não encontrei essa especialidade. Pode tentar de novo?", "new_state": "agendamento_awaiting_specialty", "memory_data": self.memoria}
 
@@ -214,35 +217,33 @@ class AgendamentoManager:
         if not medicos:
             return {"response_message": f"Desculpe, não encontrei médicos para {especialidade_escolhida['nome']} no momento. Gostaria de tentar outra especialidade?", "new_state": "agendamento_awaiting_specialty", "memory_data": self.memoria}
 
-        # Itera sobre todos os médicos da especialidade até encontrar um com horário
-        for medico in medicos:
-            horarios = buscar_proximo_horario_disponivel(medico_id=medico['id'])
-
-            # Se encontrou horários, para o loop e segue o fluxo
-            if horarios and horarios.get('horarios_disponiveis'):
-                self.memoria.update({
-                    'medico_id': medico['id'],
-                    'medico_nome': f"{medico['first_name']} {medico['last_name']}",
-                    'horarios_ofertados': horarios
-                })
-                
-                try:
-                    data_formatada = parse(horarios['data']).strftime('%d/%m/%Y')
-                except (ValueError, TypeError):
-                    data_formatada = horarios.get('data', 'Data inválida')
-                
-                horarios_formatados = [f"• *{h}*" for h in horarios['horarios_disponiveis'][:5]]
-                medico_nome_completo = f"Dr(a). {self.memoria['medico_nome']}"
-                
-                # Mensagem formatada como você solicitou
-                mensagem = (
-                    f"Excelente escolha! Cuidar da saúde é fundamental. Encontrei estes horários com {medico_nome_completo}, que é uma referência na área, para o dia *{data_formatada}*:\n\n"
-                    + "\n".join(horarios_formatados)
-                    + "\n\nQual deles prefere?"
-                )
-                return {"response_message": mensagem, "new_state": "agendamento_awaiting_slot_choice", "memory_data": self.memoria}
+        # Busca de uma vez, entre todos os médicos da especialidade, quem tem o horário mais cedo
+        medico, horarios = buscar_primeiro_medico_disponivel(especialidade_id=especialidade_escolhida['id'], medicos=medicos)
+
+        if medico and horarios and horarios.get('horarios_disponiveis'):
+            self.memoria.update({
+                'medico_id': medico['id'],
+                'medico_nome': f"{medico['first_name']} {medico['last_name']}",
+                'horarios_ofertados': horarios
+            })
+
+            try:
+                data_formatada = parse(horarios['data']).strftime('%d/%m/%Y')
+            except (ValueError, TypeError):
+                data_formatada = horarios.get('data', 'Data inválida')
+
+            horarios_formatados = [f"• *{h}*" for h in horarios['horarios_disponiveis'][:5]]
+            medico_nome_completo = f"Dr(a). {self.memoria['medico_nome']}"
 
-        # Se o loop terminar e nenhum médico tiver agenda, retorna a mensagem de indisponibilidade
+            # Mensagem formatada como você solicitou
+            mensagem = (
+                f"Excelente escolha! Cuidar da saúde é fundamental. Encontrei estes horários com {medico_nome_completo}, que é uma referência na área, para o dia *{data_formatada}*:\n\n"
+                + "\n".join(horarios_formatados)
+                + "\n\nQual deles prefere?"
+            )
+            return {"response_message": mensagem, "new_state": "agendamento_awaiting_slot_choice", "memory_data": self.memoria}
+
+        # Nenhum médico da especialidade tem agenda: retorna a mensagem de indisponibilidade
         return {
             "response_message": f"Infelizmente, não há horários disponíveis para a especialidade de {especialidade_escolhida['nome']} nos próximos dias. Gostaria de tentar outra especialidade?",
             "new_state": "agendamento_awaiting_specialty",
@@ -281,41 +282,22 @@ class AgendamentoManager:
         if not medicos:
             return {"response_message": f"Desculpe, não encontrei médicos para {especialidade_nome} no momento.", "new_state": "agendamento_awaiting_modality", "memory_data": self.memoria}
 
-        # Vamos iterar sobre os médicos se o primeiro não tiver agenda
-        for medico in medicos:
-            self.memoria.update({'medico_id': medico['id'], 'medico_nome': f"{medico['first_name']} {medico['last_name']}"})
-            
-            # 1. Tenta buscar horários a partir de hoje
-            horarios = buscar_proximo_horario_disponivel(medico_id=medico['id'])
+        # Busca de uma vez, entre todos os médicos da especialidade, quem tem o horário mais cedo
+        medico, horarios = buscar_primeiro_medico_disponivel(especialidade_id=especialidade_id, medicos=medicos)
 
-            # 2. Se não encontrou NADA (nem para hoje, nem para o futuro), avisa e para.
-            if not horarios or not horarios.get('horarios_disponiveis'):
-                continue # Tenta o próximo médico
+        if not medico or not horarios or not horarios.get('horarios_disponiveis'):
+            return {"response_message": f"Infelizmente, não há horários disponíveis para {especialidade_nome} nos próximos dias.", "new_state": "agendamento_awaiting_modality", "memory_data": self.memoria}
 
-            # 3. Se encontrou, formata a mensagem e retorna
-            self.memoria['horarios_ofertados'] = horarios
-            try:
-                from dateutil.parser import parse
-                data_formatada = parse(horarios['data']).strftime('%d/%m/%Y')
-            except (ValueError, TypeError):
-                data_formatada = horarios.get('data', 'Data inválida')
-            
-            horarios_formatados = [f"• *{h}*" for h in horarios['horarios_disponiveis'][:5]]
-            medico_nome_completo = f"Dr(a). {self.memoria['medico_nome']}"
-            mensagem = (f"Excelente escolha! Cuidar da saúde é fundamental. Encontrei estes horários com {medico_nome_completo}, que é uma referência na área, para o dia *{data_formatada}*:\n\n" + "\n".join(horarios_formatados) + "\n\nQual deles prefere?")
-            return {"response_message": mensagem, "new_state": "agendamento_awaiting_slot_choice", "memory_data": self.memoria}
-
-        # Se o loop terminar e nenhum médico tiver agenda
-        medico_nome = self.memoria.get('medico_nome', 'o médico selecionado')
-        return {"response_message": f"Infelizmente, não há horários disponíveis para Dr(a). {medico_nome} nos próximos dias.", "new_state": "agendamento_awaiting_modality", "memory_data": self.memoria}
-
-        self.memoria['horarios_ofertados'] = horarios
+        self.memoria.update({
+            'medico_id': medico['id'],
+            'medico_nome': f"{medico['first_name']} {medico['last_name']}",
+            'horarios_ofertados': horarios
+        })
         try:
-            from dateutil.parser import parse
             data_formatada = parse(horarios['data']).strftime('%d/%m/%Y')
         except (ValueError, TypeError):
             data_formatada = horarios.get('data', 'Data inválida')
-        
+
         horarios_formatados = [f"• *{h}*" for h in horarios['horarios_disponiveis'][:5]]
         medico_nome_completo = f"Dr(a). {self.memoria['medico_nome']}"
         mensagem = (f"Excelente escolha! Cuidar da saúde é fundamental. Encontrei estes horários com {medico_nome_completo}, que é uma referência na área, para o dia *{data_formatada}*:\n\n" + "\n".join(horarios_formatados) + "\n\nQual deles prefere?")
@@ -350,10 +332,10 @@ class AgendamentoManager:
 
             data_recusada_obj = datetime.strptime(data_recusada_str, '%Y-%m-%d').date()
             
-            # Chama o serviço para buscar a PRÓXIMA data disponível
+            # Chama o serviço para buscar a PRÓXIMA data disponível (a partir do dia seguinte ao recusado)
             novos_horarios = buscar_proximo_horario_disponivel(
                 medico_id=self.memoria['medico_id'],
-                data_inicial=data_recusada_obj
+                data_inicial=data_recusada_obj + timedelta(days=1)
             )
 
             if novos_horarios and novos_horarios.get('horarios_disponiveis'):
@@ -1,8 +1,130 @@
 # chatbot/analytics.py
+"""
+Analytics do chatbot.
+
+Os eventos brutos ficam em ChatbotMetrics. Cada evento gravado também
+soma nos agregados (sinal post_save em chatbot/signals.py), fora da
+requisição: o sinal só guarda o evento em memória, e a thread de descarga
+do estado quente (estado_sessao) grava os eventos acumulados em lote, com
+poucos segundos de atraso:
+- MetricaHoraria: total por (hora, evento, dimensão), com a soma das
+  durações do roteamento, em um INSERT ... ON CONFLICT DO UPDATE;
+- ResumoSessaoChatbot: primeiro e último evento e o desfecho de cada sessão.
+As consultas do dashboard leem só os agregados: o custo depende do período
+pedido, não de quantos eventos existem. Para montar os agregados a partir
+dos eventos já gravados: `python manage.py reconstruir_metricas_chatbot`.
+"""
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import connection, models, transaction
+from django.db.models.functions import ExtractHour, Greatest, TruncDate
 from django.utils import timezone
-from datetime import timedelta
-import json
-from django.db import models
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_LOTE = 500
+
+# Campo do dados_evento que vira a dimensão de cada evento
+DIMENSOES = {
+    'abandono_conversa': ('estado',),
+    'especialidade_selecionada': ('especialidade',),
+    'roteamento_intencao': ('origem', 'motivo'),
+}
+SEPARADOR_DIMENSAO = '|'
+# Eventos que definem o desfecho da sessão (vale o último)
+EVENTOS_DE_RESULTADO = {
+    'agendamento_completo', 'abandono_conversa', 'transferencia_humano_solicitada',
+    'conversa_encerrada_naturalmente', 'conversa_encerrada_comando',
+}
+
+
+# (session_id, evento, dados_evento, timestamp) ainda não somados nos agregados
+_eventos_pendentes = []
+_trava = threading.Lock()
+
+
+def _dimensao(evento, dados_evento):
+    campos = DIMENSOES.get(evento)
+    if not campos or not isinstance(dados_evento, dict):
+        return ''
+    valores = ['' if dados_evento.get(campo) is None else str(dados_evento[campo]) for campo in campos]
+    return SEPARADOR_DIMENSAO.join(valores)[:255]
+
+
+def _valor_dimensao(dimensao):
+    # Os eventos sem o campo (None) ficam com a dimensão vazia
+    return dimensao if dimensao != '' else None
+
+
+def _duracao_ms(dados):
+    duracao = dados.get('duracao_ms')
+    return float(duracao) if isinstance(duracao, (int, float)) else 0.0
+
+
+def _bucket(timestamp):
+    return timestamp.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def _upsert(cursor, tabela, colunas, conflito, atualizacao, linhas):
+    for inicio in range(0, len(linhas), TAMANHO_LOTE):
+        parte = linhas[inicio:inicio + TAMANHO_LOTE]
+        marcadores = '(' + ', '.join(['%s'] * len(colunas)) + ')'
+        cursor.execute(
+            f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES {', '.join([marcadores] * len(parte))} "
+            f"ON CONFLICT ({conflito}) DO UPDATE SET {atualizacao}",
+            [valor for linha in parte for valor in linha],
+        )
+
+
+def _somar_agregados(eventos):
+    """Agrupa os eventos por linha de cada agregado e grava os incrementos."""
+    from .models import MetricaHoraria, ResumoSessaoChatbot
+
+    horarias = defaultdict(lambda: [0, 0.0])
+    sessoes = {}  # session_id -> [primeiro, último, total, resultado, quando do resultado]
+    for session_id, evento, dados, timestamp in eventos:
+        horaria = horarias[(_bucket(timestamp), evento, _dimensao(evento, dados))]
+        horaria[0] += 1
+        horaria[1] += _duracao_ms(dados)
+        sessao = sessoes.setdefault(session_id, [timestamp, timestamp, 0, None, None])
+        sessao[0], sessao[1] = min(sessao[0], timestamp), max(sessao[1], timestamp)
+        sessao[2] += 1
+        if evento in EVENTOS_DE_RESULTADO and (sessao[4] is None or timestamp >= sessao[4]):
+            sessao[3], sessao[4] = evento, timestamp
+
+    data_hora = connection.ops.adapt_datetimefield_value
+    horaria = connection.ops.quote_name(MetricaHoraria._meta.db_table)
+    resumo = connection.ops.quote_name(ResumoSessaoChatbot._meta.db_table)
+    # No sqlite, MIN/MAX com dois argumentos fazem o papel de LEAST/GREATEST
+    menor, maior = ('LEAST', 'GREATEST') if connection.vendor == 'postgresql' else ('MIN', 'MAX')
+    # Postgres e sqlite: incremento atômico, sem ler as linhas antes. Lotes
+    # de processos diferentes (ou reenviados após uma falha) chegam fora de
+    # ordem: as datas só avançam, e o desfecho vale o do lote mais recente.
+    with connection.cursor() as cursor:
+        _upsert(
+            cursor, horaria, ('bucket_hora', 'evento', 'dimensao', 'total', 'soma_duracao_ms'),
+            'bucket_hora, evento, dimensao',
+            f"total = {horaria}.total + EXCLUDED.total, "
+            f"soma_duracao_ms = {horaria}.soma_duracao_ms + EXCLUDED.soma_duracao_ms",
+            [(data_hora(bucket), evento, dimensao, total, soma)
+             for (bucket, evento, dimensao), (total, soma) in horarias.items()],
+        )
+        _upsert(
+            cursor, resumo, ('session_id', 'primeiro_evento', 'ultimo_evento', 'total_eventos', 'resultado'),
+            'session_id',
+            f"primeiro_evento = {menor}({resumo}.primeiro_evento, EXCLUDED.primeiro_evento), "
+            f"ultimo_evento = {maior}({resumo}.ultimo_evento, EXCLUDED.ultimo_evento), "
+            f"total_eventos = {resumo}.total_eventos + EXCLUDED.total_eventos, "
+            f"resultado = CASE WHEN EXCLUDED.resultado IS NOT NULL AND ({resumo}.resultado IS NULL "
+            f"OR EXCLUDED.ultimo_evento >= {resumo}.ultimo_evento) THEN EXCLUDED.resultado "
+            f"ELSE {resumo}.resultado END",
+            [(session_id, data_hora(primeiro), data_hora(ultimo), total, resultado)
+             for session_id, (primeiro, ultimo, total, resultado, _) in sessoes.items()],
+        )
+
 
 class AnalyticsManager:
     """Gerenciador de analytics do chatbot"""
@@ -17,68 +139,197 @@ class AnalyticsManager:
             dados_evento=dados or {}
         )
 
+    @staticmethod
+    def acumular_evento(metrica):
+        """
+        Guarda um evento recém-gravado para os agregados. Não vai ao banco: a
+        descarga do estado quente (estado_sessao) chama descarregar_agregados.
+        """
+        dados = metrica.dados_evento if isinstance(metrica.dados_evento, dict) else {}
+        with _trava:
+            _eventos_pendentes.append((metrica.session_id, metrica.evento, dados, metrica.timestamp))
+
+    @staticmethod
+    def descarregar_agregados():
+        """
+        Soma os eventos pendentes em MetricaHoraria e ResumoSessaoChatbot: um
+        INSERT ... ON CONFLICT DO UPDATE por tabela para o lote inteiro.
+        Retorna quantos eventos.
+        """
+        with _trava:
+            eventos = list(_eventos_pendentes)
+            _eventos_pendentes.clear()
+        if not eventos:
+            return 0
+        try:
+            with transaction.atomic():
+                _somar_agregados(eventos)
+        except Exception as e:
+            logger.error(f"Erro ao somar {len(eventos)} eventos nos agregados do chatbot: {e}", exc_info=True)
+            with _trava:
+                _eventos_pendentes[:0] = eventos
+            return 0
+        return len(eventos)
+
+    @staticmethod
+    def reconstruir_agregados():
+        """Refaz MetricaHoraria e ResumoSessaoChatbot a partir de todo o ChatbotMetrics."""
+        from .models import ChatbotMetrics, MetricaHoraria, ResumoSessaoChatbot
+
+        horarias = defaultdict(lambda: [0, 0.0])
+        sessoes = {}
+        eventos = ChatbotMetrics.objects.order_by('timestamp').values_list('session_id', 'evento', 'dados_evento', 'timestamp')
+        for session_id, evento, dados, timestamp in eventos.iterator(chunk_size=5000):
+            dados = dados if isinstance(dados, dict) else {}
+            horaria = horarias[(_bucket(timestamp), evento, _dimensao(evento, dados))]
+            horaria[0] += 1
+            horaria[1] += _duracao_ms(dados)
+            sessao = sessoes.get(session_id)
+            if sessao is None:
+                sessao = sessoes[session_id] = ResumoSessaoChatbot(
+                    session_id=session_id, primeiro_evento=timestamp, total_eventos=0
+                )
+            sessao.ultimo_evento = timestamp
+            sessao.total_eventos += 1
+            if evento in EVENTOS_DE_RESULTADO:
+                sessao.resultado = evento
+
+        with transaction.atomic():
+            MetricaHoraria.objects.all().delete()
+            ResumoSessaoChatbot.objects.all().delete()
+            MetricaHoraria.objects.bulk_create([
+                MetricaHoraria(bucket_hora=bucket, evento=evento, dimensao=dimensao, total=total, soma_duracao_ms=soma)
+                for (bucket, evento, dimensao), (total, soma) in horarias.items()
+            ], batch_size=1000)
+            ResumoSessaoChatbot.objects.bulk_create(sessoes.values(), batch_size=1000)
+        return len(horarias), len(sessoes)
+
+    @staticmethod
+    def _horarias(inicio, **filtros):
+        from .models import MetricaHoraria
+        return MetricaHoraria.objects.filter(bucket_hora__gte=_bucket(inicio), **filtros)
+
+    @staticmethod
+    def _por_dimensao(horarias, chave, limite=None):
+        """[{chave: valor da dimensão, 'count': total}] em ordem decrescente."""
+        linhas = horarias.values('dimensao').annotate(count=models.Sum('total')).order_by('-count')
+        if limite:
+            linhas = linhas[:limite]
+        return [{chave: _valor_dimensao(linha['dimensao']), 'count': linha['count']} for linha in linhas]
+
     @staticmethod
     def obter_metricas_periodo(dias=30):
         """Obtém métricas dos últimos N dias"""
-        from .models import ChatbotMetrics
         inicio = timezone.now() - timedelta(days=dias)
 
-        metricas = ChatbotMetrics.objects.filter(timestamp__gte=inicio)
-
+        totais = dict(
+            AnalyticsManager._horarias(inicio, evento__in=['inicio_conversa', 'agendamento_completo'])
+            .values_list('evento').annotate(models.Sum('total'))
+        )
         # Conversas iniciadas
-        conversas_iniciadas = metricas.filter(evento='inicio_conversa').count()
+        conversas_iniciadas = totais.get('inicio_conversa', 0)
 
         # Agendamentos completados
-        agendamentos_completos = metricas.filter(evento='agendamento_completo').count()
+        agendamentos_completos = totais.get('agendamento_completo', 0)
 
         # Taxa de conversão
         taxa_conversao = (agendamentos_completos / conversas_iniciadas * 100) if conversas_iniciadas > 0 else 0
 
         # Estados mais comuns onde usuários abandonam
-        abandonos = metricas.filter(evento='abandono_conversa').values('dados_evento__estado').annotate(
-            count=models.Count('id')
-        ).order_by('-count')[:5]
+        abandonos = AnalyticsManager._por_dimensao(
+            AnalyticsManager._horarias(inicio, evento='abandono_conversa'), 'dados_evento__estado', 5
+        )
 
         # Especialidades mais procuradas
-        especialidades = metricas.filter(
-            evento='especialidade_selecionada'
-        ).values('dados_evento__especialidade').annotate(
-            count=models.Count('id')
-        ).order_by('-count')[:10]
+        especialidades = AnalyticsManager._por_dimensao(
+            AnalyticsManager._horarias(inicio, evento='especialidade_selecionada'), 'dados_evento__especialidade', 10
+        )
 
         return {
             'periodo_dias': dias,
             'conversas_iniciadas': conversas_iniciadas,
             'agendamentos_completos': agendamentos_completos,
             'taxa_conversao': round(taxa_conversao, 2),
-            'principais_abandonos': list(abandonos),
-            'especialidades_populares': list(especialidades),
-            'tempo_medio_conversa': AnalyticsManager._calcular_tempo_medio_conversa(metricas)
+            'principais_abandonos': abandonos,
+            'especialidades_populares': especialidades,
+            'tempo_medio_conversa': AnalyticsManager._calcular_tempo_medio_conversa(inicio)
         }
 
     @staticmethod
-    def _calcular_tempo_medio_conversa(metricas):
-        """Calcula tempo médio de conversa"""
-        sessoes = {}
+    def obter_atividade_por_hora(dias=30):
+        """Eventos por hora do dia (UTC): [{'hora', 'count'}]."""
+        inicio = timezone.now() - timedelta(days=dias)
+        return list(
+            AnalyticsManager._horarias(inicio).annotate(hora=ExtractHour('bucket_hora', tzinfo=dt_timezone.utc))
+            .values('hora').annotate(count=models.Sum('total')).order_by('hora')
+        )
 
-        # Otimização: usa values() para reduzir memória
-        for metrica in metricas.values('session_id', 'timestamp').order_by('timestamp'):
-            session_id = metrica['session_id']
-            timestamp = metrica['timestamp']
-            if session_id not in sessoes:
-                sessoes[session_id] = {'inicio': timestamp, 'fim': timestamp}
-            else:
-                sessoes[session_id]['fim'] = timestamp
+    @staticmethod
+    def obter_sessoes_por_dia(dias=30):
+        """Conversas iniciadas por dia (UTC): [{'dia', 'count'}], no máximo 31 dias."""
+        inicio = timezone.now() - timedelta(days=dias)
+        return list(
+            AnalyticsManager._horarias(inicio, evento='inicio_conversa')
+            .annotate(dia=TruncDate('bucket_hora', tzinfo=dt_timezone.utc))
+            .values('dia').annotate(count=models.Sum('total')).order_by('dia')[:31]
+        )
 
-        if not sessoes:
-            return 0
+    @staticmethod
+    def obter_metricas_roteador(dias=30):
+        """
+        Acertos do roteador local (chatbot/roteador_local.py) contra chamadas à
+        IA Roteadora, e a economia estimada: cada acerto local é uma chamada a
+        menos, com a latência média das chamadas que foram para a IA.
+        """
+        from .roteador_local import EVENTO_METRICA
+        inicio = timezone.now() - timedelta(days=dias)
 
-        tempos = []
-        for sessao in sessoes.values():
-            duracao = (sessao['fim'] - sessao['inicio']).total_seconds() / 60  # em minutos
-            tempos.append(duracao)
+        horarias = AnalyticsManager._horarias(inicio, evento=EVENTO_METRICA)
+        # Dimensão "origem|motivo"
+        local = models.Q(dimensao__startswith=f'local{SEPARADOR_DIMENSAO}')
+        resumo = horarias.aggregate(
+            mensagens=models.Sum('total'),
+            locais=models.Sum('total', filter=local),
+            soma_local_ms=models.Sum('soma_duracao_ms', filter=local),
+            soma_llm_ms=models.Sum('soma_duracao_ms', filter=~local),
+        )
+        motivos_falha = defaultdict(int)
+        linhas = horarias.filter(dimensao__startswith=f'llm{SEPARADOR_DIMENSAO}').values('dimensao').annotate(
+            count=models.Sum('total')
+        )
+        for linha in linhas:
+            motivos_falha[_valor_dimensao(linha['dimensao'].split(SEPARADOR_DIMENSAO, 1)[1])] += linha['count']
+        motivos_falha = [
+            {'dados_evento__motivo': motivo, 'count': count}
+            for motivo, count in sorted(motivos_falha.items(), key=lambda item: -item[1])
+        ]
 
-        return round(sum(tempos) / len(tempos), 2) if tempos else 0
+        total, locais = resumo['mensagens'] or 0, resumo['locais'] or 0
+        chamadas_llm = total - locais
+        resumo['latencia_local_ms'] = resumo['soma_local_ms'] / locais if locais else 0
+        resumo['latencia_llm_ms'] = resumo['soma_llm_ms'] / chamadas_llm if chamadas_llm else 0
+        latencia_llm_ms = resumo['latencia_llm_ms'] or 0
+        return {
+            'mensagens_roteadas': total,
+            'resolvidas_localmente': locais,
+            'taxa_acerto': round(locais / total * 100, 2) if total else 0,
+            'chamadas_llm_evitadas': locais,
+            'latencia_media_local_ms': round(resumo['latencia_local_ms'] or 0, 3),
+            'latencia_media_llm_ms': round(latencia_llm_ms, 1),
+            'segundos_economizados_estimados': round(locais * latencia_llm_ms / 1000, 1),
+            'motivos_envio_llm': motivos_falha,
+        }
+
+    @staticmethod
+    def _calcular_tempo_medio_conversa(inicio):
+        """Tempo médio (minutos) entre o primeiro e o último evento das sessões ativas no período"""
+        from .models import ResumoSessaoChatbot
+        duracao = models.ExpressionWrapper(
+            models.F('ultimo_evento') - Greatest('primeiro_evento', models.Value(inicio)),
+            output_field=models.DurationField()
+        )
+        media = ResumoSessaoChatbot.objects.filter(ultimo_evento__gte=inicio).aggregate(media=models.Avg(duracao))['media']
+        return round(media.total_seconds() / 60, 2) if media else 0
 
     @staticmethod
     def registrar_inicio_conversa(session_id, dados_usuario=None):
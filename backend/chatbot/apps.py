@@ -1,6 +1,19 @@
+import os
+
 from django.apps import AppConfig
 
 
 class ChatbotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chatbot'
+
+    def ready(self):
+        # Conecta os sinais que invalidam o catálogo em memória
+        from . import signals  # noqa: F401
+
+        # Só os processos web (core/asgi.py e core/wsgi.py) ligam esta variável:
+        # comandos de manutenção sobem sem importar o langchain, e as chains
+        # ficam para o primeiro uso.
+        if os.environ.get('CHATBOT_AQUECER_CHAINS') == '1':
+            from . import chains
+            chains.aquecer()
@@ -1,16 +1,53 @@
 # chatbot/bot_logic.py - VERSÃO FINAL COM LÓGICA CONTEXTUAL E DE TIMEOUT
 
+import asyncio
 import logging
-from .models import ChatMemory
+import os
+import time
+import weakref
+from channels.db import database_sync_to_async
 from .agendamento_flow import AgendamentoManager
-from .chains import chain_roteadora, chain_sintomas, chain_faq, faq_base_de_conhecimento
+from . import chains
+from .chains import faq_base_de_conhecimento, PROMPT_FAQ
 from .services import get_resposta_preco
 from .human_transfer import HumanTransferManager
 from .conversation_manager import ConversationManager
+from . import roteador_local, cache_faq, sessao_conversa
 from usuarios.models import Especialidade
 
 logger = logging.getLogger(__name__)
 
+# No orquestrador assíncrono centenas de conversas podem estar esperando o
+# Gemini ao mesmo tempo, mas só estas seguram uma conexão com o banco.
+MAX_CONEXOES_DB_ORQUESTRADOR = int(os.environ.get('CHATBOT_MAX_CONEXOES_DB', 20))
+_semaforos_db = weakref.WeakKeyDictionary()
+
+
+async def executar_no_banco(funcao, *args, **kwargs):
+    """
+    Roda um trecho de ORM síncrono fora do event loop (database_sync_to_async,
+    que também devolve a conexão ao terminar), limitado a
+    MAX_CONEXOES_DB_ORQUESTRADOR trechos simultâneos por event loop.
+    """
+    loop = asyncio.get_running_loop()
+    semaforo = _semaforos_db.get(loop)
+    if semaforo is None:
+        semaforo = _semaforos_db[loop] = asyncio.Semaphore(MAX_CONEXOES_DB_ORQUESTRADOR)
+    async with semaforo:
+        return await database_sync_to_async(funcao)(*args, **kwargs)
+
+# Estados em que a mensagem é a resposta a uma pergunta do fluxo (não vai à IA Roteadora)
+ESTADOS_DE_FLUXO = [
+    'agendamento_awaiting_type', 'agendamento_awaiting_modality',
+    'agendamento_awaiting_specialty', 'agendamento_awaiting_slot_choice',
+    'agendamento_awaiting_slot_confirmation', 'cadastro_awaiting_cpf',
+    'cadastro_awaiting_missing_field', 'agendamento_awaiting_payment_choice',
+    'agendamento_awaiting_installments', 'awaiting_inactivity_response',
+    'awaiting_schedule_confirmation', 'agendamento_awaiting_procedure', 
+    'aguardando_atendente_humano', 'cancelamento_awaiting_cpf', 
+    'cancelamento_awaiting_choice', 'cancelamento_awaiting_confirmation'
+]
+
 def get_reprompt_message(state: str, memory: dict) -> str:
     nome_usuario = memory.get('nome_usuario', '')
     prompts = {
@@ -30,8 +67,13 @@ def get_reprompt_message(state: str, memory: dict) -> str:
         return f"Como posso te direcionar ao melhor cuidado hoje, {nome_usuario}?"
     return prompts.get(state, f"Como posso te ajudar, {nome_usuario}?")
 
-def processar_mensagem_bot(session_id: str, user_message: str) -> dict:
-    memoria_obj, _ = ChatMemory.objects.get_or_create(session_id=session_id)
+def _decidir_sem_ia(session_id: str, user_message: str, sessao) -> tuple:
+    """
+    Tudo o que não depende da IA Roteadora: comandos, transferência, onboarding
+    e continuação de fluxos. Retorna (resultado, registrar_historico);
+    resultado None significa que a mensagem deve ir para a IA Roteadora.
+    """
+    memoria_obj = sessao.memoria
     memoria_atual = memoria_obj.memory_data if isinstance(memoria_obj.memory_data, dict) else {}
     estado_atual = memoria_obj.state
     nome_usuario = memoria_atual.get('nome_usuario', '')
@@ -46,26 +88,15 @@ def processar_mensagem_bot(session_id: str, user_message: str) -> dict:
     if comando:
         resultado = ConversationManager.processar_comando(comando, session_id, memoria_atual)
         if resultado:
-            memoria_obj.state = resultado.get("new_state")
-            memoria_obj.memory_data = resultado.get("memory_data")
-            memoria_obj.save()
-            return resultado
+            return resultado, False
     
     # Verifica solicitação de atendente humano
     if HumanTransferManager.detectar_solicitacao_humano(user_message):
-        resultado = HumanTransferManager.processar_transferencia(session_id, memoria_atual)
-        memoria_obj.state = resultado.get("new_state")
-        memoria_obj.memory_data = resultado.get("memory_data")
-        memoria_obj.save()
-        return resultado
+        return HumanTransferManager.processar_transferencia(session_id, memoria_atual, sessao), False
     
     # Verifica se usuário quer encerrar naturalmente
     if estado_atual == 'identificando_demanda' and ConversationManager.detectar_encerramento(user_message):
-        resultado = ConversationManager.processar_encerramento(session_id, memoria_atual)
-        memoria_obj.state = resultado.get("new_state")
-        memoria_obj.memory_data = resultado.get("memory_data")
-        memoria_obj.save()
-        return resultado
+        return ConversationManager.processar_encerramento(session_id, memoria_atual), False
 
     # --- NÍVEL 0: ONBOARDING (COLETA DO NOME) ---
     if not nome_usuario:
@@ -78,105 +109,214 @@ def processar_mensagem_bot(session_id: str, user_message: str) -> dict:
                 resultado = {"response_message": f"Prazer, {nome_candidato}! Como posso te direcionar ao melhor cuidado hoje?", "new_state": 'identificando_demanda', "memory_data": memoria_atual}
             else:
                 resultado = {"response_message": "Não entendi bem. Por favor, qual o seu primeiro nome?", "new_state": 'aguardando_nome', "memory_data": {}}
-    else:
-        # ==================================================================
-        # --- HIERARQUIA DE PROCESSAMENTO (ESTRUTURA CORRIGIDA) ---
-        # ==================================================================
-        
-        estados_de_fluxo = [
-            'agendamento_awaiting_type', 'agendamento_awaiting_modality',
-            'agendamento_awaiting_specialty', 'agendamento_awaiting_slot_choice',
-            'agendamento_awaiting_slot_confirmation', 'cadastro_awaiting_cpf',
-            'cadastro_awaiting_missing_field', 'agendamento_awaiting_payment_choice',
-            'agendamento_awaiting_installments', 'awaiting_inactivity_response',
-            'awaiting_schedule_confirmation', 'agendamento_awaiting_procedure', 
-            'aguardando_atendente_humano', 'cancelamento_awaiting_cpf', 
-            'cancelamento_awaiting_choice', 'cancelamento_awaiting_confirmation'
-        ]
-
-        # NÍVEL 1: Verifica se estamos EM UM FLUXO.
-        if estado_atual in estados_de_fluxo:
-            logger.warning(f"Priorizando continuação de fluxo no estado '{estado_atual}'.")
-            
-            # --- Tratamento de casos especiais que NÃO estão no AgendamentoManager ---
-            if estado_atual == 'aguardando_atendente_humano':
-                if 'continuar' in user_message.lower():
-                    resultado = {"response_message": f"Perfeito, {nome_usuario}! Vamos continuar nosso atendimento. Como posso te ajudar?", "new_state": "identificando_demanda", "memory_data": memoria_atual}
-                else:
-                    resultado = {"response_message": f"Entendido, {nome_usuario}. Nossa equipe entrará em contato em breve. Aguarde um momento.", "new_state": "aguardando_atendente_humano", "memory_data": memoria_atual}
-            
-            elif estado_atual == 'awaiting_inactivity_response':
-                if 'sim' in user_message.lower():
-                    # Após uma pausa, sempre voltamos ao menu principal para evitar confusão.
-                    memoria_atual.pop('tipo_agendamento', None)
-                    memoria_atual.pop('lista_procedimentos', None)
-                    resultado = {
-                        "response_message": f"Que bom que voltou, {nome_usuario}! Como posso te ajudar agora?", 
-                        "new_state": "identificando_demanda", 
-                        "memory_data": memoria_atual
-                    }
-                else:
-                    resultado = {"response_message": "Entendido. Quando precisar, é só chamar!", "new_state": 'inicio', "memory_data": {'nome_usuario': nome_usuario}}
-            
-            elif estado_atual == 'awaiting_schedule_confirmation':
-                if 'sim' in user_message.lower():
-                    manager = AgendamentoManager(session_id, memoria_atual, "")
-                    resultado = manager.processar(user_message, 'agendamento_inicio')
-                else:
-                    resultado = {"response_message": "Tudo bem. Se mudar de ideia, é só me dizer o que gostaria de fazer.", "new_state": 'identificando_demanda', "memory_data": memoria_atual}
-            
-            # --- Para todos os outros estados de fluxo, usamos o AgendamentoManager ---
-            else:
-                manager = AgendamentoManager(session_id, memoria_atual, "")
-                resultado = manager.processar(user_message, estado_atual)
+        return resultado, True
+
+    # ==================================================================
+    # --- HIERARQUIA DE PROCESSAMENTO (ESTRUTURA CORRIGIDA) ---
+    # ==================================================================
+    
+    # NÍVEL 1: Verifica se estamos EM UM FLUXO.
+    if estado_atual not in ESTADOS_DE_FLUXO:
+        # NÍVEL 2 fica com quem chamou (IA Roteadora, síncrona ou assíncrona)
+        return None, True
 
-        # NÍVEL 2: Se NÃO estamos em um fluxo, usamos a IA Roteadora.
+    logger.warning(f"Priorizando continuação de fluxo no estado '{estado_atual}'.")
+    
+    # --- Tratamento de casos especiais que NÃO estão no AgendamentoManager ---
+    if estado_atual == 'aguardando_atendente_humano':
+        if 'continuar' in user_message.lower():
+            resultado = {"response_message": f"Perfeito, {nome_usuario}! Vamos continuar nosso atendimento. Como posso te ajudar?", "new_state": "identificando_demanda", "memory_data": memoria_atual}
+        else:
+            resultado = {"response_message": f"Entendido, {nome_usuario}. Nossa equipe entrará em contato em breve. Aguarde um momento.", "new_state": "aguardando_atendente_humano", "memory_data": memoria_atual}
+    
+    elif estado_atual == 'awaiting_inactivity_response':
+        if 'sim' in user_message.lower():
+            # Após uma pausa, sempre voltamos ao menu principal para evitar confusão.
+            memoria_atual.pop('tipo_agendamento', None)
+            memoria_atual.pop('lista_procedimentos', None)
+            resultado = {
+                "response_message": f"Que bom que voltou, {nome_usuario}! Como posso te ajudar agora?", 
+                "new_state": "identificando_demanda", 
+                "memory_data": memoria_atual
+            }
+        else:
+            resultado = {"response_message": "Entendido. Quando precisar, é só chamar!", "new_state": 'inicio', "memory_data": {'nome_usuario': nome_usuario}}
+    
+    elif estado_atual == 'awaiting_schedule_confirmation':
+        if 'sim' in user_message.lower():
+            manager = AgendamentoManager(session_id, memoria_atual, "")
+            resultado = manager.processar(user_message, 'agendamento_inicio')
         else:
-            logger.warning("Nenhum fluxo ativo. Usando IA Roteadora com contexto para nova intenção.")
-            try:
-                historico = memoria_atual.get('historico_conversa', [])
-                historico_formatado = "\n".join(historico)
-
-                intent_data = chain_roteadora.invoke({
-                    "user_message": user_message,
-                    "historico_conversa": historico_formatado
-                })
-
-                intent = intent_data.get("intent")
-                entity = intent_data.get("entity")
-
-                if intent == "buscar_preco":
-                    resposta_base = get_resposta_preco(entity, nome_usuario)
-                    resposta_final = f"{resposta_base} Que tal aproveitarmos para já verificar os próximos horários disponíveis para {entity}, {nome_usuario}?"
-                    resultado = {"response_message": resposta_final, "new_state": 'awaiting_schedule_confirmation', "memory_data": memoria_atual}
-
-                elif intent == "iniciar_agendamento":
-                    manager = AgendamentoManager(session_id, memoria_atual, "")
-                    resultado = manager.processar(user_message, 'agendamento_inicio')
-
-                else: # pergunta_geral ou fallback
-                    faq_data = chain_faq.invoke({
-                        "pergunta_do_usuario": user_message, 
-                        "faq": faq_base_de_conhecimento,
-                        "nome_usuario": nome_usuario
-                    })
-                    resultado = {"response_message": faq_data.get("resposta"), "new_state": 'identificando_demanda', "memory_data": memoria_atual}
-
-            except Exception as e:
-                logger.error(f"Erro na IA Roteadora: {e}", exc_info=True)
-                resultado = {"response_message": f"Desculpe, {nome_usuario}, não consegui processar sua mensagem. Poderia tentar de outra forma?", "new_state": "identificando_demanda", "memory_data": memoria_atual}
-
-    # --- PONTO DE SAÍDA ÚNICO: ATUALIZA A MEMÓRIA E O HISTÓRICO ---
-    if not resultado:
-        resultado = {"response_message": "Não entendi muito bem. Poderia repetir?", "new_state": "identificando_demanda", "memory_data": memoria_atual}
-        
-    historico = resultado.get("memory_data", {}).get('historico_conversa', [])
-    historico.append(f"Usuário: {user_message}")
-    historico.append(f"Bot: {resultado.get('response_message')}")
-    resultado['memory_data']['historico_conversa'] = historico[-6:]
+            resultado = {"response_message": "Tudo bem. Se mudar de ideia, é só me dizer o que gostaria de fazer.", "new_state": 'identificando_demanda', "memory_data": memoria_atual}
+    
+    # --- Para todos os outros estados de fluxo, usamos o AgendamentoManager ---
+    else:
+        manager = AgendamentoManager(session_id, memoria_atual, "")
+        resultado = manager.processar(user_message, estado_atual)
+
+    return resultado, True
+
+
+def _entrada_roteadora(user_message: str, memoria_atual: dict) -> dict:
+    historico = memoria_atual.get('historico_conversa', [])
+    return {
+        "user_message": user_message,
+        "historico_conversa": "\n".join(historico)
+    }
+
+
+def _entrada_faq(user_message: str, nome_usuario: str) -> dict:
+    return {
+        "pergunta_do_usuario": user_message, 
+        "faq": faq_base_de_conhecimento,
+        "nome_usuario": nome_usuario
+    }
+
+
+def _resultado_da_intencao(intent_data: dict, session_id: str, user_message: str, memoria_atual: dict,
+                           roteamento: roteador_local.Roteamento, duracao_ms: float):
+    """
+    Registra de onde veio a intenção (roteador local ou IA) e a aplica.
+    Retorna None quando a resposta deve vir do FAQ.
+    """
+    roteador_local.registrar_metrica(session_id, roteamento, duracao_ms)
+    nome_usuario = memoria_atual.get('nome_usuario', '')
+    intent = intent_data.get("intent")
+    entity = intent_data.get("entity")
+
+    if intent == "buscar_preco":
+        resposta_base = get_resposta_preco(entity, nome_usuario)
+        resposta_final = f"{resposta_base} Que tal aproveitarmos para já verificar os próximos horários disponíveis para {entity}, {nome_usuario}?"
+        return {"response_message": resposta_final, "new_state": 'awaiting_schedule_confirmation', "memory_data": memoria_atual}
+
+    if intent == "iniciar_agendamento":
+        manager = AgendamentoManager(session_id, memoria_atual, "")
+        return manager.processar(user_message, 'agendamento_inicio') or {}
+
+    return None # pergunta_geral ou fallback
+
+
+# Muda sempre que o texto do FAQ (ou o prompt) muda, invalidando o cache de respostas
+VERSAO_FAQ = cache_faq.versao_da_base(faq_base_de_conhecimento, PROMPT_FAQ)
+
+
+def _resultado_faq(resposta: str, memoria_atual: dict) -> dict:
+    return {"response_message": resposta, "new_state": 'identificando_demanda', "memory_data": memoria_atual}
+
+
+def _responder_faq(user_message: str, memoria_atual: dict) -> dict:
+    nome_usuario = memoria_atual.get('nome_usuario', '')
+    resposta = cache_faq.obter(user_message, nome_usuario, VERSAO_FAQ)
+    if resposta is None:
+        faq_data = chains.chain_faq.invoke(_entrada_faq(user_message, nome_usuario))
+        resposta = faq_data.get("resposta")
+        cache_faq.guardar(user_message, resposta, nome_usuario, VERSAO_FAQ)
+    return _resultado_faq(resposta, memoria_atual)
+
+
+async def _aresponder_faq(user_message: str, memoria_atual: dict) -> dict:
+    nome_usuario = memoria_atual.get('nome_usuario', '')
+    resposta = cache_faq.obter(user_message, nome_usuario, VERSAO_FAQ)
+    if resposta is None:
+        faq_data = await chains.chain_faq.ainvoke(_entrada_faq(user_message, nome_usuario))
+        resposta = faq_data.get("resposta")
+        cache_faq.guardar(user_message, resposta, nome_usuario, VERSAO_FAQ)
+    return _resultado_faq(resposta, memoria_atual)
+
+
+def _resultado_erro_roteadora(memoria_atual: dict) -> dict:
+    nome_usuario = memoria_atual.get('nome_usuario', '')
+    return {"response_message": f"Desculpe, {nome_usuario}, não consegui processar sua mensagem. Poderia tentar de outra forma?", "new_state": "identificando_demanda", "memory_data": memoria_atual}
+
+
+def _memoria_atual(memoria_obj) -> dict:
+    return memoria_obj.memory_data if isinstance(memoria_obj.memory_data, dict) else {}
+
+
+def _aplicar_resultado(memoria_obj, resultado: dict, user_message: str, registrar_historico: bool) -> dict:
+    """PONTO DE SAÍDA ÚNICO: atualiza estado, memória e histórico (sem salvar)."""
+    if registrar_historico:
+        if not resultado:
+            resultado = {"response_message": "Não entendi muito bem. Poderia repetir?", "new_state": "identificando_demanda", "memory_data": _memoria_atual(memoria_obj)}
+            
+        historico = resultado.get("memory_data", {}).get('historico_conversa', [])
+        historico.append(f"Usuário: {user_message}")
+        historico.append(f"Bot: {resultado.get('response_message')}")
+        resultado['memory_data']['historico_conversa'] = historico[-6:]
 
     memoria_obj.state = resultado.get("new_state")
     memoria_obj.memory_data = resultado.get("memory_data")
-    memoria_obj.save()
-    
-    return resultado
\ No newline at end of file
+    return resultado
+
+
+def processar_mensagem_bot(session_id: str, user_message: str, sessao=None) -> dict:
+    """
+    Processa a mensagem dentro da unidade de trabalho `sessao`
+    (sessao_conversa), que grava a memória ao final. Sem ela, abre uma.
+    """
+    if sessao is None:
+        with sessao_conversa.abrir(session_id) as sessao:
+            return processar_mensagem_bot(session_id, user_message, sessao)
+    memoria_obj = sessao.memoria
+
+    resultado, registrar_historico = _decidir_sem_ia(session_id, user_message, sessao)
+
+    # NÍVEL 2: Se NÃO estamos em um fluxo, usamos a IA Roteadora.
+    if resultado is None:
+        logger.warning("Nenhum fluxo ativo. Usando IA Roteadora com contexto para nova intenção.")
+        memoria_atual = _memoria_atual(memoria_obj)
+        try:
+            # Casos sem ambiguidade são resolvidos localmente; o resto vai para a IA
+            inicio = time.perf_counter()
+            roteamento = roteador_local.classificar(user_message)
+            if roteamento.intent:
+                intent_data = roteamento.como_intent_data()
+            else:
+                intent_data = chains.chain_roteadora.invoke(_entrada_roteadora(user_message, memoria_atual))
+            duracao_ms = (time.perf_counter() - inicio) * 1000
+            resultado = _resultado_da_intencao(intent_data, session_id, user_message, memoria_atual, roteamento, duracao_ms)
+            if resultado is None:
+                resultado = _responder_faq(user_message, memoria_atual)
+        except Exception as e:
+            logger.error(f"Erro na IA Roteadora: {e}", exc_info=True)
+            resultado = _resultado_erro_roteadora(memoria_atual)
+
+    return _aplicar_resultado(memoria_obj, resultado, user_message, registrar_historico)
+
+
+async def aprocessar_mensagem_bot(session_id: str, user_message: str, sessao=None) -> dict:
+    """
+    Versão assíncrona de processar_mensagem_bot, usada pelo orquestrador sob
+    ASGI. As chamadas ao Gemini usam ainvoke (não prendem thread nenhuma
+    enquanto esperam a rede); os trechos com ORM síncrono (fluxos, preços)
+    rodam via executar_no_banco.
+    """
+    if sessao is None:
+        async with sessao_conversa.aabrir(session_id) as sessao:
+            return await aprocessar_mensagem_bot(session_id, user_message, sessao)
+    memoria_obj = sessao.memoria
+
+    resultado, registrar_historico = await executar_no_banco(_decidir_sem_ia, session_id, user_message, sessao)
+
+    if resultado is None:
+        logger.warning("Nenhum fluxo ativo. Usando IA Roteadora com contexto para nova intenção.")
+        memoria_atual = _memoria_atual(memoria_obj)
+        try:
+            inicio = time.perf_counter()
+            # Fora do event loop: com o catálogo frio, classificar() consulta o banco
+            roteamento = await executar_no_banco(roteador_local.classificar, user_message)
+            if roteamento.intent:
+                intent_data = roteamento.como_intent_data()
+            else:
+                intent_data = await chains.chain_roteadora.ainvoke(_entrada_roteadora(user_message, memoria_atual))
+            duracao_ms = (time.perf_counter() - inicio) * 1000
+            resultado = await executar_no_banco(
+                _resultado_da_intencao, intent_data, session_id, user_message, memoria_atual, roteamento, duracao_ms
+            )
+            if resultado is None:
+                resultado = await _aresponder_faq(user_message, memoria_atual)
+        except Exception as e:
+            logger.error(f"Erro na IA Roteadora: {e}", exc_info=True)
+            resultado = _resultado_erro_roteadora(memoria_atual)
+
+    return _aplicar_resultado(memoria_obj, resultado, user_message, registrar_historico)
@@ -0,0 +1,110 @@
+# chatbot/cache_faq.py
+"""
+Cache das respostas da chain_faq.
+
+A resposta do FAQ depende só da pergunta e da base de conhecimento, então
+perguntas repetidas ("qual o endereço?", "aceitam convênio?") não precisam
+ir de novo ao Gemini:
+
+- Chave: a pergunta normalizada (minúsculas, sem acentos), sem stopwords e
+  com os tokens ordenados, mais a versão (hash) da base de conhecimento e do
+  prompt. Mudou o texto do FAQ, mudou a versão: as entradas antigas deixam
+  de ser encontradas e saem pelo LRU/TTL.
+- Valor: a resposta com o nome do usuário trocado por um marcador; o nome
+  de quem perguntou é colocado de volta na hora de responder.
+- Armazenamento: LRU em memória, com TTL, por processo.
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from .roteador_local import normalizar
+
+MAX_ITENS = 512
+TTL_SEGUNDOS = 6 * 60 * 60
+MARCADOR_NOME = '\x00nome\x00'
+
+STOPWORDS = {
+    'a', 'o', 'as', 'os', 'um', 'uma', 'uns', 'umas', 'de', 'do', 'da', 'dos', 'das', 'e',
+    'em', 'no', 'na', 'nos', 'nas', 'por', 'para', 'pra', 'com', 'que', 'qual', 'quais',
+    'me', 'voce', 'voces', 'vc', 'vcs', 'favor', 'oi', 'ola', 'bom', 'boa', 'dia', 'tarde',
+    'noite', 'gostaria', 'saber', 'queria', 'poderia', 'pode', 'ai', 'la', 'ja', 'aqui',
+    'passa', 'passar', 'informa', 'informar', 'diz', 'dizer',
+}
+
+
+class CacheLRU:
+    """Dicionário limitado a `max_itens` (sai o menos usado) com expiração por TTL."""
+
+    def __init__(self, max_itens=MAX_ITENS, ttl=TTL_SEGUNDOS):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._trava = threading.Lock()
+
+    def get(self, chave):
+        with self._trava:
+            item = self._itens.get(chave)
+            if item is None:
+                return None
+            valor, expira_em = item
+            if expira_em < time.monotonic():
+                del self._itens[chave]
+                return None
+            self._itens.move_to_end(chave)
+            return valor
+
+    def set(self, chave, valor):
+        with self._trava:
+            self._itens[chave] = (valor, time.monotonic() + self.ttl)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def clear(self):
+        with self._trava:
+            self._itens.clear()
+
+    def __len__(self):
+        return len(self._itens)
+
+
+_cache = CacheLRU()
+
+
+def versao_da_base(base_de_conhecimento, prompt=None):
+    return hashlib.sha1(f"{base_de_conhecimento}\x00{prompt or ''}".encode()).hexdigest()[:12]
+
+
+def chave(pergunta, versao):
+    tokens = sorted({token for token in normalizar(pergunta or '').split() if token not in STOPWORDS})
+    return f"{versao}:{' '.join(tokens)}" if tokens else None
+
+
+def _padrao_nome(nome_usuario):
+    return re.compile(rf'\b{re.escape(nome_usuario)}\b')
+
+
+def obter(pergunta, nome_usuario, versao):
+    """Resposta já personalizada para `nome_usuario`, ou None se não estiver no cache."""
+    chave_pergunta = chave(pergunta, versao)
+    modelo = _cache.get(chave_pergunta) if chave_pergunta else None
+    if modelo is None:
+        return None
+    return modelo.replace(MARCADOR_NOME, nome_usuario or '')
+
+
+def guardar(pergunta, resposta, nome_usuario, versao):
+    """Guarda a resposta da IA sem a personalização (o nome vira marcador)."""
+    chave_pergunta = chave(pergunta, versao)
+    # Sem nome não há como separar a personalização da resposta
+    if not chave_pergunta or not resposta or not nome_usuario:
+        return
+    _cache.set(chave_pergunta, _padrao_nome(nome_usuario).sub(MARCADOR_NOME, resposta))
+
+
+def limpar():
+    _cache.clear()
@@ -0,0 +1,140 @@
+# chatbot/catalogo.py
+"""
+Catálogo da clínica usado pelo chatbot: especialidades (com o valor da
+consulta), médicos por especialidade e procedimentos agendáveis (ativos e
+com preço).
+
+Esses dados mudam poucas vezes por mês, então cada processo guarda o
+catálogo inteiro em memória, marcado com uma versão. A versão vale para
+todos os processos: é um contador no cache do Django (Redis em produção)
+que os sinais em chatbot/signals.py incrementam quando Especialidade,
+médico, Procedimento ou ValorProcedimentoConvenio mudam. Cada processo
+confere o contador no máximo a cada INTERVALO_VERIFICACAO_SEGUNDOS e
+recarrega (3 queries) quando ele muda.
+
+Estruturas calculadas a partir do catálogo (a trie do roteador local, por
+exemplo) ficam em derivado(), refeitas só quando a versão muda.
+
+A memória da conversa guarda só os IDs do que foi oferecido ao usuário
+(lista_especialidades, lista_procedimentos); resolver() devolve os itens.
+
+Os dicionários devolvidos são compartilhados entre as requisições: não
+devem ser alterados.
+"""
+
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+CHAVE_VERSAO = 'chatbot:catalogo:versao'
+INTERVALO_VERIFICACAO_SEGUNDOS = 1.0
+VALIDADE_MAXIMA_SEGUNDOS = 30 * 60  # Rede de segurança para alterações sem sinal (queryset.update())
+
+# Trocado inteiro a cada recarga: quem já pegou o estado antigo termina com ele
+_atual = {'versao': None, 'dados': None, 'derivados': {}, 'carregado_em': 0.0, 'verificado_em': 0.0}
+_trava = threading.Lock()
+
+
+def _carregar():
+    from usuarios.models import CustomUser, Especialidade
+    from faturamento.models import Procedimento
+
+    especialidades = {
+        esp['id']: esp for esp in Especialidade.objects.order_by('nome').values('id', 'nome', 'valor_consulta')
+    }
+    procedimentos = {
+        proc['id']: proc
+        for proc in Procedimento.objects.filter(ativo=True, valor_particular__gt=0).values('id', 'descricao', 'valor_particular')
+    }
+    medicos = {}
+    linhas = CustomUser.objects.filter(cargo='medico', is_active=True, especialidades__isnull=False).values(
+        'id', 'first_name', 'last_name', 'especialidades__id'
+    )
+    for medico in linhas:
+        medicos.setdefault(medico.pop('especialidades__id'), []).append(medico)
+    return {'especialidades': especialidades, 'procedimentos': procedimentos, 'medicos': medicos}
+
+
+def versao():
+    """Versão do catálogo compartilhada por todos os processos."""
+    atual = cache.get(CHAVE_VERSAO)
+    if atual is None:
+        # Cache vazio (reinício do Redis): começa de um valor que nenhum processo tem
+        cache.add(CHAVE_VERSAO, time.time_ns(), None)
+        atual = cache.get(CHAVE_VERSAO)
+    return atual
+
+
+def _estado():
+    global _atual
+    agora = time.monotonic()
+    estado = _atual
+    if estado['dados'] is not None and agora - estado['verificado_em'] < INTERVALO_VERIFICACAO_SEGUNDOS:
+        return estado
+    versao_compartilhada = versao()
+    with _trava:
+        estado = _atual
+        if (estado['dados'] is None or estado['versao'] != versao_compartilhada
+                or agora - estado['carregado_em'] > VALIDADE_MAXIMA_SEGUNDOS):
+            estado = {'versao': versao_compartilhada, 'dados': _carregar(), 'derivados': {}, 'carregado_em': agora}
+            _atual = estado
+        estado['verificado_em'] = agora
+        return estado
+
+
+def especialidades():
+    """{id: {'id', 'nome', 'valor_consulta'}}, em ordem alfabética."""
+    return _estado()['dados']['especialidades']
+
+
+def procedimentos():
+    """{id: {'id', 'descricao', 'valor_particular'}} dos procedimentos agendáveis."""
+    return _estado()['dados']['procedimentos']
+
+
+def medicos(especialidade_id):
+    """[{'id', 'first_name', 'last_name'}] dos médicos ativos da especialidade."""
+    return _estado()['dados']['medicos'].get(especialidade_id, [])
+
+
+def derivado(nome, construir):
+    """`construir(dados do catálogo)`, calculado uma vez por versão do catálogo."""
+    estado = _estado()
+    derivados = estado['derivados']
+    if nome not in derivados:
+        derivados[nome] = construir(estado['dados'])
+    return derivados[nome]
+
+
+def resolver(ids, catalogo):
+    """
+    Itens do catálogo para os IDs guardados na memória, na mesma ordem. Os
+    que saíram do catálogo são ignorados; conversas antigas ainda podem ter
+    os itens completos (dicts) em vez dos IDs.
+    """
+    itens = []
+    for item in ids:
+        item_id = item['id'] if isinstance(item, dict) else item
+        if item_id in catalogo:
+            itens.append(catalogo[item_id])
+    return itens
+
+
+def _incrementar_versao():
+    try:
+        cache.incr(CHAVE_VERSAO)
+    except ValueError:
+        cache.add(CHAVE_VERSAO, time.time_ns(), None)
+    # Este processo não espera o intervalo de verificação
+    _atual['verificado_em'] = 0.0
+
+
+def invalidar():
+    """
+    Nova versão do catálogo para todos os processos. Dentro de uma transação,
+    só depois do commit: antes disso outro processo recarregaria o catálogo
+    antigo já com a versão nova.
+    """
+    transaction.on_commit(_incrementar_versao)
@@ -1,42 +1,33 @@
 # chatbot/chains.py
+"""
+Chains de IA (Gemini) do chatbot, construídas sob demanda.
+
+Importar o langchain e montar o cliente, os schemas e os prompts custa quase
+um segundo. Por isso este módulo só guarda os textos dos prompts; as chains
+são montadas na primeira vez que alguém as usa (`chains.chain_faq`,
+`obter_chains()`) ou quando o processo web chama `aquecer()` na subida.
+Comandos de manutenção (check_inactivity, limpar_chatbot...) nunca pagam esse
+custo.
+
+Qual modelo cada chain usa, quanto tempo espera por ele e o fallback ficam
+em modelos_ia (PoliticaChain).
+"""
 
 import os
 import logging
-from typing import Optional
-from pydantic import BaseModel, Field
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
-from langchain_core.runnables import Runnable
+import threading
+import time
 
-logger = logging.getLogger(__name__)
+from . import modelos_ia
 
-# --- CONFIGURAÇÃO E INICIALIZAÇÃO SEGURA DO "CÉREBRO" DE IA ---
+logger = logging.getLogger(__name__)
 
-llm = None
-chain_roteadora: Optional[Runnable] = None
-chain_sintomas: Optional[Runnable] = None
-chain_extracao_dados: Optional[Runnable] = None
-chain_faq: Optional[Runnable] = None
+NOMES_CHAINS = ('llm', 'chain_roteadora', 'chain_sintomas', 'chain_extracao_dados', 'chain_faq')
+TIMEOUT_CLIENTE_SEGUNDOS = 30
 
-try:
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        # Lança um erro claro se a chave não estiver no ambiente
-        raise ValueError("A variável de ambiente GOOGLE_API_KEY não foi encontrada.")
-
-    # Inicializa o modelo de linguagem
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-pro", temperature=0, google_api_key=api_key)
-    logger.info("LLM (Gemini) inicializado com sucesso.")
+# --- TEXTOS DOS PROMPTS (baratos: sem langchain) ---
 
-    # --- CÉREBRO 1: IA ROTEADORA DE INTENÇÕES (AGORA COM MEMÓRIA) ---
-    class RoteadorOutput(BaseModel):
-        intent: str = Field(description="A intenção do usuário. Deve ser uma das: 'iniciar_agendamento', 'buscar_preco', 'cancelar_agendamento', 'triagem_sintomas', 'transferencia_humano', 'encerrar_conversa', 'pergunta_geral'.")
-        entity: Optional[str] = Field(description="O serviço, especialidade ou sintoma específico que o usuário mencionou, se houver (ex: 'Cardiologia', 'Ecocardiograma', 'dor de cabeça').")
-    
-    parser_roteador = JsonOutputParser(pydantic_object=RoteadorOutput)
-    prompt_roteador = ChatPromptTemplate.from_template(
-        """# MISSÃO
+PROMPT_ROTEADOR = """# MISSÃO
         Sua principal missão é analisar a MENSAGEM ATUAL do usuário e, usando o HISTÓRICO DA CONVERSA como contexto, determinar a intenção principal e a entidade.
 
         # HISTÓRICO DA CONVERSA (ÚLTIMAS MENSAGENS)
@@ -56,19 +47,11 @@ try:
         {format_instructions}
 
         # MENSAGEM ATUAL DO USUÁRIO (PARA ANÁLISE)
-        {user_message}""",
-        partial_variables={"format_instructions": parser_roteador.get_format_instructions()},
-    )
-    chain_roteadora = prompt_roteador | llm | parser_roteador
+        {user_message}"""
 
-    # --- CÉREBRO 2: IA DE TRIAGEM DE SINTOMAS ---
-    lista_especialidades_para_ia = "Cardiologia, Ginecologia, Ortopedia, Pediatria, Clínico Geral"
-    class TriagemOutput(BaseModel):
-        especialidade_sugerida: str = Field(description=f"A especialidade médica mais adequada. Deve ser uma das: {lista_especialidades_para_ia}, ou 'Nenhuma' se os sintomas forem muito vagos.")
-    
-    parser_sintomas = JsonOutputParser(pydantic_object=TriagemOutput)
-    prompt_sintomas = ChatPromptTemplate.from_template(
-        """# MISSÃO
+lista_especialidades_para_ia = "Cardiologia, Ginecologia, Ortopedia, Pediatria, Clínico Geral"
+
+PROMPT_SINTOMAS = """# MISSÃO
         Você é um assistente de triagem. Baseado nos sintomas, sugira a especialidade médica mais provável da lista. JAMAIS dê diagnósticos.
         # REGRAS
         - Dor no peito, palpitações, pressão alta -> Cardiologia.
@@ -80,13 +63,9 @@ try:
         # INSTRUÇÕES DE FORMATAÇÃO
         {format_instructions}
         # SINTOMAS DO USUÁRIO
-        {sintomas_do_usuario}""",
-        partial_variables={"format_instructions": parser_sintomas.get_format_instructions()},
-    )
-    chain_sintomas = prompt_sintomas | llm | parser_sintomas
+        {sintomas_do_usuario}"""
 
-    # --- CÉREBRO 3: IA DE PERGUNTAS FREQUENTES (COM MAIS CONHECIMENTO E PERSONALIDADE) ---
-    faq_base_de_conhecimento = """
+faq_base_de_conhecimento = """
     **P: Qual o endereço da clínica?**
     R: Nosso endereço é Rua Orense, 41 – Sala 512, no Condomínio D Office, centro de Diadema/SP.
     **P: Qual o horário de funcionamento?**
@@ -100,12 +79,8 @@ try:
     **P: Qual o telefone da clínica?**
     R: Você pode entrar em contato conosco pelo mesmo número de WhatsApp que está falando agora. Para outros assuntos, o telefone da recepção é (11) XXXX-XXXX.
     """
-    class FaqOutput(BaseModel):
-        resposta: str = Field(description="A resposta à pergunta do usuário, baseada estritamente na base de conhecimento.")
-    
-    parser_faq = JsonOutputParser(pydantic_object=FaqOutput)
-    prompt_faq_template = ChatPromptTemplate.from_template(
-        """# MISSÃO
+
+PROMPT_FAQ = """# MISSÃO
         Você é a secretária Leonidas. Responda à pergunta do usuário usando APENAS a base de conhecimento e o nome dele para criar uma conexão.
 
         # BASE DE CONHECIMENTO (FAQ)
@@ -123,10 +98,118 @@ try:
         {format_instructions}
 
         # PERGUNTA DO USUÁRIO
-        {pergunta_do_usuario}""",
+        {pergunta_do_usuario}"""
+
+
+# --- CONFIGURAÇÃO E INICIALIZAÇÃO SEGURA DO "CÉREBRO" DE IA ---
+
+def criar_llm(nivel):
+    """Cliente Gemini do nível ('rapido'/'completo', ver modelos_ia.NIVEIS_MODELO)."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        # Lança um erro claro se a chave não estiver no ambiente
+        raise ValueError("A variável de ambiente GOOGLE_API_KEY não foi encontrada.")
+    # O orçamento de cada chain é controlado em modelos_ia; aqui só evitamos
+    # que o cliente fique re-tentando (o padrão são 6 tentativas) por minutos
+    return ChatGoogleGenerativeAI(
+        model=modelos_ia.NIVEIS_MODELO[nivel], temperature=0, google_api_key=api_key,
+        timeout=TIMEOUT_CLIENTE_SEGUNDOS, max_retries=1,
+    )
+
+
+def montar_chains(fabrica_llm=criar_llm):
+    """
+    Monta as chains com os LLMs devolvidos por `fabrica_llm(nivel)`. Cada
+    chain vira uma CadeiaRoteada com uma versão por nível de modelo; trocar a
+    fábrica por um modelo falso permite testar orçamentos e fallbacks sem rede.
+    """
+    from typing import Optional
+    from pydantic import BaseModel, Field
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.output_parsers import JsonOutputParser
+
+    chains = dict.fromkeys(NOMES_CHAINS)
+
+    # Inicializa os modelos de linguagem, um por nível
+    llms = {nivel: fabrica_llm(nivel) for nivel in modelos_ia.NIVEIS_MODELO}
+    chains['llm'] = llms['completo']
+    logger.info("LLM (Gemini) inicializado com sucesso.")
+
+    def rotear(nome, prompt, parser):
+        cadeias = {nivel: prompt | llm | parser for nivel, llm in llms.items()}
+        return modelos_ia.CadeiaRoteada(nome, cadeias, modelos_ia.politica(nome))
+
+    # --- CÉREBRO 1: IA ROTEADORA DE INTENÇÕES (AGORA COM MEMÓRIA) ---
+    class RoteadorOutput(BaseModel):
+        intent: str = Field(description="A intenção do usuário. Deve ser uma das: 'iniciar_agendamento', 'buscar_preco', 'cancelar_agendamento', 'triagem_sintomas', 'transferencia_humano', 'encerrar_conversa', 'pergunta_geral'.")
+        entity: Optional[str] = Field(description="O serviço, especialidade ou sintoma específico que o usuário mencionou, se houver (ex: 'Cardiologia', 'Ecocardiograma', 'dor de cabeça').")
+
+    parser_roteador = JsonOutputParser(pydantic_object=RoteadorOutput)
+    prompt_roteador = ChatPromptTemplate.from_template(
+        PROMPT_ROTEADOR,
+        partial_variables={"format_instructions": parser_roteador.get_format_instructions()},
+    )
+    chains['chain_roteadora'] = rotear('chain_roteadora', prompt_roteador, parser_roteador)
+
+    # --- CÉREBRO 2: IA DE TRIAGEM DE SINTOMAS ---
+    class TriagemOutput(BaseModel):
+        especialidade_sugerida: str = Field(description=f"A especialidade médica mais adequada. Deve ser uma das: {lista_especialidades_para_ia}, ou 'Nenhuma' se os sintomas forem muito vagos.")
+
+    parser_sintomas = JsonOutputParser(pydantic_object=TriagemOutput)
+    prompt_sintomas = ChatPromptTemplate.from_template(
+        PROMPT_SINTOMAS,
+        partial_variables={"format_instructions": parser_sintomas.get_format_instructions()},
+    )
+    chains['chain_sintomas'] = rotear('chain_sintomas', prompt_sintomas, parser_sintomas)
+
+    # --- CÉREBRO 3: IA DE PERGUNTAS FREQUENTES (COM MAIS CONHECIMENTO E PERSONALIDADE) ---
+    class FaqOutput(BaseModel):
+        resposta: str = Field(description="A resposta à pergunta do usuário, baseada estritamente na base de conhecimento.")
+
+    parser_faq = JsonOutputParser(pydantic_object=FaqOutput)
+    prompt_faq_template = ChatPromptTemplate.from_template(
+        PROMPT_FAQ,
         partial_variables={"format_instructions": parser_faq.get_format_instructions()},
     )
-    chain_faq = prompt_faq_template | llm | parser_faq
+    chains['chain_faq'] = rotear('chain_faq', prompt_faq_template, parser_faq)
+
+    return chains
 
-except Exception as e:
-    logger.critical(f"FALHA CRÍTICA AO INICIALIZAR AS CHAINS DE IA: {e}", exc_info=True)
\ No newline at end of file
+
+_chains = None
+_trava = threading.Lock()
+
+
+def obter_chains():
+    """
+    Dicionário {nome: chain} (ver NOMES_CHAINS), montado uma única vez por
+    processo. Se a inicialização falhar, as chains ficam None, como antes.
+    """
+    global _chains
+    if _chains is None:
+        with _trava:
+            if _chains is None:
+                try:
+                    _chains = montar_chains()
+                except Exception as e:
+                    logger.critical(f"FALHA CRÍTICA AO INICIALIZAR AS CHAINS DE IA: {e}", exc_info=True)
+                    _chains = dict.fromkeys(NOMES_CHAINS)
+    return _chains
+
+
+def aquecer():
+    """Monta as chains agora (subida do processo web). Retorna o tempo gasto, em ms."""
+    inicio = time.perf_counter()
+    obter_chains()
+    duracao_ms = (time.perf_counter() - inicio) * 1000
+    logger.info(f"Chains de IA prontas em {duracao_ms:.0f} ms.")
+    return duracao_ms
+
+
+def __getattr__(nome):
+    # `chains.chain_faq` continua funcionando, mas só monta as chains no primeiro acesso
+    if nome in NOMES_CHAINS:
+        return obter_chains()[nome]
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
@@ -1,12 +1,11 @@
 import re
-import os
-import requests
 import json
 import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.utils.html import escape
-from .models import ChatMemory
+from . import envio_mensagens, estado_sessao
 
 logger = logging.getLogger(__name__)
 
@@ -61,11 +60,14 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # 1. Marca a conversa como sendo atendida por um humano
         await self.set_conversation_state('humano')
 
-        # 2. Envia a mensagem para o WhatsApp do paciente
-        # Esta é a parte que você precisará implementar a integração com a API do WhatsApp
-        # Por exemplo:
-        # await enviar_mensagem_whatsapp(self.session_id, message_from_reception)
-        logger.warning(f"SIMULAÇÃO: Enviando '{message_from_reception}' para o WhatsApp do paciente {self.session_id}")
+        # 2. Envia a mensagem para o WhatsApp do paciente (via N8N, pelo gateway de saída)
+        webhook_url = getattr(settings, 'N8N_PROACTIVE_WEBHOOK_URL', None)
+        if not webhook_url:
+            logger.warning(f"SIMULAÇÃO: Enviando '{message_from_reception}' para o WhatsApp do paciente {self.session_id}")
+            return
+        status = await envio_mensagens.aenviar(webhook_url, {"sessionId": self.session_id, "message": message_from_reception})
+        if status == envio_mensagens.FALHOU:
+            await self.send(text_data=json.dumps({'error': 'Não foi possível enviar a mensagem ao paciente'}))
 
         # (Opcional) Você pode querer salvar esta mensagem no banco de dados também.
 
@@ -81,5 +83,5 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     @database_sync_to_async
     def set_conversation_state(self, new_state):
-        """Atualiza o estado da conversa no banco de dados."""
-        ChatMemory.objects.filter(session_id=self.session_id).update(state=new_state)
+        """Atualiza o estado da conversa no banco de dados (e no estado quente do bot)."""
+        estado_sessao.atualizar(self.session_id, state=new_state)
@@ -7,9 +7,12 @@ from django.utils import timezone
 from datetime import timedelta
 from .analytics import AnalyticsManager
 from .models import ChatbotMetrics
-from .models import ChatMemory
+from .models import ChatMemory, TransicaoEstado
 from django.db.models import Count, Avg
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 class ChatbotDashboardView(APIView):
     """Dashboard com métricas do chatbot"""
@@ -36,39 +39,26 @@ class ChatbotDashboardView(APIView):
             count=Count('id')
         ).order_by('-count')[:10]
 
-        # Horários de maior atividade - otimizada
+        # Horários de maior atividade e sessões por dia (agregados por hora)
         try:
-            metricas_por_hora = ChatbotMetrics.objects.filter(
-                timestamp__gte=inicio_periodo
-            ).extra(
-                select={'hora': 'EXTRACT(hour FROM timestamp)'}
-            ).values('hora').annotate(
-                count=Count('id')
-            ).order_by('hora')[:24]  # Limita a 24 horas
+            metricas_por_hora = AnalyticsManager.obter_atividade_por_hora(dias)
         except Exception as e:
             logger.error(f"Erro ao buscar métricas por hora: {e}")
             metricas_por_hora = []
 
-        # Sessões por dia - otimizada
         try:
-            sessoes_por_dia = ChatbotMetrics.objects.filter(
-                timestamp__gte=inicio_periodo,
-                evento='inicio_conversa'
-            ).extra(
-                select={'dia': 'DATE(timestamp)'}
-            ).values('dia').annotate(
-                count=Count('id')
-            ).order_by('dia')[:31]  # Limita a 31 dias
+            sessoes_por_dia = AnalyticsManager.obter_sessoes_por_dia(dias)
         except Exception as e:
             logger.error(f"Erro ao buscar sessões por dia: {e}")
             sessoes_por_dia = []
 
-        # Tempo médio por estado
+        # Tempo médio por estado e funil (transições de estado)
         try:
             tempo_por_estado = self._calcular_tempo_por_estado(inicio_periodo)
+            funil_estados = self._calcular_funil(inicio_periodo)
         except Exception as e:
             logger.error(f"Erro ao calcular tempo por estado: {e}")
-            tempo_por_estado = {}
+            tempo_por_estado, funil_estados = {}, []
 
         return Response({
             'periodo': {
@@ -81,50 +71,42 @@ class ChatbotDashboardView(APIView):
             'atividade_por_hora': list(metricas_por_hora),
             'sessoes_por_dia': list(sessoes_por_dia),
             'tempo_por_estado': tempo_por_estado,
+            'funil_estados': funil_estados,
+            'roteador_local': AnalyticsManager.obter_metricas_roteador(dias),
             'resumo': self._gerar_resumo_insights(metricas_basicas, estados_abandono)
         })
 
     def _calcular_tempo_por_estado(self, inicio_periodo):
-        """Calcula tempo médio gasto em cada estado"""
-        memorias = ChatMemory.objects.filter(
-            updated_at__gte=inicio_periodo
-        ).exclude(state='inicio')
-
-        tempos_por_estado = {}
-
-        for memoria in memorias:
-            historico = memoria.memory_data.get('historico_conversa', [])
-            if not historico:
-                continue
-
-            for i, interacao in enumerate(historico[:-1]):
-                estado_atual = interacao.get('estado')
-                timestamp_atual = interacao.get('timestamp')
-                timestamp_proximo = historico[i + 1].get('timestamp')
-
-                if estado_atual and timestamp_atual and timestamp_proximo:
-                    try:
-                        tempo_atual = timezone.datetime.fromisoformat(timestamp_atual.replace('Z', '+00:00'))
-                        tempo_proximo = timezone.datetime.fromisoformat(timestamp_proximo.replace('Z', '+00:00'))
-                        duracao = (tempo_proximo - tempo_atual).total_seconds() / 60  # em minutos
-
-                        if estado_atual not in tempos_por_estado:
-                            tempos_por_estado[estado_atual] = []
-                        tempos_por_estado[estado_atual].append(duracao)
-                    except (ValueError, TypeError, AttributeError) as e:
-                        logger.debug(f"Erro ao processar timestamp: {e}")
-                        continue
-
-        # Calcula médias
-        medias_por_estado = {}
-        for estado, tempos in tempos_por_estado.items():
-            if tempos:
-                medias_por_estado[estado] = {
-                    'tempo_medio_minutos': round(sum(tempos) / len(tempos), 2),
-                    'total_ocorrencias': len(tempos)
-                }
-
-        return medias_por_estado
+        """Tempo médio gasto em cada estado, pelas transições de estado do período"""
+        linhas = TransicaoEstado.objects.filter(
+            entrou_em__gte=inicio_periodo,
+            estado_anterior__isnull=False,
+            duracao_ms__isnull=False
+        ).values('estado_anterior').annotate(
+            media_ms=Avg('duracao_ms'),
+            total=Count('id')
+        )
+
+        return {
+            linha['estado_anterior']: {
+                'tempo_medio_minutos': round(linha['media_ms'] / 60000, 2),
+                'total_ocorrencias': linha['total']
+            }
+            for linha in linhas
+        }
+
+    def _calcular_funil(self, inicio_periodo):
+        """Quantas vezes e quantas sessões entraram em cada estado no período"""
+        return list(
+            TransicaoEstado.objects.filter(
+                entrou_em__gte=inicio_periodo
+            ).exclude(
+                estado_novo__isnull=True
+            ).values('estado_novo').annotate(
+                entradas=Count('id'),
+                sessoes=Count('session_id', distinct=True)
+            ).order_by('-sessoes')
+        )
 
     def _gerar_resumo_insights(self, metricas_basicas, estados_abandono):
         """Gera insights automáticos"""
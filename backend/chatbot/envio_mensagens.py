@@ -0,0 +1,298 @@
+# chatbot/envio_mensagens.py
+"""
+Gateway único das mensagens de saída para o paciente (WhatsApp, direto ou
+via N8N): avisos de inatividade, lembretes de consulta e respostas da
+recepção.
+
+- Cliente HTTP persistente, com pool de conexões: um httpx.Client para quem
+  chama de código síncrono (comandos, threads) e um httpx.AsyncClient por
+  event loop para quem já é assíncrono (consumer, views async).
+- Limite de taxa por balde de fichas (MENSAGENS_POR_SEGUNDO, rajadas de até
+  RAJADA), compartilhado pelos dois clientes do processo, para respeitar o
+  limite do provedor de WhatsApp.
+- Concorrência limitada (CONCORRENCIA envios em andamento por processo).
+- Falhas temporárias (sem conexão, 429, 5xx) são repetidas na hora até
+  TENTATIVAS_IMEDIATAS vezes, com espera exponencial e jitter; se ainda
+  falharem, a mensagem vai para a tabela EnvioPendente e
+  reenviar_pendentes() tenta de novo mais tarde (check_inactivity
+  --continuo ou o comando reenviar_mensagens). Erros definitivos (4xx) só
+  vão para o log.
+- Só é repetido o que certamente não chegou ao provedor: falha ao conectar
+  ou sem conexão livre no pool. Um timeout de leitura ou um erro no meio
+  da requisição pode acontecer depois de o provedor aceitar o POST, e
+  repetir mandaria a mensagem duas vezes ao paciente: esses terminam em
+  INCERTO, sem nova tentativa.
+
+Cada envio termina em ENVIADO, NA_FILA (guardado para reenvio), INCERTO
+(pode ter chegado; não é repetido) ou FALHOU.
+Para testar sem o provedor: `python manage.py simular_webhook`.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import httpx
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EnvioPendente
+
+logger = logging.getLogger(__name__)
+
+MENSAGENS_POR_SEGUNDO = float(os.environ.get('WHATSAPP_MENSAGENS_POR_SEGUNDO', 10))
+RAJADA = int(os.environ.get('WHATSAPP_RAJADA', 20))
+CONCORRENCIA = int(os.environ.get('WHATSAPP_CONCORRENCIA', 20))
+TIMEOUT_SEGUNDOS = 15
+
+TENTATIVAS_IMEDIATAS = 3
+ESPERA_BASE_SEGUNDOS = 0.5
+ESPERA_MAXIMA_SEGUNDOS = 8
+STATUS_TEMPORARIOS = {408, 425, 429, 500, 502, 503, 504}
+# A requisição não saiu: repetir não duplica a mensagem
+ERROS_ANTES_DO_ENVIO = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# Reenvio pela tabela EnvioPendente
+MAX_TENTATIVAS = 10
+ESPERA_BASE_REENVIO = timedelta(minutes=1)
+ESPERA_MAXIMA_REENVIO = timedelta(hours=2)
+RESERVA_REENVIO = timedelta(minutes=5)  # Outro worker não pega o mesmo envio enquanto este tenta
+
+ENVIADO = 'enviado'
+NA_FILA = 'na_fila'
+INCERTO = 'incerto'
+FALHOU = 'falhou'
+
+
+class BaldeDeFichas:
+    """Limite de taxa: `taxa` fichas por segundo, acumulando até `capacidade`."""
+
+    def __init__(self, taxa, capacidade):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self._fichas = float(capacidade)
+        self._atualizado = time.monotonic()
+        self._trava = threading.Lock()
+
+    def reservar(self):
+        """Tira uma ficha e devolve quantos segundos esperar até ela valer."""
+        with self._trava:
+            agora = time.monotonic()
+            self._fichas = min(self.capacidade, self._fichas + (agora - self._atualizado) * self.taxa)
+            self._atualizado = agora
+            self._fichas -= 1
+            return 0.0 if self._fichas >= 0 else -self._fichas / self.taxa
+
+
+_balde = BaldeDeFichas(MENSAGENS_POR_SEGUNDO, RAJADA)
+_vagas = threading.BoundedSemaphore(CONCORRENCIA)
+_cliente = None
+_trava_cliente = threading.Lock()
+_clientes_async = weakref.WeakKeyDictionary()  # event loop -> (AsyncClient, Semaphore)
+
+
+def _limites():
+    return httpx.Limits(max_connections=CONCORRENCIA, max_keepalive_connections=CONCORRENCIA)
+
+
+def _cliente_sincrono():
+    global _cliente
+    with _trava_cliente:
+        if _cliente is None:
+            _cliente = httpx.Client(timeout=TIMEOUT_SEGUNDOS, limits=_limites())
+        return _cliente
+
+
+def _cliente_assincrono():
+    # O AsyncClient fica preso ao event loop em que abriu as conexões
+    loop = asyncio.get_running_loop()
+    if loop not in _clientes_async:
+        _clientes_async[loop] = (httpx.AsyncClient(timeout=TIMEOUT_SEGUNDOS, limits=_limites()), asyncio.Semaphore(CONCORRENCIA))
+    return _clientes_async[loop]
+
+
+def _classificar(resposta):
+    if resposta.is_success:
+        return ENVIADO, None
+    status = NA_FILA if resposta.status_code in STATUS_TEMPORARIOS else FALHOU
+    return status, f"HTTP {resposta.status_code}: {resposta.text[:200]}"
+
+
+def _classificar_erro(erro):
+    status = NA_FILA if isinstance(erro, ERROS_ANTES_DO_ENVIO) else INCERTO
+    return status, f"{type(erro).__name__}: {erro}"
+
+
+def _espera(tentativa, resposta):
+    """Espera antes da próxima tentativa: o Retry-After do 429, ou exponencial com jitter."""
+    retry_after = resposta.headers.get('Retry-After', '') if resposta is not None else ''
+    if retry_after.isdigit():
+        return min(float(retry_after), ESPERA_MAXIMA_SEGUNDOS)
+    # Jitter "completo": quem falhou junto não tenta de novo junto
+    return random.uniform(0, min(ESPERA_MAXIMA_SEGUNDOS, ESPERA_BASE_SEGUNDOS * 2 ** tentativa))
+
+
+def _tentar(url, payload):
+    """(status, erro) depois das tentativas imediatas, pelo cliente síncrono."""
+    cliente = _cliente_sincrono()
+    for tentativa in range(TENTATIVAS_IMEDIATAS):
+        time.sleep(_balde.reservar())
+        resposta = None
+        try:
+            with _vagas:
+                resposta = cliente.post(url, json=payload)
+            status, erro = _classificar(resposta)
+        except httpx.TransportError as e:
+            status, erro = _classificar_erro(e)
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
+            status, erro = FALHOU, f"{type(e).__name__}: {e}"
+        if status != NA_FILA or tentativa + 1 == TENTATIVAS_IMEDIATAS:
+            return status, erro
+        time.sleep(_espera(tentativa, resposta))
+
+
+async def _atentar(url, payload):
+    """(status, erro) depois das tentativas imediatas, pelo cliente do event loop."""
+    cliente, vagas = _cliente_assincrono()
+    for tentativa in range(TENTATIVAS_IMEDIATAS):
+        await asyncio.sleep(_balde.reservar())
+        resposta = None
+        try:
+            async with vagas:
+                resposta = await cliente.post(url, json=payload)
+            status, erro = _classificar(resposta)
+        except httpx.TransportError as e:
+            status, erro = _classificar_erro(e)
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
+            status, erro = FALHOU, f"{type(e).__name__}: {e}"
+        if status != NA_FILA or tentativa + 1 == TENTATIVAS_IMEDIATAS:
+            return status, erro
+        await asyncio.sleep(_espera(tentativa, resposta))
+
+
+def _espera_reenvio(tentativas):
+    espera = min(ESPERA_MAXIMA_REENVIO, ESPERA_BASE_REENVIO * 2 ** (tentativas - 1))
+    return espera * random.uniform(0.5, 1)
+
+
+def _concluir(envios, resultados):
+    """Registra os erros e guarda os envios NA_FILA para reenvio. Devolve os status."""
+    agora = timezone.now()
+    pendentes = []
+    for (url, payload), (status, erro) in zip(envios, resultados):
+        if status == FALHOU:
+            logger.error(f"Envio para {url} falhou sem nova tentativa: {erro}")
+        elif status == INCERTO:
+            logger.warning(f"Envio para {url} sem confirmação ({erro}); não será repetido para não duplicar a mensagem.")
+        elif status == NA_FILA:
+            logger.warning(f"Envio para {url} falhou ({erro}); guardado para reenvio.")
+            pendentes.append(EnvioPendente(
+                url=url, payload=payload, tentativas=1, ultimo_erro=erro, proxima_tentativa=agora + _espera_reenvio(1)
+            ))
+    status = [status for status, _ in resultados]
+    if pendentes:
+        try:
+            EnvioPendente.objects.bulk_create(pendentes)
+        except Exception as e:
+            logger.error(f"Não foi possível guardar {len(pendentes)} envios para reenvio: {e}")
+            status = [FALHOU if s == NA_FILA else s for s in status]
+    return status
+
+
+def _enviar_varios(envios, concorrencia):
+    if len(envios) == 1:
+        return [_tentar(*envios[0])]
+    with ThreadPoolExecutor(max_workers=max(1, min(concorrencia, CONCORRENCIA, len(envios)))) as executor:
+        return list(executor.map(lambda envio: _tentar(*envio), envios))
+
+
+async def _aenviar_varios(envios, concorrencia):
+    semaforo = asyncio.Semaphore(concorrencia)
+
+    async def enviar(url, payload):
+        async with semaforo:
+            return await _atentar(url, payload)
+
+    return await asyncio.gather(*(enviar(url, payload) for url, payload in envios))
+
+
+def enviar(url, payload):
+    """Envia um payload JSON para `url`. Devolve ENVIADO, NA_FILA ou FALHOU."""
+    return _concluir([(url, payload)], [_tentar(url, payload)])[0]
+
+
+async def aenviar(url, payload):
+    """enviar() para quem está em um event loop."""
+    from .bot_logic import executar_no_banco
+
+    resultado = await _atentar(url, payload)
+    if resultado[0] == ENVIADO:
+        return ENVIADO
+    return (await executar_no_banco(_concluir, [(url, payload)], [resultado]))[0]
+
+
+def enviar_lote(envios, concorrencia=CONCORRENCIA):
+    """[(url, payload)] enviados em paralelo; devolve os status na mesma ordem."""
+    envios = list(envios)
+    if not envios:
+        return []
+    return _concluir(envios, _enviar_varios(envios, concorrencia))
+
+
+async def aenviar_lote(envios, concorrencia=CONCORRENCIA):
+    """enviar_lote() para quem está em um event loop."""
+    from .bot_logic import executar_no_banco
+
+    envios = list(envios)
+    if not envios:
+        return []
+    resultados = await _aenviar_varios(envios, concorrencia)
+    return await executar_no_banco(_concluir, envios, resultados)
+
+
+def reenviar_pendentes(limite=200):
+    """
+    Tenta de novo os envios guardados cuja vez chegou. Devolve o resumo
+    {'enviados', 'na_fila', 'incertos', 'desistencias'}.
+    """
+    agora = timezone.now()
+    with transaction.atomic():
+        pendentes = list(
+            EnvioPendente.objects.select_for_update(skip_locked=True)
+            .filter(proxima_tentativa__lte=agora).order_by('proxima_tentativa')[:limite]
+        )
+        EnvioPendente.objects.filter(id__in=[p.id for p in pendentes]).update(proxima_tentativa=agora + RESERVA_REENVIO)
+    resumo = {'enviados': 0, 'na_fila': 0, 'incertos': 0, 'desistencias': 0}
+    if not pendentes:
+        return resumo
+
+    resultados = _enviar_varios([(p.url, p.payload) for p in pendentes], CONCORRENCIA)
+    concluidos, adiados = [], []
+    for pendente, (status, erro) in zip(pendentes, resultados):
+        if status == ENVIADO:
+            resumo['enviados'] += 1
+            concluidos.append(pendente.id)
+        elif status == INCERTO:
+            logger.warning(f"Envio {pendente.id} para {pendente.url} sem confirmação ({erro}); não será repetido.")
+            resumo['incertos'] += 1
+            concluidos.append(pendente.id)
+        elif status == FALHOU or pendente.tentativas + 1 >= MAX_TENTATIVAS:
+            logger.error(f"Desistindo do envio {pendente.id} para {pendente.url} após {pendente.tentativas + 1} tentativas: {erro}")
+            resumo['desistencias'] += 1
+            concluidos.append(pendente.id)
+        else:
+            pendente.tentativas += 1
+            pendente.ultimo_erro = erro
+            pendente.proxima_tentativa = timezone.now() + _espera_reenvio(pendente.tentativas)
+            adiados.append(pendente)
+    EnvioPendente.objects.filter(id__in=concluidos).delete()
+    EnvioPendente.objects.bulk_update(adiados, ['tentativas', 'ultimo_erro', 'proxima_tentativa'])
+    resumo['na_fila'] = len(adiados)
+    return resumo
+
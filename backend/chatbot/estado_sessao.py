@@ -0,0 +1,406 @@
+# chatbot/estado_sessao.py
+"""
+Estado "quente" das conversas (state, previous_state, memory_data) com
+gravação adiada (write-behind) no ChatMemory.
+
+Durante a conversa o estado vive no cache do Django (Redis quando há
+REDIS_URL; LocMemCache, por processo, no desenvolvimento): cada mensagem lê
+e grava lá, sem ir ao banco. Uma thread em segundo plano leva as alterações
+para o ChatMemory:
+- em lote (um UPDATE só com os campos alterados) a cada
+  INTERVALO_DESCARGA_SEGUNDOS;
+- na hora, sem esperar o intervalo, quando o estado da conversa muda.
+O banco fica no máximo alguns segundos atrás do cache, o que basta para os
+dashboards e para o check_inactivity. Só a primeira mensagem de uma sessão
+que não está no cache consulta o banco.
+
+No Postgres, quem informa as chaves alteradas do memory_data (a
+SessaoConversa) grava só elas: `(memory_data - removidas) || alteradas`, o
+mesmo que um jsonb_set por chave, em vez de reenviar o JSON inteiro. Nos
+outros bancos (sqlite do desenvolvimento) o memory_data vai inteiro.
+
+Quem altera a conversa por fora do bot (tela da recepção, comandos de
+manutenção) deve usar atualizar(), que grava no banco e no estado quente.
+
+Cada descarga também atualiza os prazos de inatividade das sessões
+gravadas (chatbot.prazos_inatividade), insere as mudanças de estado
+(TransicaoEstado) registradas desde a anterior e soma nos agregados do
+dashboard os eventos de analytics acumulados (AnalyticsManager).
+
+Quando a sessão entrou no estado atual (estado_desde) vai junto com os
+campos quentes, no cache e na linha do ChatMemory, então a duração de cada
+estado sai pronta, sem consulta, mesmo depois de a sessão sair do cache.
+"""
+
+import atexit
+import logging
+import os
+import threading
+
+import orjson
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from . import prazos_inatividade
+from .analytics import AnalyticsManager
+from .models import ChatMemory, TransicaoEstado
+
+logger = logging.getLogger(__name__)
+
+TTL_SEGUNDOS = 60 * 60
+INTERVALO_DESCARGA_SEGUNDOS = float(os.environ.get('CHATBOT_INTERVALO_DESCARGA', 2))
+CAMPOS_QUENTES = ('state', 'previous_state', 'memory_data', 'updated_at', 'estado_desde')
+TIPOS_SQL = {'state': 'varchar', 'previous_state': 'varchar', 'updated_at': 'timestamptz', 'estado_desde': 'timestamptz'}
+TAMANHO_LOTE = 500
+
+# session_id -> estado ainda não gravado no banco (também protege contra o
+# LocMemCache descartar uma sessão antes da descarga)
+_pendentes = {}
+_campos_pendentes = {}  # session_id -> campos alterados desde a última descarga
+# session_id -> (chaves alteradas, chaves removidas) do memory_data; None = inteiro
+_chaves_pendentes = {}
+_transicoes_pendentes = []  # TransicaoEstado ainda não inseridas
+_trava = threading.Lock()
+_acordar = threading.Event()
+_descarregador = None
+
+
+def _chave(session_id):
+    return f"chatbot:sessao:{session_id}"
+
+
+def _dados(memoria):
+    return {'id': memoria.pk, **{campo: getattr(memoria, campo) for campo in CAMPOS_QUENTES}}
+
+
+def _memoria(session_id, dados):
+    memoria = ChatMemory(id=dados['id'], session_id=session_id, **{campo: dados[campo] for campo in CAMPOS_QUENTES})
+    memoria._estado_carregado = memoria.state
+    return memoria
+
+
+def _pendente(session_id):
+    with _trava:
+        return _pendentes.get(session_id)
+
+
+def _carregar_do_banco(session_id):
+    memoria, _ = ChatMemory.objects.get_or_create(session_id=session_id, defaults={'estado_desde': timezone.now()})
+    memoria._estado_carregado = memoria.state
+    cache.set(_chave(session_id), _dados(memoria), TTL_SEGUNDOS)
+    return memoria
+
+
+def obter(session_id):
+    """ChatMemory da sessão a partir do estado quente (banco só se não estiver lá)."""
+    dados = cache.get(_chave(session_id)) or _pendente(session_id)
+    if dados is None:
+        return _carregar_do_banco(session_id)
+    return _memoria(session_id, dados)
+
+
+def obter_varios(session_ids):
+    """{session_id: dados quentes} das sessões que estão no estado quente (sem ir ao banco)."""
+    chaves = {_chave(session_id): session_id for session_id in session_ids}
+    encontrados = {chaves[chave]: dados for chave, dados in cache.get_many(list(chaves)).items()}
+    with _trava:
+        for session_id in session_ids:
+            if session_id not in encontrados and session_id in _pendentes:
+                encontrados[session_id] = _pendentes[session_id]
+    return encontrados
+
+
+async def aobter(session_id):
+    dados = await cache.aget(_chave(session_id)) or _pendente(session_id)
+    if dados is None:
+        from .bot_logic import executar_no_banco
+        return await executar_no_banco(_carregar_do_banco, session_id)
+    return _memoria(session_id, dados)
+
+
+def _acumular_chaves(session_id, chaves):
+    # Chamar com a _trava. Uma vez inteiro, inteiro até a descarga.
+    if chaves is None or _chaves_pendentes.get(session_id, ()) is None:
+        _chaves_pendentes[session_id] = None
+        return
+    alteradas, removidas = _chaves_pendentes.setdefault(session_id, (set(), set()))
+    alteradas.update(chaves[0])
+    removidas.update(chaves[1])
+
+
+def _nova_transicao(session_id, anterior, novo, quando, desde):
+    # Chamar com a _trava
+    duracao_ms = round((quando - desde).total_seconds() * 1000) if desde else None
+    _transicoes_pendentes.append(TransicaoEstado(
+        session_id=session_id, estado_anterior=anterior, estado_novo=novo, entrou_em=quando, duracao_ms=duracao_ms
+    ))
+
+
+def _registrar_pendente(memoria, campos, chaves):
+    # Mesmo efeito do auto_now do save(): é a "última atividade" da conversa
+    memoria.updated_at = timezone.now()
+    anterior, desde = getattr(memoria, '_estado_carregado', None), memoria.estado_desde
+    mudou_de_estado = memoria.state != anterior
+    if mudou_de_estado:
+        memoria.estado_desde = memoria.updated_at
+    memoria._estado_carregado = memoria.state
+    dados = _dados(memoria)
+    with _trava:
+        if mudou_de_estado:
+            _nova_transicao(memoria.session_id, anterior, memoria.state, memoria.updated_at, desde)
+        _pendentes[memoria.session_id] = dados
+        _campos_pendentes.setdefault(memoria.session_id, {'updated_at'}).update(campos or CAMPOS_QUENTES)
+        if mudou_de_estado:
+            _campos_pendentes[memoria.session_id].add('estado_desde')
+        if not campos or 'memory_data' in campos:
+            _acumular_chaves(memoria.session_id, chaves if campos else None)
+    iniciar_descarregador()
+    if mudou_de_estado:
+        _acordar.set()
+    return dados
+
+
+def guardar(memoria, campos=None, chaves=None):
+    """
+    Substitui o memoria.save(): grava no estado quente e agenda a descarga.
+    `campos` (padrão: todos) limita o que a descarga escreve no banco;
+    updated_at vai sempre. `chaves` ((alteradas, removidas)) limita o que
+    vai do memory_data; sem elas, ele vai inteiro.
+    """
+    cache.set(_chave(memoria.session_id), _registrar_pendente(memoria, campos, chaves), TTL_SEGUNDOS)
+
+
+async def aguardar(memoria, campos=None, chaves=None):
+    await cache.aset(_chave(memoria.session_id), _registrar_pendente(memoria, campos, chaves), TTL_SEGUNDOS)
+
+
+def atualizar(session_id, **campos):
+    """
+    Alteração feita por fora do bot: vai para o banco na hora (como um
+    update()) e, se a sessão estiver quente, também para o cache e para a
+    descarga pendente, para não ser sobrescrita por ela.
+    """
+    campos.setdefault('updated_at', timezone.now())
+    anteriores = None
+    if 'state' in campos and not obter_varios([session_id]):
+        # Sessão fria: o estado anterior (para a transição) só está no banco
+        memoria = ChatMemory.objects.filter(session_id=session_id).only('session_id', 'state', 'estado_desde').first()
+        if memoria is not None:
+            anteriores = {session_id: (memoria.state, memoria.estado_desde)}
+    atualizacao = dict(campos)
+    if 'state' in campos:
+        # Só conta de novo se o estado mudar mesmo
+        atualizacao['estado_desde'] = Case(
+            When(~Q(state=campos['state']), then=Value(campos['updated_at'])), default=F('estado_desde')
+        )
+    ChatMemory.objects.filter(session_id=session_id).update(**atualizacao)
+    aplicar_no_estado_quente({session_id: campos}, anteriores)
+    if 'state' in campos:
+        prazos_inatividade.agendar([(session_id, campos['state'], campos['updated_at'])])
+
+
+def aplicar_no_estado_quente(alteracoes, anteriores=None):
+    """
+    {session_id: {campo: valor}} já gravados no banco por fora do bot
+    (atualizar(), UPDATE em lote do check_inactivity): leva os campos
+    quentes para o cache e para a descarga pendente, e registra as mudanças
+    de estado. `anteriores` ({session_id: (state, estado_desde)}) vale para
+    as sessões que não estão no estado quente.
+    """
+    quentes = {
+        session_id: {campo: valor for campo, valor in campos.items() if campo in CAMPOS_QUENTES}
+        for session_id, campos in alteracoes.items()
+    }
+    quentes = {session_id: campos for session_id, campos in quentes.items() if campos}
+    if not quentes:
+        return
+    chaves = {_chave(session_id): session_id for session_id in quentes}
+    atuais = {chaves[chave]: dados for chave, dados in cache.get_many(list(chaves)).items()}
+    extras = {}  # Fora dos campos a gravar: só para o estado quente
+    with _trava:
+        for session_id, campos in quentes.items():
+            if 'state' not in campos:
+                continue
+            dados = atuais.get(session_id) or _pendentes.get(session_id)
+            if dados:
+                anterior, desde = dados['state'], dados.get('estado_desde')
+            else:
+                anterior, desde = (anteriores or {}).get(session_id, (None, None))
+            if anterior != campos['state']:
+                quando = campos.get('updated_at') or timezone.now()
+                _nova_transicao(session_id, anterior, campos['state'], quando, desde)
+                extras[session_id] = {'estado_desde': quando}
+    if extras:
+        # Comandos (check_inactivity) também chegam aqui: a descarga insere as transições
+        iniciar_descarregador()
+        _acordar.set()
+    if atuais:
+        cache.set_many(
+            {_chave(session_id): {**dados, **quentes[session_id], **extras.get(session_id, {})} for session_id, dados in atuais.items()},
+            TTL_SEGUNDOS,
+        )
+    with _trava:
+        for session_id, campos in quentes.items():
+            if session_id in _pendentes:
+                _pendentes[session_id] = {**_pendentes[session_id], **campos, **extras.get(session_id, {})}
+                _campos_pendentes[session_id].update(campos)
+                if 'memory_data' in campos:
+                    _acumular_chaves(session_id, None)
+
+
+def _parte_do_memory_data(memoria, chaves):
+    """(dados, chaves a remover, inteiro?) do memory_data a gravar."""
+    dados = memoria.memory_data
+    if chaves is None or not isinstance(dados, dict):
+        return dados, [], True
+    alteradas, removidas = chaves
+    return {chave: dados[chave] for chave in alteradas if chave in dados}, sorted((removidas | alteradas) - dados.keys()), False
+
+
+def _gravar_parcial(grupo, campos, chaves_do_lote):
+    """
+    Postgres: UPDATE ... FROM (VALUES ...) em lotes de TAMANHO_LOTE, com o
+    memory_data montado no banco a partir das chaves alteradas. Retorna
+    quantas linhas gravou.
+    """
+    colunas = [campo for campo in CAMPOS_QUENTES if campo in campos and campo != 'memory_data']
+    tabela = connection.ops.quote_name(ChatMemory._meta.db_table)
+    valores = '(%s, ' + ''.join(f'%s::{TIPOS_SQL[coluna]}, ' for coluna in colunas) + '%s::jsonb, %s::text[], %s)'
+    atribuicoes = ''.join(f'{coluna} = v.{coluna}, ' for coluna in colunas)
+    gravadas = 0
+    for inicio in range(0, len(grupo), TAMANHO_LOTE):
+        parte = grupo[inicio:inicio + TAMANHO_LOTE]
+        parametros = []
+        for memoria in parte:
+            dados, removidas, inteiro = _parte_do_memory_data(memoria, chaves_do_lote.get(memoria.session_id))
+            parametros += [
+                memoria.id, *(getattr(memoria, coluna) for coluna in colunas),
+                orjson.dumps(dados, option=orjson.OPT_NON_STR_KEYS).decode(), removidas, inteiro,
+            ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {tabela} AS m SET {atribuicoes}"
+                "memory_data = CASE WHEN v.inteiro THEN v.dados ELSE (m.memory_data - v.removidas) || v.dados END "
+                f"FROM (VALUES {', '.join([valores] * len(parte))}) "
+                f"AS v(id, {''.join(coluna + ', ' for coluna in colunas)}dados, removidas, inteiro) "
+                "WHERE m.id = v.id",
+                parametros,
+            )
+            gravadas += cursor.rowcount
+    return gravadas
+
+
+def _gravar_transicoes(transicoes):
+    if not transicoes:
+        return
+    try:
+        with transaction.atomic():
+            TransicaoEstado.objects.bulk_create(transicoes, batch_size=TAMANHO_LOTE)
+    except Exception as e:
+        logger.error(f"Erro ao gravar as transições de estado: {e}", exc_info=True)
+        with _trava:
+            _transicoes_pendentes[:0] = transicoes
+
+
+def _recriar_apagadas(memorias):
+    """
+    Linhas apagadas (ex: limpar_chatbot, admin) com a conversa ainda quente:
+    grava o estado inteiro pelo session_id (INSERT ... ON CONFLICT DO UPDATE,
+    caso outro processo já tenha recriado a linha) e passa o novo id para o
+    estado quente, para as próximas descargas acharem a linha.
+    """
+    existentes = set(ChatMemory.objects.filter(id__in=[m.id for m in memorias]).values_list('id', flat=True))
+    apagadas = [memoria for memoria in memorias if memoria.id not in existentes]
+    if not apagadas:
+        return
+    recriadas = ChatMemory.objects.bulk_create(
+        [ChatMemory(session_id=m.session_id, **{campo: getattr(m, campo) for campo in CAMPOS_QUENTES}) for m in apagadas],
+        update_conflicts=True, unique_fields=['session_id'], update_fields=list(CAMPOS_QUENTES), batch_size=TAMANHO_LOTE,
+    )
+    novos_ids = {memoria.session_id: memoria.pk for memoria in recriadas}
+    for memoria in apagadas:
+        memoria.id = novos_ids[memoria.session_id]
+    with _trava:
+        for session_id, novo_id in novos_ids.items():
+            if session_id in _pendentes:
+                _pendentes[session_id] = {**_pendentes[session_id], 'id': novo_id}
+    chaves = {_chave(session_id): session_id for session_id in novos_ids}
+    em_cache = cache.get_many(list(chaves))
+    if em_cache:
+        cache.set_many({chave: {**dados, 'id': novos_ids[chaves[chave]]} for chave, dados in em_cache.items()}, TTL_SEGUNDOS)
+
+
+def descarregar():
+    """
+    Grava no ChatMemory as sessões pendentes, um UPDATE por conjunto de campos
+    alterados (em geral um ou dois). Retorna quantas.
+    """
+    with _trava:
+        lote, campos_do_lote, chaves_do_lote = dict(_pendentes), dict(_campos_pendentes), dict(_chaves_pendentes)
+        transicoes = list(_transicoes_pendentes)
+        _pendentes.clear()
+        _campos_pendentes.clear()
+        _chaves_pendentes.clear()
+        _transicoes_pendentes.clear()
+    _gravar_transicoes(transicoes)
+    AnalyticsManager.descarregar_agregados()
+    if not lote:
+        return 0
+
+    # Se outro processo já gravou uma versão mais nova no cache, vale a mais nova
+    atuais = cache.get_many([_chave(session_id) for session_id in lote])
+    for session_id, dados in lote.items():
+        atual = atuais.get(_chave(session_id))
+        if atual and atual['updated_at'] > dados['updated_at']:
+            lote[session_id] = atual
+
+    memorias = [_memoria(session_id, dados) for session_id, dados in lote.items()]
+    grupos = {}
+    for memoria in memorias:
+        grupos.setdefault(frozenset(campos_do_lote[memoria.session_id]), []).append(memoria)
+    try:
+        gravadas = 0
+        for campos, grupo in grupos.items():
+            if 'memory_data' in campos and connection.vendor == 'postgresql':
+                gravadas += _gravar_parcial(grupo, campos, chaves_do_lote)
+            else:
+                gravadas += ChatMemory.objects.bulk_update(
+                    grupo, [c for c in CAMPOS_QUENTES if c in campos], batch_size=TAMANHO_LOTE
+                )
+        if gravadas < len(memorias):
+            _recriar_apagadas(memorias)
+    except Exception as e:
+        logger.error(f"Erro ao gravar o estado das conversas no banco: {e}", exc_info=True)
+        with _trava:
+            for session_id, dados in lote.items():
+                _pendentes.setdefault(session_id, dados)
+                _campos_pendentes.setdefault(session_id, set()).update(campos_do_lote[session_id])
+                if session_id in chaves_do_lote:
+                    _acumular_chaves(session_id, chaves_do_lote[session_id])
+        return 0
+    prazos_inatividade.agendar([(memoria.session_id, memoria.state, memoria.updated_at) for memoria in memorias])
+    return len(memorias)
+
+
+def _laco_de_descarga():
+    while True:
+        _acordar.wait(INTERVALO_DESCARGA_SEGUNDOS)
+        _acordar.clear()
+        try:
+            descarregar()
+        finally:
+            # Thread própria: não segura conexão entre uma descarga e outra
+            connection.close()
+
+
+def iniciar_descarregador():
+    global _descarregador
+    if _descarregador is None:
+        with _trava:
+            if _descarregador is None:
+                _descarregador = threading.Thread(target=_laco_de_descarga, name='chatbot-descarga', daemon=True)
+                _descarregador.start()
+                # O que ainda estiver pendente quando o processo terminar
+                atexit.register(descarregar)
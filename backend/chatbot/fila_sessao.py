@@ -0,0 +1,96 @@
+# chatbot/fila_sessao.py
+"""
+Fila de entrada por sessão, com agrupamento (debounce) das mensagens em
+rajada.
+
+No WhatsApp é comum o paciente mandar "oi", "quero marcar", "cardiologia"
+em sequência, e cada mensagem chega ao orquestrador numa requisição
+própria. Aqui cada sessão tem uma fila e uma única tarefa que a esvazia:
+- a primeira mensagem abre um lote, que espera `janela` segundos sem
+  mensagem nova (no máximo ESPERA_MAXIMA_SEGUNDOS desde a primeira);
+- o lote inteiro vai numa chamada só a `processar(session_id, mensagens)`,
+  que devolve um resultado por mensagem;
+- lotes da mesma sessão são processados um de cada vez, na ordem de
+  chegada, e cada requisição recebe o resultado da sua mensagem.
+
+A fila é do processo (e do event loop): com vários workers, mensagens da
+mesma sessão que caem em processos diferentes não se agrupam, mas
+continuam serializadas pela trava da sessao_conversa.
+"""
+
+import asyncio
+import os
+
+JANELA_SEGUNDOS = float(os.environ.get('CHATBOT_JANELA_AGRUPAMENTO', 1.5))
+ESPERA_MAXIMA_SEGUNDOS = float(os.environ.get('CHATBOT_ESPERA_MAXIMA_AGRUPAMENTO', 5))
+
+
+class _Fila:
+    def __init__(self):
+        self.mensagens = []  # [(mensagem, janela, futuro)]
+        self.chegou = asyncio.Event()
+        self.tarefa = None
+
+
+_filas = {}  # (event loop, session_id) -> _Fila
+
+
+async def _esperar_rajada(fila, janela):
+    loop = asyncio.get_running_loop()
+    limite = loop.time() + ESPERA_MAXIMA_SEGUNDOS
+    while True:
+        fila.chegou.clear()
+        espera = min(janela, limite - loop.time())
+        if espera <= 0:
+            return
+        try:
+            await asyncio.wait_for(fila.chegou.wait(), espera)
+        except asyncio.TimeoutError:
+            return
+
+
+async def _esvaziar(chave, session_id, processar):
+    fila = _filas[chave]
+    lote = []
+    try:
+        while fila.mensagens:
+            await _esperar_rajada(fila, fila.mensagens[0][1])
+            lote, fila.mensagens = fila.mensagens, []
+            try:
+                resultados = await processar(session_id, [mensagem for mensagem, _, _ in lote])
+            except Exception as e:
+                for _, _, futuro in lote:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                continue
+            for (_, _, futuro), resultado in zip(lote, resultados):
+                if not futuro.done():
+                    futuro.set_result(resultado)
+    finally:
+        # Sem await entre o último "while" e aqui: nenhuma mensagem fica para trás
+        del _filas[chave]
+        # Tarefa cancelada (desligamento do processo): quem esperava o lote em
+        # andamento ou a fila não fica pendurado
+        for _, _, futuro in lote + fila.mensagens:
+            if not futuro.done():
+                futuro.cancel()
+
+
+async def enviar(session_id, mensagem, processar, janela=None):
+    """
+    Coloca a mensagem na fila da sessão e espera o resultado dela.
+    `janela` (padrão JANELA_SEGUNDOS; 0 = sem agrupar) vale para o lote que
+    esta mensagem abrir.
+    """
+    loop = asyncio.get_running_loop()
+    chave = (loop, session_id)
+    fila = _filas.get(chave)
+    if fila is None:
+        fila = _filas[chave] = _Fila()
+    futuro = loop.create_future()
+    fila.mensagens.append((mensagem, JANELA_SEGUNDOS if janela is None else janela, futuro))
+    fila.chegou.set()
+    if fila.tarefa is None:
+        fila.tarefa = loop.create_task(_esvaziar(chave, session_id, processar))
+    # shield: a requisição cancelada (cliente desconectou) não derruba o lote
+    return await asyncio.shield(futuro)
@@ -22,14 +22,16 @@ class HumanTransferManager:
         return any(palavra in mensagem_lower for palavra in cls.PALAVRAS_TRANSFERENCIA)
     
     @classmethod
-    def processar_transferencia(cls, session_id: str, memoria_atual: dict) -> dict:
+    def processar_transferencia(cls, session_id: str, memoria_atual: dict, sessao=None) -> dict:
         """Processa a transferência para atendimento humano"""
         nome_usuario = memoria_atual.get('nome_usuario', '')
         
         try:
-            memoria_obj = ChatMemory.objects.get(session_id=session_id)
-            memoria_obj.transferencia_solicitada = True # Atualizado para usar o campo do modelo
-            memoria_obj.save()
+            if sessao is not None:
+                # Vai no UPDATE único da unidade de trabalho da requisição
+                sessao.alterar(transferencia_solicitada=True)
+            else:
+                ChatMemory.objects.filter(session_id=session_id).update(transferencia_solicitada=True)
             
             # Registra métrica
             ChatbotMetrics.objects.create(
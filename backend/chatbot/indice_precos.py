@@ -0,0 +1,157 @@
+# chatbot/indice_precos.py
+"""
+Índice de busca dos serviços com preço (consultas por especialidade e
+procedimentos), para achar o serviço que a IA extraiu da pergunta.
+
+A busca é feita sobre os nomes normalizados (minúsculas, sem acentos), o
+que resolve "cardiologista" x "Cardiologia", "eco" x "Ecocardiograma",
+"consulta de pediatria" x "Pediatria" e erros de digitação, com:
+- formas exatas: o nome e as variantes do roteador local (cardiologista,
+  pediatra), depois de trocar os SINONIMOS da pergunta ("usg");
+- nome contido no texto ("consulta de cardiologia");
+- prefixos dos tokens ("eco", "ultra");
+- trigramas, para o que sobrar (digitação errada), entre os serviços com
+  alguma palavra que comece pela mesma letra da pergunta.
+
+O índice é montado uma vez por versão do catálogo (chatbot.catalogo), já
+com os preços formatados.
+"""
+
+from . import catalogo
+from .roteador_local import normalizar, variantes
+
+TAMANHO_MINIMO_PREFIXO = 3
+PONTUACAO_MINIMA = 0.4
+
+# Abreviações e nomes populares -> token normalizado do nome do serviço
+SINONIMOS = {
+    'eco': 'ecocardiograma',
+    'ecg': 'eletrocardiograma',
+    'cardio': 'cardiologia',
+    'gineco': 'ginecologia',
+    'orto': 'ortopedia',
+    'ultrassom': 'ultrassonografia',
+    'usg': 'ultrassonografia',
+    'preventivo': 'papanicolau',
+}
+
+# Palavras da pergunta que não ajudam a achar o serviço
+PALAVRAS_IGNORADAS = {
+    'consulta', 'consultas', 'exame', 'exames', 'procedimento', 'de', 'da', 'do', 'com', 'o', 'a',
+    'um', 'uma', 'para', 'pra', 'valor', 'preco', 'particular',
+}
+
+
+def _formatar_valor(valor):
+    return f"{valor:.2f}".replace('.', ',')
+
+
+def _trigramas(texto):
+    trigramas = set()
+    for token in texto.split():
+        com_bordas = f"  {token} "
+        trigramas.update(com_bordas[i:i + 3] for i in range(len(com_bordas) - 2))
+    return trigramas
+
+
+def _sem_palavras_ignoradas(texto):
+    tokens = [token for token in texto.split() if token not in PALAVRAS_IGNORADAS]
+    return ' '.join(tokens) if tokens else texto
+
+
+def _com_sinonimos(texto):
+    return ' '.join(SINONIMOS.get(token, token) for token in texto.split())
+
+
+class IndicePrecos:
+    """Serviços com preço ({'nome', 'valor', 'tipo'}) e as estruturas de busca sobre eles."""
+
+    def __init__(self, servicos):
+        self.servicos = servicos
+        self._exatos = {}  # forma normalizada -> índice do serviço
+        self._prefixos = {}  # prefixo de token -> {índices}
+        self._indice_trigramas = {}  # trigrama -> {índices}
+        self._formas = []  # índice -> [(forma, trigramas)]
+        for indice, servico in enumerate(servicos):
+            nome = normalizar(servico['nome'])
+            formas = variantes(nome) | {_sem_palavras_ignoradas(nome)}
+            formas.discard('')
+            self._formas.append([(forma, _trigramas(forma)) for forma in formas])
+            for forma, trigramas in self._formas[-1]:
+                self._exatos.setdefault(forma, indice)
+                for token in forma.split():
+                    for fim in range(TAMANHO_MINIMO_PREFIXO, len(token) + 1):
+                        self._prefixos.setdefault(token[:fim], set()).add(indice)
+                for trigrama in trigramas:
+                    self._indice_trigramas.setdefault(trigrama, set()).add(indice)
+        # Formas mais longas primeiro: "clinico geral" antes de "geral"
+        self._formas_por_tamanho = sorted(self._exatos, key=len, reverse=True)
+
+    def buscar(self, texto, limite=3):
+        """[(pontuação de 0 a 1, serviço)] em ordem decrescente de pontuação."""
+        consulta = _com_sinonimos(_sem_palavras_ignoradas(normalizar(texto or '')))
+        if not consulta:
+            return []
+
+        pontuacoes = {}
+        if consulta in self._exatos:
+            pontuacoes[self._exatos[consulta]] = 1.0
+        else:
+            # O nome de um serviço dentro do texto ("consulta de cardiologia")
+            texto_com_bordas = f" {consulta} "
+            for forma in self._formas_por_tamanho:
+                if f" {forma} " in texto_com_bordas:
+                    pontuacoes[self._exatos[forma]] = 0.95
+                    break
+
+        tokens = [token for token in consulta.split() if len(token) >= TAMANHO_MINIMO_PREFIXO]
+        if tokens:
+            # Todos os tokens da pergunta começam algum token do nome ("eco", "ultra abd")
+            comuns = set.intersection(*(self._prefixos.get(token, set()) for token in tokens))
+            for indice in comuns:
+                pontuacoes.setdefault(indice, 0.8)
+
+        trigramas_consulta = _trigramas(consulta)
+        candidatos = set()
+        for trigrama in trigramas_consulta:
+            candidatos.update(self._indice_trigramas.get(trigrama, ()))
+        # Erro de digitação quase nunca está na primeira letra; sem isso
+        # "neurologia" (que não atendemos) casaria com "urologia"
+        candidatos &= self._indice_trigramas.get(f"  {consulta[0]}", set())
+        for indice in candidatos:
+            similaridade = max(
+                len(trigramas_consulta & trigramas) / len(trigramas_consulta | trigramas)
+                for _, trigramas in self._formas[indice]
+            )
+            if similaridade > pontuacoes.get(indice, 0):
+                pontuacoes[indice] = similaridade
+
+        ordenados = sorted(
+            ((pontuacao, indice) for indice, pontuacao in pontuacoes.items() if pontuacao >= PONTUACAO_MINIMA),
+            key=lambda item: (-item[0], len(self.servicos[item[1]]['nome'])),
+        )
+        return [(round(pontuacao, 3), self.servicos[indice]) for pontuacao, indice in ordenados[:limite]]
+
+    def melhor(self, texto):
+        """O serviço mais provável, ou None se nenhum chegar a PONTUACAO_MINIMA."""
+        encontrados = self.buscar(texto, limite=1)
+        return encontrados[0][1] if encontrados else None
+
+
+def _montar(dados):
+    servicos = [
+        {"nome": esp['nome'], "valor": _formatar_valor(esp['valor_consulta']), "tipo": "Consulta"}
+        for esp in dados['especialidades'].values()
+        # Especialidade sem preço cadastrado não tem o que responder
+        if esp['valor_consulta'] is not None
+    ]
+    servicos += [
+        {"nome": proc['descricao'], "valor": _formatar_valor(proc['valor_particular']), "tipo": "Procedimento"}
+        for proc in dados['procedimentos'].values()
+    ]
+    return IndicePrecos(servicos)
+
+
+def indice():
+    """Índice da versão atual do catálogo."""
+    return catalogo.derivado('indice_precos', _montar)
@@ -1,103 +1,65 @@
 # chatbot/management/commands/check_inactivity.py
-import os
-import requests
 import logging
-from datetime import timedelta
+import time
+
 from django.core.management.base import BaseCommand
+from django.db import close_old_connections
 from django.utils import timezone
-from django.conf import settings
-from chatbot.models import ChatMemory
+
+from chatbot import envio_mensagens, prazos_inatividade
 
 logger = logging.getLogger(__name__)
 
+ESPERA_MAXIMA_SEGUNDOS = 5  # Sem Redis, é também o intervalo de releitura do banco
+
+
 class Command(BaseCommand):
     help = 'Verifica e gerencia sessões de chatbot inativas.'
 
-    # Define os tempos em minutos
-    TIMEOUT_WARNING_MINUTES = 15
-    TIMEOUT_RESET_MINUTES = 2 # Tempo para responder à mensagem de aviso
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--continuo',
+            action='store_true',
+            help='Fica rodando e trata cada sessão assim que o prazo dela vence (em vez de uma verificação por execução do cron).',
+        )
 
     def handle(self, *args, **options):
-        now = timezone.now()
-        self.stdout.write(f"[{now.strftime('%Y-%m-%d %H:%M:%S')}] Iniciando verificação de inatividade...")
-
-        self.reset_expired_sessions(now)
-        self.warn_inactive_sessions(now)
-
-        self.stdout.write(self.style.SUCCESS('Verificação de inatividade concluída.'))
-
-    def reset_expired_sessions(self, now):
-        """Reseta sessões que não responderam ao aviso de inatividade."""
-        reset_limit = now - timedelta(minutes=self.TIMEOUT_RESET_MINUTES)
-        
-        expired_sessions = ChatMemory.objects.filter(
-            state='awaiting_inactivity_response',
-            updated_at__lt=reset_limit
-        ).only('id', 'session_id', 'memory_data')
-
-        if not expired_sessions.exists():
-            self.stdout.write("Nenhuma sessão expirada para resetar.")
+        indice = prazos_inatividade.indice()
+        indice.carregar_do_banco(timezone.now())
+
+        if not options['continuo']:
+            now = timezone.now()
+            self.stdout.write(f"[{now.strftime('%Y-%m-%d %H:%M:%S')}] Iniciando verificação de inatividade...")
+            self.processar(now)
+            self.stdout.write(self.style.SUCCESS('Verificação de inatividade concluída.'))
             return
 
-        count = expired_sessions.count()
-        for session in expired_sessions:
-            session.state = 'inicio'
-            user_name = session.memory_data.get('nome_usuario')
-            session.memory_data = {'nome_usuario': user_name} if user_name else {}
-            session.previous_state = None
-            session.save()
-            
-            self.send_proactive_message(
-                session.session_id,
-                "Como não recebi uma resposta, estou encerrando nossa conversa por enquanto. Se precisar de algo, é só me chamar! 😉"
-            )
-
-        self.stdout.write(self.style.WARNING(f"{count} sessões expiradas foram resetadas."))
-
-    def warn_inactive_sessions(self, now):
-        """Envia aviso para sessões que atingiram o limite de inatividade."""
-        warning_start_limit = now - timedelta(minutes=self.TIMEOUT_WARNING_MINUTES + 1)
-        warning_end_limit = now - timedelta(minutes=self.TIMEOUT_WARNING_MINUTES)
-
-        inactive_sessions = ChatMemory.objects.exclude(
-            state__in=['inicio', 'awaiting_inactivity_response']
-        ).filter(
-            updated_at__gte=warning_start_limit,
-            updated_at__lt=warning_end_limit
-        ).only('id', 'session_id', 'state')
-
-        if not inactive_sessions.exists():
-            self.stdout.write("Nenhuma sessão inativa para avisar.")
+        self.stdout.write("Verificação contínua de inatividade iniciada.")
+        while True:
+            close_old_connections()
+            try:
+                indice.sincronizar(timezone.now())
+                self.processar(timezone.now())
+                # O mesmo worker cuida da fila de reenvio do gateway de saída
+                envio_mensagens.reenviar_pendentes()
+                # Se sobrarem vencidas (mais que MAX_POR_VOLTA), o próximo prazo já passou e não há espera
+                proximo = indice.proximo()
+            except Exception as e:
+                logger.error(f"Erro na verificação de inatividade: {e}", exc_info=True)
+                proximo = None
+            espera = ESPERA_MAXIMA_SEGUNDOS
+            if proximo is not None:
+                espera = min(espera, max((proximo - timezone.now()).total_seconds(), 0))
+            time.sleep(espera)
+
+    def processar(self, now):
+        """Trata as sessões vencidas até `now` e envia as mensagens."""
+        mensagens = prazos_inatividade.processar_vencidos(now)
+        if not mensagens:
             return
-            
-        count = inactive_sessions.count()
-        for session in inactive_sessions:
-            session.previous_state = session.state
-            session.state = 'awaiting_inactivity_response'
-            session.save()
-
-            self.send_proactive_message(
-                session.session_id,
-                "Olá! Notei que estamos parados há um tempo. Você ainda precisa de ajuda? 😊 (Responda 'sim' para continuar ou 'não' para encerrar)"
-            )
-        
-        self.stdout.write(self.style.SUCCESS(f"{count} sessões inativas foram notificadas."))
-
-    def send_proactive_message(self, session_id, message):
-        """Envia uma mensagem para o N8N, que a repassará para o usuário."""
-        webhook_url = getattr(settings, 'N8N_PROACTIVE_WEBHOOK_URL', None)
-        if not webhook_url:
-            self.stdout.write(self.style.ERROR("A variável N8N_PROACTIVE_WEBHOOK_URL não está configurada!"))
-            return
-
-        payload = {
-            "sessionId": session_id,
-            "message": message
-        }
-        
-        try:
-            response = requests.post(webhook_url, json=payload, timeout=10)
-            response.raise_for_status()
-            self.stdout.write(f"Mensagem de inatividade enviada para a sessão {session_id}.")
-        except requests.exceptions.RequestException as e:
-            self.stdout.write(self.style.ERROR(f"Falha ao enviar mensagem para a sessão {session_id}: {e}"))
+        avisos = sum(1 for _, mensagem in mensagens if mensagem == prazos_inatividade.MENSAGEM_AVISO)
+        enviadas = prazos_inatividade.enviar_mensagens(mensagens)
+        self.stdout.write(self.style.SUCCESS(
+            f"{avisos} sessões inativas foram notificadas, {len(mensagens) - avisos} sessões expiradas foram resetadas "
+            f"({enviadas}/{len(mensagens)} mensagens enviadas)."
+        ))
@@ -2,7 +2,7 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta
-from chatbot.models import ChatMemory
+from chatbot.models import ChatMemory, TransicaoEstado
 from chatbot.analytics import ChatbotMetrics
 from chatbot.recovery_manager import ConversationRecoveryManager
 
@@ -63,6 +63,16 @@ class Command(BaseCommand):
                 self.style.SUCCESS(f'Removidas {count_metricas} métricas antigas')
             )
         
+        # Transições de estado: mesma retenção das métricas
+        transicoes_antigas = TransicaoEstado.objects.filter(entrou_em__lt=limite_metricas)
+        if dry_run:
+            self.stdout.write(f'[DRY RUN] Removeria {transicoes_antigas.count()} transições de estado')
+        else:
+            count_transicoes, _ = transicoes_antigas.delete()
+            self.stdout.write(
+                self.style.SUCCESS(f'Removidas {count_transicoes} transições de estado antigas')
+            )
+        
         # Estatísticas finais
         if not dry_run:
             memorias_restantes = ChatMemory.objects.count()
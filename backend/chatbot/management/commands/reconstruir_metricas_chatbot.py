@@ -0,0 +1,15 @@
+# chatbot/management/commands/reconstruir_metricas_chatbot.py
+from django.core.management.base import BaseCommand
+
+from chatbot.analytics import AnalyticsManager
+
+
+class Command(BaseCommand):
+    help = (
+        'Refaz os agregados do dashboard do chatbot (métricas por hora e resumo por sessão) '
+        'a partir dos eventos em ChatbotMetrics. Rodar uma vez depois da migração.'
+    )
+
+    def handle(self, *args, **options):
+        horarias, sessoes = AnalyticsManager.reconstruir_agregados()
+        self.stdout.write(self.style.SUCCESS(f"{horarias} linhas por hora e {sessoes} sessões recalculadas."))
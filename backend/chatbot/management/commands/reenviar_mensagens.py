@@ -0,0 +1,18 @@
+# chatbot/management/commands/reenviar_mensagens.py
+from django.core.management.base import BaseCommand
+
+from chatbot import envio_mensagens
+
+
+class Command(BaseCommand):
+    help = 'Tenta de novo as mensagens de saída (WhatsApp/N8N) que falharam e estão na fila de reenvio.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limite', type=int, default=200, help='Máximo de mensagens por execução (padrão: 200)')
+
+    def handle(self, *args, **options):
+        resumo = envio_mensagens.reenviar_pendentes(limite=options['limite'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{resumo['enviados']} mensagens reenviadas, {resumo['na_fila']} continuam na fila, "
+            f"{resumo['incertos']} sem confirmação, {resumo['desistencias']} desistências."
+        ))
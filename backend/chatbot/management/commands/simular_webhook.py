@@ -0,0 +1,82 @@
+# chatbot/management/commands/simular_webhook.py
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class _Servidor(ThreadingHTTPServer):
+    request_queue_size = 128  # Aguenta o pool inteiro do gateway conectando de uma vez
+
+
+class Command(BaseCommand):
+    help = (
+        'Sobe um webhook local que faz o papel do N8N / API de WhatsApp, para testar o envio de mensagens '
+        '(aponte N8N_PROACTIVE_WEBHOOK_URL ou WHATSAPP_LEMBRETE_WEBHOOK para ele).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--porta', type=int, default=8089)
+        parser.add_argument('--latencia', type=float, default=0.05, help='Segundos de espera por requisição (padrão: 0.05)')
+        parser.add_argument('--falhas', type=float, default=0.0, help='Fração das requisições respondidas com 503 (0 a 1)')
+        parser.add_argument(
+            '--limite-taxa', type=float, default=0.0,
+            help='Requisições por segundo aceitas; acima disso responde 429 com Retry-After (0 = sem limite)'
+        )
+
+    def handle(self, *args, **options):
+        latencia, falhas = options['latencia'], options['falhas']
+        limite_taxa = options['limite_taxa']
+        contagem = {'recebidas': 0, 'aceitas': 0, 'segundo': 0, 'no_segundo': 0}
+        trava = threading.Lock()
+        stdout = self.stdout
+
+        class Webhook(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Mantém a conexão aberta, como um provedor real
+
+            def do_POST(self):
+                corpo = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                time.sleep(latencia)
+                with trava:
+                    contagem['recebidas'] += 1
+                    # Janela fixa de um segundo
+                    segundo = int(time.monotonic())
+                    if segundo != contagem['segundo']:
+                        contagem['segundo'], contagem['no_segundo'] = segundo, 0
+                    contagem['no_segundo'] += 1
+                    acima_do_limite = limite_taxa and contagem['no_segundo'] > limite_taxa
+                if acima_do_limite:
+                    return self._responder(429, {'erro': 'limite de taxa'}, {'Retry-After': '1'})
+                if random.random() < falhas:
+                    return self._responder(503, {'erro': 'indisponível'})
+                with trava:
+                    contagem['aceitas'] += 1
+                    aceitas = contagem['aceitas']
+                stdout.write(f"[{aceitas}] {corpo.decode('utf-8', 'replace')[:200]}")
+                self._responder(200, {'ok': True})
+
+            def _responder(self, status, dados, cabecalhos=None):
+                corpo = json.dumps(dados).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(corpo)))
+                for nome, valor in (cabecalhos or {}).items():
+                    self.send_header(nome, valor)
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def log_message(self, *args):
+                pass
+
+        servidor = _Servidor(('127.0.0.1', options['porta']), Webhook)
+        self.stdout.write(self.style.SUCCESS(f"Webhook de teste em http://127.0.0.1:{options['porta']}/ (Ctrl+C para parar)"))
+        try:
+            servidor.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            servidor.server_close()
+            self.stdout.write(f"{contagem['recebidas']} requisições recebidas, {contagem['aceitas']} aceitas.")
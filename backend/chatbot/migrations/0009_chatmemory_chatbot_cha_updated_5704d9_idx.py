@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0008_rename_chatbot_chatmemory_transfer_idx_chatbot_cha_transfe_fec5b0_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmemory',
+            index=models.Index(fields=['updated_at'], name='chatbot_cha_updated_5704d9_idx'),
+        ),
+    ]
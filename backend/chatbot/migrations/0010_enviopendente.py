@@ -0,0 +1,30 @@
+# Generated by Django 5.0.7 on 2026-10-18 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0009_chatmemory_chatbot_cha_updated_5704d9_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnvioPendente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=500)),
+                ('payload', models.JSONField()),
+                ('tentativas', models.PositiveSmallIntegerField(default=0)),
+                ('proxima_tentativa', models.DateTimeField()),
+                ('ultimo_erro', models.TextField(blank=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Envio Pendente',
+                'verbose_name_plural': 'Envios Pendentes',
+                'indexes': [models.Index(fields=['proxima_tentativa'], name='chatbot_env_proxima_8d5568_idx')],
+            },
+        ),
+    ]
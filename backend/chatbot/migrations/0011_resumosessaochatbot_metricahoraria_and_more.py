@@ -0,0 +1,52 @@
+# Generated by Django 5.0.7 on 2026-10-18 12:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0010_enviopendente'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoSessaoChatbot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(max_length=50, unique=True)),
+                ('primeiro_evento', models.DateTimeField()),
+                ('ultimo_evento', models.DateTimeField()),
+                ('total_eventos', models.PositiveIntegerField(default=0)),
+                ('resultado', models.CharField(blank=True, max_length=100, null=True)),
+            ],
+            options={
+                'verbose_name': 'Resumo de Sessão do Chatbot',
+                'verbose_name_plural': 'Resumos de Sessões do Chatbot',
+            },
+        ),
+        migrations.CreateModel(
+            name='MetricaHoraria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_hora', models.DateTimeField()),
+                ('evento', models.CharField(max_length=100)),
+                ('dimensao', models.CharField(blank=True, default='', max_length=255)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('soma_duracao_ms', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Métrica Horária do Chatbot',
+                'verbose_name_plural': 'Métricas Horárias do Chatbot',
+                'indexes': [models.Index(fields=['evento', 'bucket_hora'], name='chatbot_met_evento_1dd152_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='metricahoraria',
+            constraint=models.UniqueConstraint(fields=('bucket_hora', 'evento', 'dimensao'), name='metrica_horaria_unica'),
+        ),
+        migrations.AddIndex(
+            model_name='resumosessaochatbot',
+            index=models.Index(fields=['ultimo_evento'], name='chatbot_res_ultimo__784647_idx'),
+        ),
+    ]
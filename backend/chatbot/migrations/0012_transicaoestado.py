@@ -0,0 +1,29 @@
+# Generated by Django 5.0.7 on 2026-10-18 12:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0011_resumosessaochatbot_metricahoraria_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransicaoEstado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(max_length=50)),
+                ('estado_anterior', models.CharField(blank=True, max_length=100, null=True)),
+                ('estado_novo', models.CharField(blank=True, max_length=100, null=True)),
+                ('entrou_em', models.DateTimeField()),
+                ('duracao_ms', models.BigIntegerField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Transição de Estado',
+                'verbose_name_plural': 'Transições de Estado',
+                'indexes': [models.Index(fields=['session_id', 'entrou_em'], name='chatbot_tra_session_68c9ab_idx'), models.Index(fields=['entrou_em', 'estado_anterior'], name='chatbot_tra_entrou__c78c06_idx'), models.Index(fields=['entrou_em', 'estado_novo'], name='chatbot_tra_entrou__4b4294_idx')],
+            },
+        ),
+    ]
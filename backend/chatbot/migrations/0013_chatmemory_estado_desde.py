@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0012_transicaoestado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmemory',
+            name='estado_desde',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
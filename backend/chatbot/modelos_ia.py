@@ -0,0 +1,189 @@
+# chatbot/modelos_ia.py
+"""
+Roteamento de modelos das chains de IA: nível, orçamento de latência,
+fallback e disjuntor (circuit breaker).
+
+Cada chain tem uma PoliticaChain: o nível de modelo que usa ('rapido' ou
+'completo'), quantos segundos pode esperar por ele e o que fazer quando o
+orçamento acaba: tentar outro nível (com orçamento próprio) e, se nada
+responder, devolver uma resposta pronta ou levantar IAIndisponivel. Assim o
+pior caso de uma chamada é a soma dos orçamentos, por mais lento que o Gemini
+esteja.
+
+Cada nível tem um DisjuntorDeCircuito: depois de LIMITE_FALHAS falhas
+seguidas o nível fica "aberto" por TEMPO_ABERTO_SEGUNDOS e as chamadas vão
+direto para o fallback, sem esperar o timeout de novo.
+"""
+
+import asyncio
+import copy
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+NIVEIS_MODELO = {
+    'rapido': os.environ.get('CHATBOT_MODELO_RAPIDO', 'gemini-2.5-flash'),
+    'completo': os.environ.get('CHATBOT_MODELO_COMPLETO', 'gemini-2.5-pro'),
+}
+
+LIMITE_FALHAS = 5
+TEMPO_ABERTO_SEGUNDOS = 30
+# Threads para o invoke() síncrono com timeout (a chamada que estoura o
+# orçamento termina sozinha em segundo plano; o disjuntor evita acumular)
+MAX_CHAMADAS_SINCRONAS = 16
+
+
+class PoliticaChain(NamedTuple):
+    nivel: str
+    orcamento_segundos: float
+    fallback: Optional[str] = None
+    orcamento_fallback_segundos: float = 0
+    resposta_padrao: Optional[dict] = None
+
+
+POLITICAS_PADRAO = {
+    # Classificar intenção não precisa do modelo mais caro; sem resposta, o
+    # bot_logic já devolve "não consegui processar sua mensagem"
+    'chain_roteadora': PoliticaChain('rapido', 5),
+    'chain_sintomas': PoliticaChain('completo', 10, 'rapido', 5, {'especialidade_sugerida': 'Clínico Geral'}),
+    # Sem resposta pronta: um "não sei" inventado iria para o cache do FAQ
+    'chain_faq': PoliticaChain('completo', 10, 'rapido', 5),
+}
+
+
+def politica(nome_chain):
+    """Política da chain, com os ajustes de settings.CHATBOT_POLITICAS_IA (dicts parciais)."""
+    base = POLITICAS_PADRAO[nome_chain]
+    ajustes = getattr(settings, 'CHATBOT_POLITICAS_IA', {}).get(nome_chain, {})
+    return base._replace(**ajustes)
+
+
+class IAIndisponivel(Exception):
+    """Nenhum nível respondeu dentro do orçamento e a chain não tem resposta pronta."""
+
+
+class DisjuntorDeCircuito:
+    """
+    Fechado: tudo passa. Aberto (após `limite_falhas` falhas seguidas): nada
+    passa por `tempo_aberto` segundos. Depois disso deixa passar UMA chamada
+    de teste (meio-aberto): sucesso fecha, falha abre de novo.
+    """
+
+    def __init__(self, limite_falhas=LIMITE_FALHAS, tempo_aberto=TEMPO_ABERTO_SEGUNDOS):
+        self.limite_falhas = limite_falhas
+        self.tempo_aberto = tempo_aberto
+        self.falhas = 0
+        self.aberto_ate = None
+        self._testando = False
+        self._trava = threading.Lock()
+
+    @property
+    def estado(self):
+        if self.aberto_ate is None:
+            return 'fechado'
+        return 'aberto' if time.monotonic() < self.aberto_ate else 'meio_aberto'
+
+    def permite(self):
+        with self._trava:
+            if self.aberto_ate is None:
+                return True
+            if time.monotonic() < self.aberto_ate or self._testando:
+                return False
+            self._testando = True
+            return True
+
+    def registrar_sucesso(self):
+        with self._trava:
+            self.falhas = 0
+            self.aberto_ate = None
+            self._testando = False
+
+    def registrar_falha(self):
+        with self._trava:
+            self.falhas += 1
+            if self._testando or self.falhas >= self.limite_falhas:
+                if self.aberto_ate is None or self._testando:
+                    logger.warning(f"Disjuntor da IA aberto por {self.tempo_aberto}s após {self.falhas} falha(s).")
+                self.aberto_ate = time.monotonic() + self.tempo_aberto
+            self._testando = False
+
+
+_disjuntores = {nivel: DisjuntorDeCircuito() for nivel in NIVEIS_MODELO}
+_executor = ThreadPoolExecutor(max_workers=MAX_CHAMADAS_SINCRONAS, thread_name_prefix='chatbot-ia')
+
+
+def disjuntor(nivel):
+    return _disjuntores.setdefault(nivel, DisjuntorDeCircuito())
+
+
+class CadeiaRoteada:
+    """
+    Fachada com invoke()/ainvoke() sobre uma chain montada por nível
+    ({nivel: Runnable}), aplicando a PoliticaChain.
+    """
+
+    def __init__(self, nome, cadeias_por_nivel, politica_chain):
+        self.nome = nome
+        self.cadeias_por_nivel = cadeias_por_nivel
+        self.politica = politica_chain
+
+    def _tentativas(self):
+        tentativas = [(self.politica.nivel, self.politica.orcamento_segundos)]
+        if self.politica.fallback:
+            tentativas.append((self.politica.fallback, self.politica.orcamento_fallback_segundos))
+        return [(nivel, orcamento) for nivel, orcamento in tentativas if nivel in self.cadeias_por_nivel]
+
+    def _sem_resposta(self, ultimo_erro):
+        if self.politica.resposta_padrao is not None:
+            logger.warning(f"[{self.nome}] Nenhum modelo respondeu a tempo; usando a resposta padrão.")
+            return copy.deepcopy(self.politica.resposta_padrao)
+        motivo = repr(ultimo_erro) if ultimo_erro else 'disjuntor aberto'
+        raise IAIndisponivel(f"{self.nome}: nenhum modelo respondeu a tempo ({motivo}).")
+
+    def _falhou(self, nivel, orcamento, erro):
+        disjuntor(nivel).registrar_falha()
+        if isinstance(erro, (asyncio.TimeoutError, FuturesTimeoutError)):
+            logger.warning(f"[{self.nome}] Nível '{nivel}' estourou o orçamento de {orcamento}s.")
+        else:
+            logger.warning(f"[{self.nome}] Nível '{nivel}' falhou: {erro}")
+
+    def invoke(self, entrada, *args, **kwargs):
+        ultimo_erro = None
+        for nivel, orcamento in self._tentativas():
+            if not disjuntor(nivel).permite():
+                continue
+            futuro = _executor.submit(self.cadeias_por_nivel[nivel].invoke, entrada, *args, **kwargs)
+            try:
+                resposta = futuro.result(timeout=orcamento)
+            except Exception as e:
+                futuro.cancel()
+                self._falhou(nivel, orcamento, e)
+                ultimo_erro = e
+                continue
+            disjuntor(nivel).registrar_sucesso()
+            return resposta
+        return self._sem_resposta(ultimo_erro)
+
+    async def ainvoke(self, entrada, *args, **kwargs):
+        ultimo_erro = None
+        for nivel, orcamento in self._tentativas():
+            if not disjuntor(nivel).permite():
+                continue
+            try:
+                resposta = await asyncio.wait_for(
+                    self.cadeias_por_nivel[nivel].ainvoke(entrada, *args, **kwargs), timeout=orcamento
+                )
+            except Exception as e:
+                self._falhou(nivel, orcamento, e)
+                ultimo_erro = e
+                continue
+            disjuntor(nivel).registrar_sucesso()
+            return resposta
+        return self._sem_resposta(ultimo_erro)
@@ -1,15 +1,19 @@
 # chatbot/models.py
 from django.db import models
 from django.core.exceptions import ValidationError
-import json
+import orjson
 
 def validate_json_data(value):
     """Valida se os dados JSON são válidos"""
     if not isinstance(value, dict):
         raise ValidationError('Dados devem ser um dicionário válido')
 
-    # Limita o tamanho dos dados
-    if len(json.dumps(value)) > 10000:
+    # Limita o tamanho dos dados (orjson: mede sem o custo do json.dumps)
+    try:
+        tamanho = len(orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS))
+    except TypeError:
+        raise ValidationError('Dados devem ser serializáveis em JSON')
+    if tamanho > 10000:
         raise ValidationError('Dados JSON muito grandes')
 
 class ChatMemory(models.Model):
@@ -22,6 +26,8 @@ class ChatMemory(models.Model):
     conversa_encerrada = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Entrada no estado atual (duração de cada estado no TransicaoEstado); nula = desconhecida
+    estado_desde = models.DateTimeField(null=True, blank=True)
 
     def clean(self):
         # Sanitiza o session_id
@@ -39,6 +45,7 @@ class ChatMemory(models.Model):
         indexes = [
             models.Index(fields=['transferencia_solicitada', 'updated_at']),
             models.Index(fields=['conversa_encerrada', 'updated_at']),
+            models.Index(fields=['updated_at']),  # Releitura dos prazos de inatividade
         ]
 
 class ChatbotMetrics(models.Model):
@@ -63,4 +70,95 @@ class ChatbotMetrics(models.Model):
         ]
 
     def __str__(self):
-        return f"{self.evento} - {self.session_id} - {self.timestamp.strftime('%d/%m/%Y %H:%M')}"
\ No newline at end of file
+        return f"{self.evento} - {self.session_id} - {self.timestamp.strftime('%d/%m/%Y %H:%M')}"
+
+class EnvioPendente(models.Model):
+    """
+    Mensagem de saída (WhatsApp/N8N) que falhou depois das tentativas
+    imediatas. O gateway (chatbot.envio_mensagens) tenta de novo com espera
+    crescente até MAX_TENTATIVAS.
+    """
+    url = models.URLField(max_length=500)
+    payload = models.JSONField()
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    proxima_tentativa = models.DateTimeField()
+    ultimo_erro = models.TextField(blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Envio Pendente"
+        verbose_name_plural = "Envios Pendentes"
+        indexes = [
+            models.Index(fields=['proxima_tentativa']),
+        ]
+
+    def __str__(self):
+        return f"Envio para {self.url} ({self.tentativas} tentativas)"
+
+class MetricaHoraria(models.Model):
+    """
+    Contagem dos eventos do ChatbotMetrics por hora, evento e dimensão (o
+    estado do abandono, a especialidade, a origem do roteamento...),
+    atualizada a cada evento gravado (chatbot.analytics). O dashboard lê
+    daqui em vez de agregar os eventos brutos.
+    """
+    bucket_hora = models.DateTimeField()
+    evento = models.CharField(max_length=100)
+    dimensao = models.CharField(max_length=255, blank=True, default='')
+    total = models.PositiveIntegerField(default=0)
+    soma_duracao_ms = models.FloatField(default=0)  # Para médias de latência (roteamento_intencao)
+
+    class Meta:
+        verbose_name = "Métrica Horária do Chatbot"
+        verbose_name_plural = "Métricas Horárias do Chatbot"
+        constraints = [
+            models.UniqueConstraint(fields=['bucket_hora', 'evento', 'dimensao'], name='metrica_horaria_unica'),
+        ]
+        indexes = [
+            models.Index(fields=['evento', 'bucket_hora']),
+        ]
+
+    def __str__(self):
+        return f"{self.evento} [{self.dimensao}] - {self.bucket_hora.strftime('%d/%m/%Y %H:00')}: {self.total}"
+
+class ResumoSessaoChatbot(models.Model):
+    """Primeiro e último evento de cada sessão e o último desfecho registrado."""
+    session_id = models.CharField(max_length=50, unique=True)
+    primeiro_evento = models.DateTimeField()
+    ultimo_evento = models.DateTimeField()
+    total_eventos = models.PositiveIntegerField(default=0)
+    resultado = models.CharField(max_length=100, null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Resumo de Sessão do Chatbot"
+        verbose_name_plural = "Resumos de Sessões do Chatbot"
+        indexes = [
+            models.Index(fields=['ultimo_evento']),
+        ]
+
+    def __str__(self):
+        return f"{self.session_id}: {self.total_eventos} eventos ({self.resultado or 'sem desfecho'})"
+
+class TransicaoEstado(models.Model):
+    """
+    Uma linha por mudança de estado da conversa (só inserção). duracao_ms é
+    o tempo que a sessão passou em estado_anterior, calculado na gravação;
+    fica nulo quando a entrada nele não é conhecida.
+    """
+    session_id = models.CharField(max_length=50)
+    estado_anterior = models.CharField(max_length=100, null=True, blank=True)
+    estado_novo = models.CharField(max_length=100, null=True, blank=True)
+    entrou_em = models.DateTimeField()
+    duracao_ms = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Transição de Estado"
+        verbose_name_plural = "Transições de Estado"
+        indexes = [
+            models.Index(fields=['session_id', 'entrou_em']),
+            models.Index(fields=['entrou_em', 'estado_anterior']),
+            models.Index(fields=['entrou_em', 'estado_novo']),
+        ]
+
+    def __str__(self):
+        return f"{self.session_id}: {self.estado_anterior} -> {self.estado_novo} ({self.entrou_em.strftime('%d/%m/%Y %H:%M')})"
@@ -0,0 +1,304 @@
+# chatbot/prazos_inatividade.py
+"""
+Prazos de inatividade das conversas em um índice ordenado, no lugar da
+varredura do ChatMemory por faixa de updated_at.
+
+Cada conversa em andamento tem um prazo:
+- aviso: última atividade + MINUTOS_AVISO ("ainda precisa de ajuda?");
+- encerramento: aviso enviado (estado awaiting_inactivity_response) +
+  MINUTOS_ENCERRAMENTO sem resposta: a conversa volta para 'inicio'.
+Conversas em 'inicio' não têm prazo.
+
+O índice:
+- com REDIS_URL, um ZSET no Redis (membro: session_id; score: o prazo em
+  epoch), atualizado pela descarga do estado quente (estado_sessao) em um
+  pipeline por lote, ou seja, a cada mensagem, com poucos segundos de atraso;
+- sem Redis, um heap local no worker, alimentado pelo banco: a cada volta,
+  só as linhas com updated_at depois da última leitura (índice em
+  updated_at).
+
+O worker (check_inactivity --continuo) tira do índice só as sessões
+vencidas e confere o prazo com o estado atual (a conversa pode ter andado).
+Ele muda o estado de cada grupo (avisar / encerrar) com um UPDATE só e
+envia as mensagens em paralelo pelo gateway de saída (envio_mensagens).
+Cada volta custa proporcional às sessões que vencem, não ao tamanho da
+tabela.
+"""
+
+import heapq
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, JSONField, Q, Value, When
+from django.utils import timezone
+
+from . import envio_mensagens, estado_sessao
+from .models import ChatMemory
+
+logger = logging.getLogger(__name__)
+
+MINUTOS_AVISO = 15
+MINUTOS_ENCERRAMENTO = 2  # Tempo para responder à mensagem de aviso
+# Vencido há mais que isso (worker parado), a conversa não recebe um aviso atrasado
+ATRASO_MAXIMO_AVISO = timedelta(minutes=10)
+ESTADO_AGUARDANDO = 'awaiting_inactivity_response'
+ESTADOS_SEM_PRAZO = {'inicio'}
+
+CHAVE_REDIS = 'chatbot:prazos_inatividade'
+MAX_POR_VOLTA = 500
+# Heap local: releitura para trás, cobre o atraso da descarga do estado quente
+FOLGA_SINCRONIZACAO = timedelta(seconds=30)
+
+MENSAGEM_AVISO = "Olá! Notei que estamos parados há um tempo. Você ainda precisa de ajuda? 😊 (Responda 'sim' para continuar ou 'não' para encerrar)"
+MENSAGEM_ENCERRAMENTO = "Como não recebi uma resposta, estou encerrando nossa conversa por enquanto. Se precisar de algo, é só me chamar! 😉"
+
+# Tira do ZSET, de forma atômica, até ARGV[2] sessões com prazo até ARGV[1];
+# devolve [id, prazo, id, prazo...]
+_SCRIPT_VENCIDOS = """
+local itens = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, ARGV[2])
+local ids = {}
+for i = 1, #itens, 2 do ids[#ids + 1] = itens[i] end
+if #ids > 0 then redis.call('ZREM', KEYS[1], unpack(ids)) end
+return itens
+"""
+
+
+def prazo(state, updated_at):
+    """Quando a conversa nesse estado vence (datetime), ou None se não vence."""
+    if state in ESTADOS_SEM_PRAZO or updated_at is None:
+        return None
+    minutos = MINUTOS_ENCERRAMENTO if state == ESTADO_AGUARDANDO else MINUTOS_AVISO
+    return updated_at + timedelta(minutes=minutos)
+
+
+def _linhas_com_prazo(agora):
+    """Conversas que ainda podem vencer: em andamento recentes e as que esperam resposta ao aviso."""
+    recentes = agora - timedelta(minutes=MINUTOS_AVISO) - ATRASO_MAXIMO_AVISO
+    return ChatMemory.objects.exclude(state__in=ESTADOS_SEM_PRAZO).filter(
+        Q(updated_at__gte=recentes) | Q(state=ESTADO_AGUARDANDO)
+    )
+
+
+class IndiceRedis:
+    """ZSET compartilhado: os processos web agendam, o worker retira."""
+
+    def __init__(self, url):
+        import redis
+
+        self.erro_redis = redis.RedisError
+        self.cliente = redis.Redis.from_url(url)
+        self._vencidos = self.cliente.register_script(_SCRIPT_VENCIDOS)
+
+    def agendar(self, itens):
+        pipeline = self.cliente.pipeline(transaction=False)
+        for session_id, prazo_sessao in itens:
+            if prazo_sessao is None:
+                pipeline.zrem(CHAVE_REDIS, session_id)
+            else:
+                pipeline.zadd(CHAVE_REDIS, {session_id: prazo_sessao.timestamp()})
+        pipeline.execute()
+
+    def carregar_do_banco(self, agora):
+        # Só na primeira vez (ou depois de o Redis perder os dados)
+        if not self.cliente.exists(CHAVE_REDIS):
+            linhas = _linhas_com_prazo(agora).values_list('session_id', 'state', 'updated_at')
+            self.agendar([(session_id, prazo(state, updated_at)) for session_id, state, updated_at in linhas.iterator()])
+
+    def sincronizar(self, agora):
+        """Os processos web já agendam na descarga."""
+
+    def vencidos(self, agora, limite):
+        itens = self._vencidos(keys=[CHAVE_REDIS], args=[agora.timestamp(), limite])
+        return [
+            (session_id.decode(), datetime.fromtimestamp(float(score), tz=dt_timezone.utc))
+            for session_id, score in zip(itens[::2], itens[1::2])
+        ]
+
+    def proximo(self):
+        primeiro = self.cliente.zrange(CHAVE_REDIS, 0, 0, withscores=True)
+        return datetime.fromtimestamp(primeiro[0][1], tz=dt_timezone.utc) if primeiro else None
+
+
+class IndiceLocal:
+    """Heap do próprio worker, alimentado pelas linhas alteradas no banco."""
+
+    def __init__(self):
+        self._heap = []  # (prazo, session_id); entradas antigas são descartadas ao sair
+        self._prazos = {}  # session_id -> prazo vigente
+        self._lido_ate = None
+
+    def agendar(self, itens):
+        for session_id, prazo_sessao in itens:
+            if prazo_sessao is None:
+                self._prazos.pop(session_id, None)
+            elif self._prazos.get(session_id) != prazo_sessao:
+                self._prazos[session_id] = prazo_sessao
+                heapq.heappush(self._heap, (prazo_sessao, session_id))
+
+    def carregar_do_banco(self, agora):
+        self.sincronizar(agora)
+
+    def sincronizar(self, agora):
+        if self._lido_ate is None:
+            linhas = _linhas_com_prazo(agora)
+        else:
+            linhas = ChatMemory.objects.filter(updated_at__gt=self._lido_ate - FOLGA_SINCRONIZACAO)
+        for session_id, state, updated_at in linhas.values_list('session_id', 'state', 'updated_at').iterator():
+            self.agendar([(session_id, prazo(state, updated_at))])
+            self._lido_ate = max(self._lido_ate or updated_at, updated_at)
+        self._lido_ate = self._lido_ate or agora
+
+    def vencidos(self, agora, limite):
+        vencidos = []
+        while self._heap and self._heap[0][0] <= agora and len(vencidos) < limite:
+            prazo_sessao, session_id = heapq.heappop(self._heap)
+            if self._prazos.get(session_id) == prazo_sessao:
+                del self._prazos[session_id]
+                vencidos.append((session_id, prazo_sessao))
+        return vencidos
+
+    def proximo(self):
+        while self._heap and self._prazos.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+
+_indice = None
+
+
+def indice():
+    global _indice
+    if _indice is None:
+        redis_url = getattr(settings, 'REDIS_URL', None)
+        _indice = IndiceRedis(redis_url) if redis_url else IndiceLocal()
+    return _indice
+
+
+def agendar(itens):
+    """
+    [(session_id, state, updated_at)] gravados pelo bot: novo prazo de cada
+    sessão. Sem Redis não faz nada (o worker lê os prazos do banco).
+    """
+    if not getattr(settings, 'REDIS_URL', None) or not itens:
+        return
+    try:
+        indice().agendar([(session_id, prazo(state, updated_at)) for session_id, state, updated_at in itens])
+    except Exception as e:
+        # O worker confere o estado antes de agir; um prazo perdido só atrasa o aviso
+        logger.error(f"Erro ao agendar prazos de inatividade: {e}")
+
+
+def _estado_atual(session_ids):
+    """{session_id: (state, updated_at, memory_data, estado_desde)}: estado quente se houver, senão o banco."""
+    atuais = {}
+    quentes = estado_sessao.obter_varios(session_ids)
+    for session_id, dados in quentes.items():
+        atuais[session_id] = (dados['state'], dados['updated_at'], dados['memory_data'], dados.get('estado_desde'))
+    faltam = [session_id for session_id in session_ids if session_id not in atuais]
+    if faltam:
+        linhas = ChatMemory.objects.filter(session_id__in=faltam).values_list(
+            'session_id', 'state', 'updated_at', 'memory_data', 'estado_desde'
+        )
+        for session_id, *atual in linhas:
+            atuais[session_id] = tuple(atual)
+    return atuais
+
+
+def _memoria_apos_encerramento(memory_data):
+    nome_usuario = memory_data.get('nome_usuario') if isinstance(memory_data, dict) else None
+    return {'nome_usuario': nome_usuario} if nome_usuario else {}
+
+
+def processar_vencidos(agora=None):
+    """
+    Avisa e encerra as conversas vencidas. Retorna [(session_id, mensagem)]
+    a enviar; quem chamou envia (enviar_mensagens). Se algo falhar no
+    caminho, as sessões voltam ao índice com os prazos que tinham e a
+    próxima volta tenta de novo.
+    """
+    agora = agora or timezone.now()
+    vencidos = indice().vencidos(agora, MAX_POR_VOLTA)
+    if not vencidos:
+        return []
+    try:
+        return _tratar_vencidos([session_id for session_id, _ in vencidos], agora)
+    except Exception:
+        indice().agendar(vencidos)
+        raise
+
+
+def _tratar_vencidos(session_ids, agora):
+    avisar, encerrar, desde, reagendar = {}, {}, {}, []
+    for session_id, (state, updated_at, memory_data, estado_desde) in _estado_atual(session_ids).items():
+        prazo_sessao = prazo(state, updated_at)
+        if prazo_sessao is None:
+            continue
+        if prazo_sessao > agora:
+            # Houve atividade depois de o prazo entrar no índice
+            reagendar.append((session_id, prazo_sessao))
+        elif state == ESTADO_AGUARDANDO:
+            encerrar[session_id] = _memoria_apos_encerramento(memory_data)
+            desde[session_id] = estado_desde or updated_at
+        elif agora - prazo_sessao <= ATRASO_MAXIMO_AVISO:
+            avisar[session_id] = state
+            desde[session_id] = estado_desde
+
+    # Banco e estado quente juntos: se o estado quente falhar, o UPDATE volta atrás
+    with transaction.atomic():
+        _gravar_vencidos(avisar, encerrar, desde, agora)
+    indice().agendar(reagendar + [(session_id, prazo(ESTADO_AGUARDANDO, agora)) for session_id in avisar])
+
+    return [(session_id, MENSAGEM_AVISO) for session_id in avisar] + [
+        (session_id, MENSAGEM_ENCERRAMENTO) for session_id in encerrar
+    ]
+
+
+def _gravar_vencidos(avisar, encerrar, desde, agora):
+    if avisar:
+        ChatMemory.objects.filter(session_id__in=avisar).exclude(state__in=[*ESTADOS_SEM_PRAZO, ESTADO_AGUARDANDO]).update(
+            previous_state=F('state'), state=ESTADO_AGUARDANDO, updated_at=agora, estado_desde=agora
+        )
+    if encerrar:
+        ChatMemory.objects.filter(session_id__in=encerrar, state=ESTADO_AGUARDANDO).update(
+            state='inicio',
+            previous_state=None,
+            memory_data=Case(
+                *(When(session_id=session_id, then=Value(memoria, output_field=JSONField()))
+                  for session_id, memoria in encerrar.items()),
+                output_field=JSONField(),
+            ),
+            updated_at=agora,
+            estado_desde=agora,
+        )
+
+    alteracoes = {
+        session_id: {'previous_state': state, 'state': ESTADO_AGUARDANDO, 'updated_at': agora}
+        for session_id, state in avisar.items()
+    }
+    alteracoes.update({
+        session_id: {'state': 'inicio', 'previous_state': None, 'memory_data': memoria, 'updated_at': agora}
+        for session_id, memoria in encerrar.items()
+    })
+    anteriores = {session_id: (state, desde[session_id]) for session_id, state in avisar.items()}
+    anteriores.update({session_id: (ESTADO_AGUARDANDO, desde[session_id]) for session_id in encerrar})
+    estado_sessao.aplicar_no_estado_quente(alteracoes, anteriores)
+
+
+def enviar_mensagens(mensagens):
+    """
+    Envia ao N8N, pelo gateway de saída, as mensagens [(session_id, mensagem)].
+    Retorna quantas foram aceitas (as que falharam por instabilidade ficam na
+    fila de reenvio).
+    """
+    webhook_url = getattr(settings, 'N8N_PROACTIVE_WEBHOOK_URL', None)
+    if not mensagens:
+        return 0
+    if not webhook_url:
+        logger.error("A variável N8N_PROACTIVE_WEBHOOK_URL não está configurada!")
+        return 0
+    status = envio_mensagens.enviar_lote(
+        [(webhook_url, {"sessionId": session_id, "message": mensagem}) for session_id, mensagem in mensagens]
+    )
+    return status.count(envio_mensagens.ENVIADO)
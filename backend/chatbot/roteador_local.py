@@ -0,0 +1,210 @@
+# chatbot/roteador_local.py
+"""
+Roteador de intenções local, na frente da chain_roteadora.
+
+As regras do prompt da IA Roteadora são, na prática, palavras-chave
+("preço/valor/quanto custa" -> buscar_preco, "agendar/marcar" ->
+iniciar_agendamento...). Aqui elas viram uma trie de tokens compilada uma
+única vez: a mensagem é normalizada (minúsculas, sem acentos, sem
+pontuação) e percorrida em uma passada. Se exatamente uma intenção casar,
+sem negação e com a entidade necessária, respondemos em microssegundos;
+qualquer ambiguidade cai na IA, como antes.
+
+As entidades (especialidades e procedimentos) vêm do catálogo
+(chatbot/catalogo.py), compiladas em outra trie que só é refeita quando a
+versão do catálogo muda.
+"""
+
+import logging
+import re
+import unicodedata
+from typing import NamedTuple, Optional
+
+from . import catalogo
+
+logger = logging.getLogger(__name__)
+
+EVENTO_METRICA = 'roteamento_intencao'
+
+# Mesmas regras do prompt_roteador (chains.py), já normalizadas. Só frases sem
+# duplo sentido: "pessoa" ("marcar para outra pessoa"), "sinto" ("sinto
+# muito") ou "estou com" ("estou com uma dúvida") sozinhos ficam para a IA.
+PALAVRAS_CHAVE = {
+    'transferencia_humano': [
+        'atendente', 'humano', 'falar com uma pessoa', 'falar com alguem', 'operador', 'recepcionista',
+    ],
+    'encerrar_conversa': [
+        'tchau', 'obrigado', 'obrigada', 'valeu', 'ate logo', 'ate mais',
+    ],
+    'buscar_preco': [
+        'preco', 'precos', 'valor', 'valores', 'quanto custa', 'quanto custam', 'quanto fica',
+        'quanto sai', 'quanto e', 'quanto eh', 'custo',
+    ],
+    'iniciar_agendamento': [
+        'agendar', 'agendamento', 'marcar', 'marcacao', 'quero uma consulta', 'quero consulta',
+        'tem horario', 'tem vaga', 'horario disponivel', 'horarios disponiveis',
+    ],
+    'cancelar_agendamento': [
+        'cancelar', 'cancelamento', 'desmarcar', 'nao posso ir', 'nao vou poder ir', 'nao vou conseguir ir',
+    ],
+    'triagem_sintomas': [
+        'me sinto mal', 'estou sentindo', 'dor', 'dores', 'febre', 'tosse', 'enjoo', 'tontura', 'mal estar',
+    ],
+    'pergunta_geral': [
+        'endereco', 'onde fica', 'localizacao', 'horario de funcionamento', 'que horas abre',
+        'que horas fecha', 'convenio', 'convenios', 'plano de saude', 'telefone', 'estacionamento',
+    ],
+}
+
+# Intenções que só fazem sentido com uma entidade (senão o contexto do histórico decide)
+EXIGEM_ENTIDADE = {'buscar_preco'}
+
+NEGACOES = {'nao', 'nem', 'nunca'}
+JANELA_NEGACAO = 2  # "nao agendar", "nao quero agendar"
+
+_FIM = object()
+
+
+class Roteamento(NamedTuple):
+    intent: Optional[str]
+    entity: Optional[str]
+    motivo: str
+
+    def como_intent_data(self):
+        return {'intent': self.intent, 'entity': self.entity}
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas, sem acentos e só com letras/dígitos separados por espaço."""
+    decomposto = unicodedata.normalize('NFKD', texto.lower())
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return re.sub(r'[^a-z0-9]+', ' ', sem_acentos).strip()
+
+
+def _compilar_trie(pares):
+    """pares: [(frase normalizada, valor)] -> trie de tokens em dicts aninhados."""
+    raiz = {}
+    for frase, valor in pares:
+        no = raiz
+        for token in frase.split():
+            no = no.setdefault(token, {})
+        no[_FIM] = valor
+    return raiz
+
+
+def _casamentos(trie, tokens):
+    """(inicio, fim, valor) do casamento mais longo que começa em cada token."""
+    resultado = []
+    for inicio in range(len(tokens)):
+        no, posicao, melhor = trie, inicio, None
+        while posicao < len(tokens) and tokens[posicao] in no:
+            no = no[tokens[posicao]]
+            posicao += 1
+            if _FIM in no:
+                melhor = (inicio, posicao, no[_FIM])
+        if melhor:
+            resultado.append(melhor)
+    return resultado
+
+
+_TRIE_INTENCOES = _compilar_trie(
+    (normalizar(frase), intencao) for intencao, frases in PALAVRAS_CHAVE.items() for frase in frases
+)
+
+
+# --- Catálogo de entidades (especialidades e procedimentos) ---
+
+def variantes(nome_normalizado):
+    """Cardiologia -> cardiologista; Pediatria -> pediatra."""
+    variantes = {nome_normalizado}
+    if nome_normalizado.endswith('ria'):
+        variantes.add(nome_normalizado[:-3] + 'ra')
+    if nome_normalizado.endswith('ia'):
+        variantes.add(nome_normalizado[:-2] + 'ista')
+    return variantes
+
+
+def _compilar_catalogo(dados):
+    nomes = [esp['nome'] for esp in dados['especialidades'].values()]
+    nomes += [proc['descricao'] for proc in dados['procedimentos'].values()]
+    pares = []
+    for nome in nomes:
+        for variante in variantes(normalizar(nome)):
+            if variante:
+                pares.append((variante, nome))
+    return _compilar_trie(pares)
+
+
+def _trie_do_catalogo():
+    return catalogo.derivado('trie_roteador_local', _compilar_catalogo)
+
+
+def extrair_entidade(tokens):
+    """
+    Nome (como está no catálogo) da especialidade/procedimento citado. Se a
+    mensagem citar dois serviços diferentes, devolve None (ambíguo).
+    """
+    encontrados = {valor for _, _, valor in _casamentos(_trie_do_catalogo(), tokens)}
+    return encontrados.pop() if len(encontrados) == 1 else None
+
+
+# --- Classificação ---
+
+def classificar(mensagem: str) -> Roteamento:
+    """
+    Resolve a intenção localmente quando não há dúvida. Quando `intent` vem
+    None, `motivo` diz por que a mensagem deve ir para a IA Roteadora.
+    """
+    tokens = normalizar(mensagem or '').split()
+    if not tokens:
+        return Roteamento(None, None, 'mensagem_vazia')
+
+    casamentos = _casamentos(_TRIE_INTENCOES, tokens)
+    if not casamentos:
+        return Roteamento(None, None, 'sem_palavra_chave')
+
+    intencoes = {intencao for _, _, intencao in casamentos}
+
+    # "Se mencionar atendente/humano/pessoa, a intenção é SEMPRE transferencia_humano"
+    if 'transferencia_humano' in intencoes:
+        return Roteamento('transferencia_humano', None, 'regra')
+
+    # "Não quero agendar": a negação muda o sentido, melhor a IA decidir
+    for inicio, _, _ in casamentos:
+        if NEGACOES.intersection(tokens[max(inicio - JANELA_NEGACAO, 0):inicio]):
+            return Roteamento(None, None, 'negacao')
+
+    # "Se quer marcar algo e NÃO pergunta o preço" -> perguntar o preço vence
+    if 'buscar_preco' in intencoes:
+        intencoes.discard('iniciar_agendamento')
+
+    if len(intencoes) > 1:
+        return Roteamento(None, None, 'conflito')
+
+    intencao = intencoes.pop()
+    entidade = extrair_entidade(tokens)
+    if intencao in EXIGEM_ENTIDADE and not entidade:
+        return Roteamento(None, None, 'sem_entidade')
+    return Roteamento(intencao, entidade, 'regra')
+
+
+def registrar_metrica(session_id, roteamento: Roteamento, duracao_ms: float):
+    """
+    Uma linha em ChatbotMetrics por mensagem roteada: origem local ou llm e o
+    tempo gasto. A latência das chamadas à IA é o que cada acerto local economiza.
+    """
+    from .models import ChatbotMetrics
+
+    try:
+        ChatbotMetrics.objects.create(
+            session_id=session_id,
+            evento=EVENTO_METRICA,
+            dados_evento={
+                'origem': 'local' if roteamento.intent else 'llm',
+                'motivo': roteamento.motivo,
+                'intent': roteamento.intent,
+                'duracao_ms': round(duracao_ms, 3),
+            }
+        )
+    except Exception as e:
+        logger.error(f"Erro ao registrar métrica do roteador: {e}")
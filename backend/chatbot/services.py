@@ -1,59 +1,19 @@
 # chatbot/services.py
 
-from usuarios.models import Especialidade
-from faturamento.models import Procedimento
+from . import indice_precos
 
 def buscar_precos_servicos(nome_servico=None):
     """
-    Busca os preços de todas as especialidades e procedimentos no banco de dados.
-    Se um nome de serviço for fornecido, tenta encontrar um serviço específico.
+    Preços de todas as especialidades e procedimentos, já formatados.
+    Se um nome de serviço for fornecido, devolve o serviço que mais se parece
+    com ele (sem acentos, com variantes, prefixos e erros de digitação), ou
+    None. Vem do índice montado uma vez por versão do catálogo.
     """
     try:
-        servicos = []
-        
-        # Busca preços das consultas - otimizada
-        especialidades = Especialidade.objects.only('nome', 'valor_consulta')
-        servicos.extend([
-            {
-                "nome": esp.nome,
-                "valor": f"{esp.valor_consulta:.2f}".replace('.', ','),
-                "tipo": "Consulta"
-            }
-            for esp in especialidades
-        ])
-
-        # Busca preços dos procedimentos - otimizada
-        procedimentos = Procedimento.objects.filter(
-            ativo=True, 
-            valor_particular__gt=0
-        ).only('descricao', 'valor_particular')
-        
-        servicos.extend([
-            {
-                "nome": proc.descricao,
-                "valor": f"{proc.valor_particular:.2f}".replace('.', ','),
-                "tipo": "Procedimento"
-            }
-            for proc in procedimentos
-        ])
-
+        indice = indice_precos.indice()
         if not nome_servico:
-            return servicos
-
-        # Se um nome foi especificado, tenta encontrar o serviço
-        nome_servico_lower = nome_servico.lower()
-        
-        # Busca por correspondência exata primeiro
-        for s in servicos:
-            if s['nome'].lower() == nome_servico_lower:
-                return s
-                
-        # Se não achar, busca por correspondência parcial
-        for s in servicos:
-            if nome_servico_lower in s['nome'].lower():
-                return s
-
-        return None
+            return indice.servicos
+        return indice.melhor(nome_servico)
     except Exception as e:
         from django.conf import settings
         import logging
@@ -67,7 +27,8 @@ def get_resposta_preco(nome_servico: str, nome_usuario: str = ""):
         from django.utils.html import escape
         nome_usuario_seguro = escape(str(nome_usuario)[:50]) if nome_usuario else ""
         nome_servico_seguro_busca = escape(str(nome_servico)[:100]) if nome_servico else ""
-        servico_info = buscar_precos_servicos(nome_servico_seguro_busca)
+        # A busca normaliza o texto; o escape é só para exibir
+        servico_info = buscar_precos_servicos(str(nome_servico)[:100] if nome_servico else "")
     except Exception as e:
         import logging
         logger = logging.getLogger(__name__)
@@ -0,0 +1,195 @@
+# chatbot/sessao_conversa.py
+"""
+Unidade de trabalho da conversa durante uma requisição.
+
+A mensagem é processada dentro de `with abrir(session_id) as sessao` (ou
+`async with aabrir(...)`):
+- a memória é carregada UMA vez (estado quente; o banco só na primeira vez)
+  e repassada a quem precisa (timeout, bot, transferência para humano);
+- ao sair do bloco sem erro, a memória é gravada uma vez no estado quente,
+  que leva ao banco só os campos que mudaram (state, previous_state,
+  memory_data; updated_at sempre; do memory_data, só as chaves alteradas),
+  e os demais campos do ChatMemory
+  (transferencia_solicitada...) alterados saem em um único UPDATE;
+- duas mensagens simultâneas da mesma sessão não se atropelam: uma trava por
+  sessão (Redis em produção) faz a segunda esperar a primeira terminar e
+  carregar a memória já atualizada. Se a trava não sair em
+  ESPERA_MAXIMA_SEGUNDOS, a mensagem falha com SessaoOcupada (nunca roda
+  sem a trava); a trava só é apagada por quem a tem (compare-and-delete).
+"""
+
+import asyncio
+import copy
+import logging
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from . import estado_sessao
+from .models import ChatMemory
+
+logger = logging.getLogger(__name__)
+
+TRAVA_TTL_SEGUNDOS = 60  # Se o processo morrer com a trava, ela expira sozinha
+ESPERA_MAXIMA_SEGUNDOS = 30  # Maior que o pior caso de uma mensagem (orçamentos da IA)
+INTERVALO_TENTATIVA_SEGUNDOS = 0.05
+CAMPOS_RASTREADOS = ('state', 'previous_state', 'memory_data')
+
+# Apaga a trava só se ela ainda for de ARGV[1] (pode ter expirado e sido pega por outro)
+_SCRIPT_LIBERAR = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+class SessaoOcupada(Exception):
+    """A trava da sessão não foi liberada em ESPERA_MAXIMA_SEGUNDOS."""
+
+
+class SessaoConversa:
+    """Memória da conversa carregada uma vez, com as alterações rastreadas."""
+
+    def __init__(self, memoria):
+        self.memoria = memoria
+        self.session_id = memoria.session_id
+        self._original = self._retrato()
+        self._campos_frios = {}
+
+    def _retrato(self):
+        return {campo: copy.deepcopy(getattr(self.memoria, campo)) for campo in CAMPOS_RASTREADOS}
+
+    def alterar(self, **campos):
+        """Campos do ChatMemory fora do estado quente (ex: transferencia_solicitada=True)."""
+        self._campos_frios.update(campos)
+
+    def campos_alterados(self):
+        """Campos alterados desde o carregamento (ou a última gravação)."""
+        atual = self._retrato()
+        return [campo for campo, valor in atual.items() if valor != self._original[campo]] + list(self._campos_frios)
+
+    def _gravar_campos_frios(self):
+        if self._campos_frios:
+            ChatMemory.objects.filter(session_id=self.session_id).update(**self._campos_frios)
+            self._campos_frios = {}
+
+    def chaves_alteradas(self):
+        """
+        (alteradas, removidas) do memory_data desde o carregamento, ou None
+        se ele não for um dicionário (aí vai inteiro para o banco).
+        """
+        antes, depois = self._original['memory_data'], self.memoria.memory_data
+        if not isinstance(antes, dict) or not isinstance(depois, dict):
+            return None
+        alteradas = {chave for chave, valor in depois.items() if chave not in antes or antes[chave] != valor}
+        return alteradas, set(antes) - set(depois)
+
+    def _alteracoes_quentes(self):
+        alterados = [campo for campo in self.campos_alterados() if campo in CAMPOS_RASTREADOS]
+        chaves = self.chaves_alteradas() if 'memory_data' in alterados else None
+        self._original = self._retrato()
+        return alterados, chaves
+
+    def salvar(self):
+        # Grava sempre: mesmo sem alterações, a escrita marca a última atividade (timeout)
+        estado_sessao.guardar(self.memoria, *self._alteracoes_quentes())
+        self._gravar_campos_frios()
+
+    async def asalvar(self):
+        await estado_sessao.aguardar(self.memoria, *self._alteracoes_quentes())
+        if self._campos_frios:
+            from .bot_logic import executar_no_banco
+            await executar_no_banco(self._gravar_campos_frios)
+
+
+def _chave_trava(session_id):
+    return f"chatbot:trava:{session_id}"
+
+
+class TravaRedis:
+    """Trava compartilhada pelos processos: SET NX com expiração, liberada por script."""
+
+    def __init__(self, url):
+        import redis
+
+        self.cliente = redis.Redis.from_url(url)
+        self._liberar = self.cliente.register_script(_SCRIPT_LIBERAR)
+
+    def adquirir(self, chave, dono):
+        return bool(self.cliente.set(chave, dono, nx=True, ex=TRAVA_TTL_SEGUNDOS))
+
+    def liberar(self, chave, dono):
+        self._liberar(keys=[chave], args=[dono])
+
+
+class TravaLocal:
+    """
+    Sem Redis o cache é do processo (LocMem): uma trava de thread em volta
+    de cada operação já torna o "confere e apaga" atômico.
+    """
+
+    def __init__(self):
+        self._trava = threading.Lock()
+
+    def adquirir(self, chave, dono):
+        with self._trava:
+            return cache.add(chave, dono, TRAVA_TTL_SEGUNDOS)
+
+    def liberar(self, chave, dono):
+        with self._trava:
+            if cache.get(chave) == dono:
+                cache.delete(chave)
+
+
+_travas = None
+
+
+def _trava():
+    global _travas
+    if _travas is None:
+        redis_url = getattr(settings, 'REDIS_URL', None)
+        _travas = TravaRedis(redis_url) if redis_url else TravaLocal()
+    return _travas
+
+
+def _esgotou(session_id):
+    logger.warning(f"Trava da sessão {session_id} não liberada em {ESPERA_MAXIMA_SEGUNDOS}s; mensagem recusada.")
+    return SessaoOcupada(session_id)
+
+
+@contextmanager
+def abrir(session_id):
+    """Levanta SessaoOcupada se outra mensagem da sessão segurar a trava por ESPERA_MAXIMA_SEGUNDOS."""
+    chave, dono = _chave_trava(session_id), uuid.uuid4().hex
+    limite = time.monotonic() + ESPERA_MAXIMA_SEGUNDOS
+    while not _trava().adquirir(chave, dono):
+        if time.monotonic() > limite:
+            raise _esgotou(session_id)
+        time.sleep(INTERVALO_TENTATIVA_SEGUNDOS)
+    try:
+        sessao = SessaoConversa(estado_sessao.obter(session_id))
+        yield sessao
+        sessao.salvar()
+    finally:
+        _trava().liberar(chave, dono)
+
+
+@asynccontextmanager
+async def aabrir(session_id):
+    chave, dono = _chave_trava(session_id), uuid.uuid4().hex
+    limite = time.monotonic() + ESPERA_MAXIMA_SEGUNDOS
+    adquirir = sync_to_async(_trava().adquirir, thread_sensitive=False)
+    while not await adquirir(chave, dono):
+        if time.monotonic() > limite:
+            raise _esgotou(session_id)
+        await asyncio.sleep(INTERVALO_TENTATIVA_SEGUNDOS)
+    try:
+        sessao = SessaoConversa(await estado_sessao.aobter(session_id))
+        yield sessao
+        await sessao.asalvar()
+    finally:
+        await sync_to_async(_trava().liberar, thread_sensitive=False)(chave, dono)
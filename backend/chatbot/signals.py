@@ -0,0 +1,63 @@
+# chatbot/signals.py
+"""
+Invalida o catálogo do chatbot (chatbot.catalogo) quando especialidades,
+médicos, procedimentos ou a tabela de valores por convênio mudam, e
+acumula cada evento novo do ChatbotMetrics para os agregados do dashboard
+(chatbot.analytics), gravados em lote pela descarga do estado quente.
+"""
+
+import logging
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from faturamento.models import Procedimento, ValorProcedimentoConvenio
+from usuarios.models import CustomUser, Especialidade
+from . import catalogo, estado_sessao
+from .analytics import AnalyticsManager
+from .models import ChatbotMetrics
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Especialidade)
+@receiver(post_delete, sender=Especialidade)
+@receiver(post_save, sender=Procedimento)
+@receiver(post_delete, sender=Procedimento)
+@receiver(post_save, sender=ValorProcedimentoConvenio)
+@receiver(post_delete, sender=ValorProcedimentoConvenio)
+def invalidar_catalogo(sender, **kwargs):
+    catalogo.invalidar()
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidar_catalogo_medico(sender, instance, update_fields=None, **kwargs):
+    # O login grava last_login a cada acesso: não muda nada no catálogo
+    if instance.cargo != 'medico' or update_fields == frozenset({'last_login'}):
+        return
+    catalogo.invalidar()
+
+
+@receiver(m2m_changed, sender=CustomUser.especialidades.through)
+def invalidar_catalogo_especialidades_do_medico(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        catalogo.invalidar()
+
+
+def _acumular_metrica(metrica):
+    try:
+        # Só guarda o evento: a thread de descarga do estado quente grava os agregados
+        AnalyticsManager.acumular_evento(metrica)
+        estado_sessao.iniciar_descarregador()
+    except Exception as e:
+        # Quem registra o evento não deve falhar por causa do dashboard
+        logger.error(f"Erro ao acumular métrica {metrica.evento} nos agregados: {e}")
+
+
+@receiver(post_save, sender=ChatbotMetrics)
+def acumular_metrica(sender, instance, created, **kwargs):
+    # Depois do commit: um evento desfeito pelo rollback não entra nos agregados
+    if created:
+        transaction.on_commit(lambda: _acumular_metrica(instance))
@@ -1,3 +1,584 @@
-from django.test import TestCase
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from langchain_core.language_models.chat_models import SimpleChatModel
+
+from usuarios.models import Especialidade
+from . import chains, envio_mensagens, estado_sessao, fila_sessao, modelos_ia, roteador_local
+from .indice_precos import IndicePrecos
+from .analytics import AnalyticsManager
+from .bot_logic import processar_mensagem_bot
+from .models import ChatMemory, ChatbotMetrics, EnvioPendente, MetricaHoraria, ResumoSessaoChatbot, TransicaoEstado
+
+
+# Processo novo: carrega o Django como um comando de gerenciamento e diz se o
+# cliente do Gemini foi importado
+SCRIPT_IMPORTACOES = """
+import sys
+import django
+django.setup()
+from django.core.management import call_command, load_command_class
+import chatbot.views
+load_command_class('chatbot', 'check_inactivity')
+call_command('check')
+print('langchain_google_genai' in sys.modules)
+"""
+
+
+class InicializacaoSemLangchainTests(SimpleTestCase):
+    """Views e comandos não pagam a importação do LangChain; as chains só são montadas no primeiro uso."""
+
+    def test_views_e_comandos_nao_importam_o_gemini(self):
+        ambiente = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'core.settings'}
+        ambiente.pop('CHATBOT_AQUECER_CHAINS', None)
+
+        saida = subprocess.run(
+            [sys.executable, '-c', SCRIPT_IMPORTACOES], cwd=settings.BASE_DIR, env=ambiente,
+            capture_output=True, text=True, timeout=120, check=True,
+        ).stdout
+
+        self.assertEqual(saida.strip().splitlines()[-1], 'False')
+
+
+class ModeloFalso(SimpleChatModel):
+    """LLM local para os testes: responde `resposta` depois de `atraso` segundos, ou falha."""
+
+    resposta: str = '{}'
+    atraso: float = 0
+    falhar: bool = False
+    chamadas: int = 0
+
+    @property
+    def _llm_type(self):
+        return 'modelo-falso'
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs):
+        self.chamadas += 1
+        if self.atraso:
+            time.sleep(self.atraso)
+        if self.falhar:
+            raise ConnectionError('modelo fora do ar')
+        return self.resposta
+
+
+class Relogio:
+    """time.monotonic controlável, para o disjuntor não depender de sleep."""
+
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+
+ORCAMENTOS_CURTOS = {
+    'chain_sintomas': {'orcamento_segundos': 0.05, 'orcamento_fallback_segundos': 0.05},
+    'chain_faq': {'orcamento_segundos': 0.05, 'orcamento_fallback_segundos': 0.05},
+}
+
+
+def pergunta_faq(texto):
+    return {'pergunta_do_usuario': texto, 'faq': 'Endereço: Rua X, 100.', 'nome_usuario': 'Ana'}
+
+
+@override_settings(CHATBOT_POLITICAS_IA=ORCAMENTOS_CURTOS)
+class RoteamentoDeModelosTests(SimpleTestCase):
+
+    def setUp(self):
+        # Disjuntores novos a cada teste (modelos_ia.disjuntor cria sob demanda)
+        patcher = mock.patch.object(modelos_ia, '_disjuntores', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.modelos = {
+            'rapido': ModeloFalso(resposta='{"especialidade_sugerida": "Cardiologia", "resposta": "rápido"}'),
+            'completo': ModeloFalso(resposta='{"especialidade_sugerida": "Ortopedia", "resposta": "completo"}'),
+        }
+
+    def montar(self):
+        return chains.montar_chains(fabrica_llm=lambda nivel: self.modelos[nivel])
+
+    def test_nivel_principal_responde(self):
+        resposta = self.montar()['chain_sintomas'].invoke({'sintomas_do_usuario': 'dor no joelho'})
+
+        self.assertEqual(resposta['especialidade_sugerida'], 'Ortopedia')
+        self.assertEqual(self.modelos['rapido'].chamadas, 0)
+
+    def test_orcamento_estourado_vai_para_o_fallback(self):
+        self.modelos['completo'].atraso = 0.5
+
+        inicio = time.monotonic()
+        resposta = self.montar()['chain_sintomas'].invoke({'sintomas_do_usuario': 'dor no peito'})
+
+        self.assertEqual(resposta['especialidade_sugerida'], 'Cardiologia')
+        self.assertLess(time.monotonic() - inicio, 0.4)
+
+    def test_nenhum_nivel_a_tempo_usa_resposta_pronta(self):
+        self.modelos['completo'].atraso = 0.5
+        self.modelos['rapido'].atraso = 0.5
+
+        inicio = time.monotonic()
+        resposta = self.montar()['chain_sintomas'].invoke({'sintomas_do_usuario': 'cansaço'})
+
+        self.assertEqual(resposta, {'especialidade_sugerida': 'Clínico Geral'})
+        # O pior caso é a soma dos orçamentos, não o tempo do modelo
+        self.assertLess(time.monotonic() - inicio, 0.4)
+
+    def test_sem_resposta_pronta_levanta_ia_indisponivel(self):
+        self.modelos['completo'].falhar = True
+        self.modelos['rapido'].falhar = True
+
+        with self.assertRaises(modelos_ia.IAIndisponivel):
+            self.montar()['chain_faq'].invoke(pergunta_faq('Qual o endereço?'))
+
+    def test_ainvoke_respeita_orcamento_e_fallback(self):
+        self.modelos['completo'].atraso = 0.5
+
+        resposta = asyncio.run(self.montar()['chain_faq'].ainvoke(pergunta_faq('Aceitam convênio?')))
+
+        self.assertEqual(resposta['resposta'], 'rápido')
+
+    def test_disjuntor_abre_e_fica_meio_aberto(self):
+        relogio = Relogio()
+        self.modelos['completo'].falhar = True
+        chain = self.montar()['chain_sintomas']
+
+        with mock.patch.object(modelos_ia.time, 'monotonic', relogio):
+            for _ in range(modelos_ia.LIMITE_FALHAS):
+                self.assertEqual(chain.invoke({'sintomas_do_usuario': 'febre'})['especialidade_sugerida'], 'Cardiologia')
+            self.assertEqual(modelos_ia.disjuntor('completo').estado, 'aberto')
+            self.assertEqual(self.modelos['completo'].chamadas, modelos_ia.LIMITE_FALHAS)
+
+            # Aberto: vai direto para o fallback, sem chamar o nível com problema
+            chain.invoke({'sintomas_do_usuario': 'febre'})
+            self.assertEqual(self.modelos['completo'].chamadas, modelos_ia.LIMITE_FALHAS)
+
+            # Passado o tempo aberto, uma chamada de teste; falhou, abre de novo
+            relogio.agora += modelos_ia.TEMPO_ABERTO_SEGUNDOS + 1
+            self.assertEqual(modelos_ia.disjuntor('completo').estado, 'meio_aberto')
+            chain.invoke({'sintomas_do_usuario': 'febre'})
+            self.assertEqual(self.modelos['completo'].chamadas, modelos_ia.LIMITE_FALHAS + 1)
+            self.assertEqual(modelos_ia.disjuntor('completo').estado, 'aberto')
+
+            # Nova chamada de teste com o modelo de volta: o disjuntor fecha
+            relogio.agora += modelos_ia.TEMPO_ABERTO_SEGUNDOS + 1
+            self.modelos['completo'].falhar = False
+            resposta = chain.invoke({'sintomas_do_usuario': 'febre'})
+            self.assertEqual(resposta['especialidade_sugerida'], 'Ortopedia')
+            self.assertEqual(modelos_ia.disjuntor('completo').estado, 'fechado')
+
+    def test_meio_aberto_deixa_passar_uma_chamada_por_vez(self):
+        relogio = Relogio()
+        disjuntor = modelos_ia.DisjuntorDeCircuito(limite_falhas=1, tempo_aberto=10)
+
+        with mock.patch.object(modelos_ia.time, 'monotonic', relogio):
+            disjuntor.registrar_falha()
+            self.assertFalse(disjuntor.permite())
+            relogio.agora += 11
+            self.assertTrue(disjuntor.permite())
+            self.assertFalse(disjuntor.permite())
+            disjuntor.registrar_sucesso()
+            self.assertTrue(disjuntor.permite())
+
+
+class OrcamentoDeQueriesDaMensagemTests(TestCase):
+    """Uma mensagem normal custa no máximo duas queries no caminho da requisição."""
+
+    def setUp(self):
+        cache.clear()
+        # A descarga roda aqui, na thread do teste, e não entra na conta
+        patcher = mock.patch.object(estado_sessao, 'iniciar_descarregador')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(estado_sessao.descarregar)
+        ChatMemory.objects.create(session_id='sessao-1', state='aguardando_nome', memory_data={})
+
+    def processar(self, mensagem):
+        with CaptureQueriesContext(connection) as capturadas:
+            resultado = processar_mensagem_bot('sessao-1', mensagem)
+        self.assertLessEqual(len(capturadas), 2, [query['sql'] for query in capturadas])
+        return resultado, len(capturadas)
+
+    def test_sessao_fria_le_a_memoria_uma_vez(self):
+        resultado, queries = self.processar('Maria')
+
+        self.assertEqual(queries, 1)
+        self.assertIn('Maria', resultado['response_message'])
+        estado_sessao.descarregar()
+        self.assertEqual(ChatMemory.objects.get(session_id='sessao-1').memory_data['nome_usuario'], 'Maria')
+
+    def test_sessao_quente_nao_vai_ao_banco(self):
+        self.processar('Maria')
+
+        resultado, queries = self.processar('#ajuda')
+
+        self.assertEqual(queries, 0)
+        self.assertTrue(resultado['response_message'])
+
+    def test_transferencia_para_humano(self):
+        self.processar('Maria')
+
+        resultado, queries = self.processar('quero falar com um atendente')
+
+        self.assertEqual(queries, 2)  # Métrica + UPDATE de transferencia_solicitada
+        self.assertEqual(resultado['new_state'], 'aguardando_atendente_humano')
+        self.assertTrue(ChatMemory.objects.get(session_id='sessao-1').transferencia_solicitada)
+        self.assertTrue(ChatbotMetrics.objects.filter(session_id='sessao-1', evento='transferencia_humano_solicitada').exists())
+
+    def test_sessao_fria_mantem_a_entrada_no_estado(self):
+        self.processar('Maria')
+        estado_sessao.descarregar()
+        entrada = ChatMemory.objects.get(session_id='sessao-1').estado_desde
+        # O cache expirou (TTL, reinício, outro worker): a próxima mensagem carrega do banco
+        cache.clear()
+
+        processar_mensagem_bot('sessao-1', 'quero falar com um atendente')
+        estado_sessao.descarregar()
+
+        transicao = TransicaoEstado.objects.get(session_id='sessao-1', estado_novo='aguardando_atendente_humano')
+        self.assertIsNotNone(transicao.duracao_ms)
+        self.assertEqual(transicao.duracao_ms, round((transicao.entrou_em - entrada).total_seconds() * 1000))
+
+
+class AgregadosForaDeOrdemTests(TestCase):
+    """Lotes de eventos que chegam fora de ordem não fazem o resumo da sessão andar para trás."""
+
+    INICIO = datetime(2026, 3, 2, 14, 0, tzinfo=dt_timezone.utc)
+
+    def descarregar(self, *eventos):
+        for minutos, evento in eventos:
+            AnalyticsManager.acumular_evento(ChatbotMetrics(
+                session_id='sessao-1', evento=evento, dados_evento={},
+                timestamp=self.INICIO + timedelta(minutes=minutos),
+            ))
+        self.assertEqual(AnalyticsManager.descarregar_agregados(), len(eventos))
+
+    def test_lotes_em_ordem_inversa(self):
+        # O lote mais novo chega primeiro
+        self.descarregar((30, 'inicio_conversa'), (40, 'agendamento_completo'))
+        self.descarregar((0, 'inicio_conversa'), (10, 'abandono_conversa'))
+
+        resumo = ResumoSessaoChatbot.objects.get(session_id='sessao-1')
+        self.assertEqual(resumo.primeiro_evento, self.INICIO)
+        self.assertEqual(resumo.ultimo_evento, self.INICIO + timedelta(minutes=40))
+        self.assertEqual(resumo.total_eventos, 4)
+        self.assertEqual(resumo.resultado, 'agendamento_completo')
+        self.assertEqual(MetricaHoraria.objects.get(evento='inicio_conversa').total, 2)
+
+    def test_lote_mais_novo_troca_o_resultado(self):
+        self.descarregar((0, 'inicio_conversa'), (10, 'abandono_conversa'))
+        self.descarregar((30, 'transferencia_humano_solicitada'))
+
+        resumo = ResumoSessaoChatbot.objects.get(session_id='sessao-1')
+        self.assertEqual(resumo.resultado, 'transferencia_humano_solicitada')
+        self.assertEqual(resumo.ultimo_evento, self.INICIO + timedelta(minutes=30))
+
+
+class RoteadorLocalTests(TestCase):
+    """O roteador local só decide sem a IA quando a mensagem não tem duplo sentido."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Especialidade.objects.create(nome='Cardiologia', valor_consulta=Decimal('250.00'))
+        Especialidade.objects.create(nome='Pediatria', valor_consulta=Decimal('200.00'))
+
+    def setUp(self):
+        # Versão nova do catálogo: recarrega com as especialidades deste teste
+        cache.clear()
+
+    def test_casos_resolvidos_localmente(self):
+        casos = {
+            'quero falar com um atendente': ('transferencia_humano', None),
+            'posso falar com uma pessoa?': ('transferencia_humano', None),
+            'quanto custa a consulta com cardiologista?': ('buscar_preco', 'Cardiologia'),
+            'quero marcar pediatria': ('iniciar_agendamento', 'Pediatria'),
+            'preciso desmarcar minha consulta': ('cancelar_agendamento', None),
+            'estou sentindo muita dor de cabeça': ('triagem_sintomas', None),
+            'me sinto mal desde ontem': ('triagem_sintomas', None),
+            'onde fica a clínica?': ('pergunta_geral', None),
+            'obrigada, tchau': ('encerrar_conversa', None),
+        }
+        for mensagem, esperado in casos.items():
+            with self.subTest(mensagem=mensagem):
+                roteamento = roteador_local.classificar(mensagem)
+                self.assertEqual((roteamento.intent, roteamento.entity), esperado)
+                self.assertEqual(roteamento.motivo, 'regra')
+
+    def test_palavras_ambiguas_ficam_para_a_ia(self):
+        for mensagem in ('sinto muito', 'me sinto melhor', 'estou com uma dúvida', 'essa pessoa me indicou vocês'):
+            with self.subTest(mensagem=mensagem):
+                self.assertIsNone(roteador_local.classificar(mensagem).intent)
+
+    def test_pessoa_nao_transfere_para_humano(self):
+        roteamento = roteador_local.classificar('quero marcar para outra pessoa')
+
+        self.assertEqual(roteamento.intent, 'iniciar_agendamento')
+
+    def test_negacao_conflito_e_falta_de_entidade_vao_para_a_ia(self):
+        casos = {
+            'não quero agendar': 'negacao',
+            'quero cancelar e marcar outra': 'conflito',
+            'quanto custa?': 'sem_entidade',
+            'bom dia': 'sem_palavra_chave',
+            '': 'mensagem_vazia',
+        }
+        for mensagem, motivo in casos.items():
+            with self.subTest(mensagem=mensagem):
+                self.assertEqual(roteador_local.classificar(mensagem), roteador_local.Roteamento(None, None, motivo))
+
+
+class IndicePrecosTests(SimpleTestCase):
+    """Entidades como a IA extrai da pergunta -> serviço com preço."""
+
+    ESPECIALIDADES = [
+        'Cardiologia', 'Ginecologia', 'Ortopedia', 'Pediatria', 'Clínico Geral', 'Dermatologia', 'Endocrinologia',
+        'Gastroenterologia', 'Oftalmologia', 'Otorrinolaringologia', 'Psiquiatria', 'Urologia',
+    ]
+    PROCEDIMENTOS = [
+        'Ecocardiograma transtorácico', 'Eletrocardiograma', 'Ultrassonografia de abdome total',
+        'Ultrassonografia transvaginal', 'Holter 24 horas', 'Teste ergométrico', 'Colposcopia', 'Papanicolau',
+        'Infiltração articular', 'Audiometria tonal', 'Espirometria', 'Biópsia de pele', 'Mapeamento de retina',
+        'Tonometria', 'Retirada de sinal', 'Cauterização química',
+    ] + [f'Procedimento diverso {indice}' for indice in range(60)]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        servicos = [{'nome': nome, 'valor': '350,00', 'tipo': 'Consulta'} for nome in cls.ESPECIALIDADES]
+        servicos += [{'nome': nome, 'valor': '100,00', 'tipo': 'Procedimento'} for nome in cls.PROCEDIMENTOS]
+        cls.indice = IndicePrecos(servicos)
+
+    def test_entidades_extraidas(self):
+        casos = {
+            'Cardiologia': 'Cardiologia',
+            'cardiologista': 'Cardiologia',
+            'cardiolojia': 'Cardiologia',
+            'consulta de cardiologia': 'Cardiologia',
+            'pediatra': 'Pediatria',
+            'ginecologista': 'Ginecologia',
+            'dermatologista': 'Dermatologia',
+            'ortopedista': 'Ortopedia',
+            'psiquiatra': 'Psiquiatria',
+            'urologista': 'Urologia',
+            'clinico geral': 'Clínico Geral',
+            'clínico': 'Clínico Geral',
+            'oftalmo': 'Oftalmologia',
+            'otorrino': 'Otorrinolaringologia',
+            'eco': 'Ecocardiograma transtorácico',
+            'eletrocardiograma': 'Eletrocardiograma',
+            'ECG': 'Eletrocardiograma',
+            'ultrassom transvaginal': 'Ultrassonografia transvaginal',
+            'exame de papanicolau': 'Papanicolau',
+            'biopsia': 'Biópsia de pele',
+            'holter': 'Holter 24 horas',
+            'teste ergometrico': 'Teste ergométrico',
+        }
+        for texto, esperado in casos.items():
+            with self.subTest(texto=texto):
+                servico = self.indice.melhor(texto)
+                self.assertEqual(servico and servico['nome'], esperado)
+
+    def test_servico_fora_da_lista_nao_casa(self):
+        for texto in ('neurologia', 'neurologista', 'consulta', 'massagem', 'tatuagem', ''):
+            with self.subTest(texto=texto):
+                self.assertEqual(self.indice.buscar(texto), [])
+                self.assertIsNone(self.indice.melhor(texto))
+
+    def test_resultados_ordenados_pela_pontuacao(self):
+        resultados = self.indice.buscar('ultrassom', limite=3)
+
+        self.assertEqual(
+            {servico['nome'] for _, servico in resultados},
+            {'Ultrassonografia de abdome total', 'Ultrassonografia transvaginal'},
+        )
+        pontuacoes = [pontuacao for pontuacao, _ in resultados]
+        self.assertEqual(pontuacoes, sorted(pontuacoes, reverse=True))
+
+
+class FilaSessaoTests(SimpleTestCase):
+
+    def test_rajada_vira_um_lote(self):
+        lotes = []
+
+        async def processar(session_id, mensagens):
+            lotes.append(mensagens)
+            return [f'resposta {indice}' for indice in range(len(mensagens))]
+
+        async def cenario():
+            return await asyncio.gather(*(
+                fila_sessao.enviar('sessao-1', mensagem, processar, janela=0.05) for mensagem in ('oi', 'quero marcar')
+            ))
+
+        self.assertEqual(asyncio.run(cenario()), ['resposta 0', 'resposta 1'])
+        self.assertEqual(lotes, [['oi', 'quero marcar']])
+
+    def test_lote_cancelado_nao_deixa_ninguem_esperando(self):
+        async def cenario():
+            comecou = asyncio.Event()
+
+            async def processar(session_id, mensagens):
+                comecou.set()
+                await asyncio.sleep(60)
+
+            esperas = [
+                asyncio.ensure_future(fila_sessao.enviar('sessao-1', mensagem, processar, janela=0.01))
+                for mensagem in ('oi', 'quero marcar')
+            ]
+            await comecou.wait()
+            # Chega durante o processamento: fica na fila para o próximo lote
+            esperas.append(asyncio.ensure_future(fila_sessao.enviar('sessao-1', 'cardiologia', processar)))
+            await asyncio.sleep(0)
+            fila_sessao._filas[(asyncio.get_running_loop(), 'sessao-1')].tarefa.cancel()
+            return await asyncio.wait_for(asyncio.gather(*esperas, return_exceptions=True), 1)
+
+        resultados = asyncio.run(cenario())
+
+        self.assertEqual(len(resultados), 3)
+        for resultado in resultados:
+            self.assertIsInstance(resultado, asyncio.CancelledError)
+        self.assertEqual(fila_sessao._filas, {})
+
+
+class ProvedorFalso:
+    """Webhook do provedor via httpx.MockTransport: cada requisição consome a próxima resposta (ou erro)."""
+
+    def __init__(self, *respostas):
+        self.respostas = list(respostas)
+        self.requisicoes = []
+
+    def __call__(self, request):
+        self.requisicoes.append(request)
+        resposta = self.respostas.pop(0) if len(self.respostas) > 1 else self.respostas[0]
+        if isinstance(resposta, type) and issubclass(resposta, httpx.TransportError):
+            raise resposta('falha simulada', request=request)
+        status, cabecalhos = resposta if isinstance(resposta, tuple) else (resposta, {})
+        return httpx.Response(status, headers=cabecalhos, json={})
+
+
+URL_WEBHOOK = 'https://provedor.test/mensagens'
+
+
+class GatewayDeEnvioTests(TestCase):
+
+    def setUp(self):
+        # Sem espera real entre as tentativas; as esperas pedidas ficam registradas
+        self.esperas = []
+        patcher = mock.patch.object(envio_mensagens.time, 'sleep', self.esperas.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def usar(self, provedor):
+        patcher = mock.patch.object(envio_mensagens, '_cliente', httpx.Client(transport=httpx.MockTransport(provedor)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return provedor
+
+    def test_sucesso(self):
+        provedor = self.usar(ProvedorFalso(200))
+
+        self.assertEqual(envio_mensagens.enviar(URL_WEBHOOK, {'message': 'oi'}), envio_mensagens.ENVIADO)
+        self.assertEqual(len(provedor.requisicoes), 1)
+        self.assertEqual(provedor.requisicoes[0].read(), b'{"message":"oi"}')
+
+    def test_falha_temporaria_vai_para_a_fila(self):
+        provedor = self.usar(ProvedorFalso(503))
+
+        self.assertEqual(envio_mensagens.enviar(URL_WEBHOOK, {'message': 'oi'}), envio_mensagens.NA_FILA)
+        self.assertEqual(len(provedor.requisicoes), envio_mensagens.TENTATIVAS_IMEDIATAS)
+        pendente = EnvioPendente.objects.get()
+        self.assertEqual((pendente.tentativas, pendente.payload), (1, {'message': 'oi'}))
+
+    def test_erro_definitivo_nao_repete(self):
+        provedor = self.usar(ProvedorFalso(400))
+
+        self.assertEqual(envio_mensagens.enviar(URL_WEBHOOK, {'message': 'oi'}), envio_mensagens.FALHOU)
+        self.assertEqual(len(provedor.requisicoes), 1)
+        self.assertFalse(EnvioPendente.objects.exists())
+
+    def test_falha_de_conexao_repete(self):
+        provedor = self.usar(ProvedorFalso(httpx.ConnectError, httpx.PoolTimeout, 200))
+
+        self.assertEqual(envio_mensagens.enviar(URL_WEBHOOK, {'message': 'oi'}), envio_mensagens.ENVIADO)
+        self.assertEqual(len(provedor.requisicoes), 3)
+
+    def test_erro_depois_do_envio_nao_repete(self):
+        for erro in (httpx.ReadTimeout, httpx.WriteError, httpx.RemoteProtocolError):
+            with self.subTest(erro=erro.__name__):
+                provedor = self.usar(ProvedorFalso(erro, 200))
+
+                self.assertEqual(envio_mensagens.enviar(URL_WEBHOOK, {'message': 'oi'}), envio_mensagens.INCERTO)
+                self.assertEqual(len(provedor.requisicoes), 1)
+                self.assertFalse(EnvioPendente.objects.exists())
+
+    def test_retry_after_do_429(self):
+        provedor = self.usar(ProvedorFalso((429, {'Retry-After': '3'}), 200))
+
+        self.assertEqual(envio_mensagens.enviar(URL_WEBHOOK, {'message': 'oi'}), envio_mensagens.ENVIADO)
+        self.assertEqual(len(provedor.requisicoes), 2)
+        self.assertIn(3.0, self.esperas)
+
+    def test_retry_after_tem_teto(self):
+        resposta = httpx.Response(429, headers={'Retry-After': '600'})
+
+        self.assertEqual(envio_mensagens._espera(0, resposta), envio_mensagens.ESPERA_MAXIMA_SEGUNDOS)
+
+    def test_lote_mantem_a_ordem(self):
+        def provedor(request):
+            return httpx.Response(400 if b'falha' in request.read() else 200)
+
+        self.usar(provedor)
+
+        status = envio_mensagens.enviar_lote(
+            [(URL_WEBHOOK, {'message': 'ok 1'}), (URL_WEBHOOK, {'message': 'falha'}), (URL_WEBHOOK, {'message': 'ok 2'})]
+        )
+
+        self.assertEqual(status, [envio_mensagens.ENVIADO, envio_mensagens.FALHOU, envio_mensagens.ENVIADO])
+
+    def test_reenvio_desiste_depois_de_max_tentativas(self):
+        self.usar(ProvedorFalso(503))
+        vencido = timezone.now() - timedelta(minutes=1)
+        ultima = EnvioPendente.objects.create(
+            url=URL_WEBHOOK, payload={'message': 'a'}, tentativas=envio_mensagens.MAX_TENTATIVAS - 1, proxima_tentativa=vencido
+        )
+        adiado = EnvioPendente.objects.create(url=URL_WEBHOOK, payload={'message': 'b'}, tentativas=1, proxima_tentativa=vencido)
+
+        resumo = envio_mensagens.reenviar_pendentes()
+
+        self.assertEqual(resumo, {'enviados': 0, 'na_fila': 1, 'incertos': 0, 'desistencias': 1})
+        self.assertFalse(EnvioPendente.objects.filter(id=ultima.id).exists())
+        adiado.refresh_from_db()
+        self.assertEqual(adiado.tentativas, 2)
+        self.assertGreater(adiado.proxima_tentativa, timezone.now())
+
+    def test_reenvio_enviado_sai_da_fila(self):
+        self.usar(ProvedorFalso(200))
+        EnvioPendente.objects.create(
+            url=URL_WEBHOOK, payload={'message': 'a'}, tentativas=3, proxima_tentativa=timezone.now() - timedelta(seconds=1)
+        )
+
+        self.assertEqual(envio_mensagens.reenviar_pendentes()['enviados'], 1)
+        self.assertFalse(EnvioPendente.objects.exists())
+
+    def test_aenviar_pelo_cliente_assincrono(self):
+        provedor = ProvedorFalso(httpx.ConnectTimeout, 200)
+
+        async def cenario():
+            cliente = httpx.AsyncClient(transport=httpx.MockTransport(provedor))
+            with mock.patch.object(envio_mensagens, '_cliente_assincrono', lambda: (cliente, asyncio.Semaphore(1))), \
+                    mock.patch.object(envio_mensagens.asyncio, 'sleep', mock.AsyncMock()):
+                return await envio_mensagens.aenviar(URL_WEBHOOK, {'message': 'oi'})
+
+        self.assertEqual(asyncio.run(cenario()), envio_mensagens.ENVIADO)
+        self.assertEqual(len(provedor.requisicoes), 2)
@@ -16,23 +16,30 @@ class TimeoutManager:
         """Verifica se a sessão expirou por inatividade"""
         try:
             memoria = ChatMemory.objects.get(session_id=session_id)
-            agora = timezone.now()
-            tempo_limite = memoria.updated_at + timedelta(minutes=cls.TIMEOUT_MINUTES)
+        except ChatMemory.DoesNotExist:
+            return None
 
-            if agora > tempo_limite and memoria.state != 'awaiting_inactivity_response':
-                return cls._iniciar_aviso_timeout(memoria)
+        aviso = cls.verificar_timeout_da_memoria(memoria)
+        if aviso:
+            memoria.save()
+        return aviso
 
-            return None
+    @classmethod
+    def verificar_timeout_da_memoria(cls, memoria):
+        """Mesma regra sobre uma memória já carregada; quem chamou salva se houver aviso"""
+        agora = timezone.now()
+        tempo_limite = memoria.updated_at + timedelta(minutes=cls.TIMEOUT_MINUTES)
 
-        except ChatMemory.DoesNotExist:
-            return None
+        if agora > tempo_limite and memoria.state != 'awaiting_inactivity_response':
+            return cls._iniciar_aviso_timeout(memoria)
+
+        return None
 
     @classmethod
     def _iniciar_aviso_timeout(cls, memoria):
         """Inicia o processo de aviso de timeout"""
         memoria.previous_state = memoria.state
         memoria.state = 'awaiting_inactivity_response'
-        memoria.save()
 
         nome = str(memoria.memory_data.get('nome_usuario', ''))[:50] if isinstance(memoria.memory_data, dict) else ''
         mensagem = (
@@ -10,10 +10,9 @@ from datetime import datetime, time, timedelta
 from dateutil import parser
 from .services import buscar_precos_servicos
 from typing import Optional
-from pydantic import BaseModel, Field
-from .bot_logic import processar_mensagem_bot # <-- IMPORTE A NOVA FUNÇÃO
+from .bot_logic import aprocessar_mensagem_bot, ESTADOS_DE_FLUXO
 from .timeout_manager import TimeoutManager # <-- ADICIONE ESTA IMPORTAÇÃO
-from asgiref.sync import async_to_sync   # <--- ADICIONE ESTA LINHA
+from . import catalogo, estado_sessao, fila_sessao, sessao_conversa
 from channels.layers import get_channel_layer # <--- ADICIONE ESTA LINHA
 
 from django.utils import timezone
@@ -32,9 +31,6 @@ from rest_framework_api_key.permissions import HasAPIKey
 # --- SEÇÃO DE IMPORTAÇÕES DO LANGCHAIN E IA ---
 from dotenv import load_dotenv
 import requests
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
 
 # --- SEÇÃO DE IMPORTAÇÕES DO SEU PROJETO ---
 from .models import ChatMemory
@@ -158,6 +154,10 @@ class ListarEspecialidadesView(generics.ListAPIView):
     permission_classes = [HasAPIKey]
     queryset = Especialidade.objects.all().order_by('nome')
     serializer_class = EspecialidadeSerializer
+    def list(self, request, *args, **kwargs):
+        # Vem do catálogo em memória (chatbot/catalogo.py), sem ir ao banco
+        especialidades = [Especialidade(**esp) for esp in catalogo.especialidades().values()]
+        return Response(self.get_serializer(especialidades, many=True).data)
 
 class ListarMedicosPorEspecialidadeView(generics.ListAPIView):
     permission_classes = [HasAPIKey]
@@ -173,10 +173,10 @@ class ListarProcedimentosView(generics.ListAPIView):
     permission_classes = [HasAPIKey]
     queryset = Procedimento.objects.filter(valor_particular__gt=0, ativo=True).exclude(descricao__iexact='consulta')
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
         dados_formatados = [
-            {"id": proc.id, "nome": proc.descricao, "valor": f"{proc.valor_particular:.2f}".replace('.', ',')}
-            for proc in queryset
+            {"id": proc['id'], "nome": proc['descricao'], "valor": f"{proc['valor_particular']:.2f}".replace('.', ',')}
+            for proc in catalogo.procedimentos().values()
+            if proc['descricao'].lower() != 'consulta'
         ]
         return Response(dados_formatados)
 
@@ -215,58 +215,109 @@ except ImportError:
     from django.utils.html import escape
     from django.views.decorators.http import require_http_methods
 
-@csrf_exempt
-@require_POST
-def chatbot_orchestrator(request):
-    logger.warning("="*20 + " NOVA REQUISIÇÃO " + "="*20)
-    try:
-        logger.warning("[DEBUG-VIEW] Orquestrador iniciado.")
-        data = json.loads(request.body)
-        user_message = data.get("message")
-        session_id = data.get("sessionId")
-        logger.warning(f"[DEBUG-VIEW] Dados recebidos: message='{user_message[:50]}...', sessionId='{session_id}'")
+# Estados em que cada mensagem responde uma pergunta ("cardiologia", CPF, "sim"):
+# não são juntadas, mas continuam na fila da sessão, uma de cada vez
+ESTADOS_SEM_AGRUPAMENTO = set(ESTADOS_DE_FLUXO) | {'aguardando_nome'}
+SEPARADOR_MENSAGENS = '\n'
 
 
-        if not user_message or not session_id:
-            logger.error("[DEBUG-VIEW] Erro: message ou sessionId ausentes.")
-            return JsonResponse({"error": "message e sessionId são obrigatórios."}, status=400)
-        
+async def _processar_lote(session_id, mensagens):
+    """
+    Processa um lote da fila da sessão (fila_sessao) e devolve o corpo da
+    resposta de cada mensagem. Fora de um fluxo, as mensagens viram uma só
+    chamada ao bot e a resposta vai na requisição da última; as outras
+    recebem {} (sem resposta, como no atendimento humano).
+    """
+    # Unidade de trabalho do lote: carrega a conversa uma vez (estado quente),
+    # serializa com outros processos e grava ao final
+    async with sessao_conversa.aabrir(session_id) as sessao:
+        memoria_obj = sessao.memoria
+        sem_resposta = [{} for _ in mensagens[:-1]]
+
         # --- INÍCIO DO NOVO BLOCO DE TIMEOUT ---
         # Verifica se houve timeout ANTES de processar a mensagem.
-        timeout_info = TimeoutManager.verificar_timeout(session_id)
+        timeout_info = TimeoutManager.verificar_timeout_da_memoria(memoria_obj)
         if timeout_info:
             logger.warning(f"[DEBUG-VIEW] Timeout detectado para a sessão {session_id}. Enviando aviso.")
             # Se um timeout foi detectado, o manager já mudou o estado.
             # Apenas enviamos a mensagem de aviso e paramos o fluxo aqui.
-            return JsonResponse({"response_message": timeout_info["message"]})
+            return sem_resposta + [{"response_message": timeout_info["message"]}]
         # --- FIM DO NOVO BLOCO DE TIMEOUT ---
-        
+
         session_id_sanitizado = re.sub(r'[^a-zA-Z0-9\-_.]', '_', session_id)
-        
+
         logger.warning("[DEBUG-VIEW] Enviando mensagem para o Channel Layer...")
         channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f'chat_{session_id_sanitizado}',
-            {
-                'type': 'chat_message',
-                'message': {'text': user_message, 'author': 'paciente'}
-            }
-        )
+        for user_message in mensagens:
+            await channel_layer.group_send(
+                f'chat_{session_id_sanitizado}',
+                {
+                    'type': 'chat_message',
+                    'message': {'text': user_message, 'author': 'paciente'}
+                }
+            )
         logger.warning("[DEBUG-VIEW] Mensagem enviada para o Channel Layer com sucesso.")
 
-        memoria_obj, _ = ChatMemory.objects.get_or_create(session_id=session_id)
-        
         if memoria_obj.state == 'humano':
             logger.warning(f"[DEBUG-VIEW] Conversa {session_id} em modo 'humano'. Bot não responderá.")
-            return JsonResponse({})
-        
-        logger.warning("[DEBUG-VIEW] Chamando o processar_mensagem_bot...")
-        resultado = processar_mensagem_bot(session_id, user_message)
+            return [{} for _ in mensagens]
+
+        logger.warning("[DEBUG-VIEW] Chamando o aprocessar_mensagem_bot...")
+        if memoria_obj.state in ESTADOS_SEM_AGRUPAMENTO:
+            respostas = []
+            for user_message in mensagens:
+                # Reaproveita a sessão já carregada (evita uma segunda leitura)
+                resultado = await aprocessar_mensagem_bot(session_id, user_message, sessao)
+                respostas.append({"response_message": resultado.get("response_message")})
+            return respostas
+
+        if len(mensagens) > 1:
+            logger.warning(f"[DEBUG-VIEW] {len(mensagens)} mensagens da sessão {session_id} agrupadas em uma.")
+        resultado = await aprocessar_mensagem_bot(session_id, SEPARADOR_MENSAGENS.join(mensagens), sessao)
         logger.warning(f"[DEBUG-VIEW] Resultado recebido do bot_logic: {resultado}")
-        
+        return sem_resposta + [{"response_message": resultado.get("response_message")}]
+
+
+@csrf_exempt
+@require_POST
+async def chatbot_orchestrator(request):
+    """
+    Orquestrador assíncrono: sob ASGI (core/asgi.py) nenhuma thread fica
+    presa esperando o Gemini ou o Channel Layer, então um único processo
+    segura centenas de conversas em andamento. O ORM síncrono que sobra
+    roda via executar_no_banco (poucas conexões, liberadas a cada trecho), e
+    a conversa é lida e gravada uma vez por lote (sessao_conversa).
+
+    As mensagens passam pela fila da sessão (fila_sessao): uma rajada
+    ("oi", "quero marcar", "cardiologia") vira uma chamada só ao bot. No
+    meio de um fluxo não há espera: a resposta à pergunta segue na hora.
+    """
+    logger.warning("="*20 + " NOVA REQUISIÇÃO " + "="*20)
+    try:
+        logger.warning("[DEBUG-VIEW] Orquestrador iniciado.")
+        data = json.loads(request.body)
+        user_message = data.get("message")
+        session_id = data.get("sessionId")
+        logger.warning(f"[DEBUG-VIEW] Dados recebidos: message='{user_message[:50]}...', sessionId='{session_id}'")
+
+
+        if not user_message or not session_id:
+            logger.error("[DEBUG-VIEW] Erro: message ou sessionId ausentes.")
+            return JsonResponse({"error": "message e sessionId são obrigatórios."}, status=400)
+
+        memoria_obj = await estado_sessao.aobter(session_id)
+        janela = 0 if memoria_obj.state in ESTADOS_SEM_AGRUPAMENTO else None
+        resposta = await fila_sessao.enviar(session_id, user_message, _processar_lote, janela)
+
         logger.warning("[DEBUG-VIEW] Enviando JsonResponse de volta para o N8N.")
-        return JsonResponse({"response_message": resultado.get("response_message")})
+        return JsonResponse(resposta)
 
+    except sessao_conversa.SessaoOcupada:
+        # Outra mensagem da sessão ainda está em andamento: quem chamou reenvia
+        return JsonResponse(
+            {"error": "Conversa ocupada com outra mensagem. Tente novamente."},
+            status=503, headers={"Retry-After": "5"},
+        )
     except Exception as e:
         logger.error(f"[DEBUG-VIEW] ERRO CRÍTICO no orquestrador: {e}", exc_info=True)
         return JsonResponse({"error": "Ocorreu um erro interno."}, status=500)
@@ -6,6 +6,8 @@ from django.core.asgi import get_asgi_application
 # 1. Inicializa o Django PRIMEIRO.
 # Esta linha efetivamente chama django.setup() e carrega os apps.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Processo web: o ChatbotConfig.ready() já deixa as chains de IA montadas
+os.environ.setdefault('CHATBOT_AQUECER_CHAINS', '1')
 django_asgi_app = get_asgi_application()
 
 # 2. AGORA que o Django está pronto, podemos importar
@@ -118,7 +118,12 @@ TEMPLATES = [
 DATABASES = {
     'default': dj_database_url.config(
         default=f'sqlite:///{BASE_DIR / "db.sqlite3"}',
-        conn_max_age=600
+        # Sob ASGI (daphne) cada requisição roda em sua própria thread: conexões
+        # persistentes ficariam presas a threads descartadas e, nas conversas do
+        # chatbot, abertas durante toda a espera pelo Gemini. Por isso o padrão
+        # é fechar ao fim de cada bloco de ORM; use DB_CONN_MAX_AGE (ou um
+        # pooler como o PgBouncer) se precisar de conexões persistentes.
+        conn_max_age=int(os.environ.get('DB_CONN_MAX_AGE', 0))
     )
 }
 AUTH_USER_MODEL = 'usuarios.CustomUser'
@@ -186,4 +191,19 @@ else:
                 "hosts": [('127.0.0.1', 6379)],
             },
         },
-    }
\ No newline at end of file
+    }
+
+# Cache (mapas de ocupação das agendas, etc.)
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
@@ -12,5 +12,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Processo web: o ChatbotConfig.ready() já deixa as chains de IA montadas
+os.environ.setdefault('CHATBOT_AQUECER_CHAINS', '1')
 
 application = get_wsgi_application()
@@ -16,7 +16,7 @@ from datetime import datetime, time # <-- IMPORTAÇÃO CORRIGIDA
 from django.http import HttpResponse
 
 # --- 1. LIMPEZA E CORREÇÃO DAS IMPORTAÇÕES ---
-from agendamentos.serializers import AgendamentoSerializer
+from agendamentos.serializers import AgendamentoSerializer, preparar_listagem
 from agendamentos.models import Agendamento
 from usuarios.permissions import IsRecepcaoOrAdmin, IsAdminUser # Importamos IsAdminUser
 from .services import inter_service # Importa nosso serviço do Inter
@@ -183,13 +183,13 @@ class AgendamentosFaturaveisAPIView(generics.ListAPIView):
             return Agendamento.objects.none()
 
         # Filtra os agendamentos com base nos critérios
-        queryset = Agendamento.objects.filter(
+        queryset = preparar_listagem(Agendamento.objects.filter(
             plano_utilizado__convenio__id=convenio_id,
             data_hora_inicio__month=mes,
             data_hora_inicio__year=ano,
             tipo_atendimento='Convenio',
             guia_tiss__isnull=True  # O filtro mágico: apenas os que ainda não têm guia!
-        ).select_related('paciente', 'plano_utilizado').order_by('data_hora_inicio')
+        )).order_by('data_hora_inicio')
 
         return queryset
 